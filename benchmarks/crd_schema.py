@@ -0,0 +1,57 @@
+"""Scaling benchmark for the CRD schema generation.
+
+Generates resource classes with a spec made of a chain of `depth` nested
+models, each referencing the next one and a model of its own, and times
+as_crd for growing depths. The time per model should stay roughly
+constant.
+
+Note that kubernetes needs every reference inlined, so models that are
+referenced more than once multiply the size of the resulting CRD.
+
+With pydantic v2 the schema generation of pydantic itself recurses per
+nesting level and runs into python's recursion limit at depths of around
+50, so use smaller depths there.
+
+    python benchmarks/crd_schema.py [depth ...]
+"""
+import json
+import sys
+import time
+import typing
+
+from pydantic import Field, create_model
+
+import kopf_resources
+from kopf_resources import Resource, Spec
+
+
+
+def make_resource(depth):
+    model = create_model('Leaf0', value=(str, Field(description='A leaf value.')))
+    for i in range(1, depth):
+        leaf = create_model(f'Leaf{i}', value=(str, ...), values=(typing.List[str], ...))
+        model = create_model(f'Node{i}',
+            name=(str, ...),
+            child=(model, Field(description='Referenced through allOf.')),
+            leaves=(typing.List[leaf], Field(default_factory=list)),
+        )
+    spec = create_model(f'BenchSpec{depth}', __base__=Spec, root=(model, ...))
+    return type(f'Bench{depth}', (Resource,), {'__annotations__': {'spec': spec}},
+        group='bench.example.com', version='v1', kind=f'Bench{depth}')
+
+
+
+def main(depths):
+    print(f'{"depth":>6} {"seconds":>10} {"us/model":>10} {"bytes":>12}')
+    for depth in depths:
+        resource_class = make_resource(depth)
+        start = time.perf_counter()
+        crd = kopf_resources.as_crd(resource_class)
+        elapsed = time.perf_counter() - start
+        size = len(json.dumps(crd))
+        print(f'{depth:>6} {elapsed:>10.4f} {elapsed / depth * 1e6:>10.1f} {size:>12}')
+
+
+
+if __name__ == '__main__':
+    main([int(a) for a in sys.argv[1:]] or [10, 50, 100, 200])
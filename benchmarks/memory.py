@@ -0,0 +1,126 @@
+"""Memory retained per object by cached and indexed resources.
+
+Parses HostCertificates of the example with realistic metadata, as kopf
+gets them: decoded from json, so equal strings are distinct objects. The
+bodies are dropped afterwards and the memory still held, measured with
+tracemalloc, is reported per object:
+
+    validated, trusted, lazy: models as kept in the model cache
+    projection: CompactIndex projections including the labels
+    resource_index: models looked up through a ResourceIndex of raw bodies,
+        the bodies are kept as kopf's index keeps them
+
+    python benchmarks/memory.py [--count 10000]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example'))
+
+import kopf_resources
+from kopf_resources import replay
+
+from resources import HostCertificate
+
+
+
+def payload(count, namespaces=10):
+    """Return the json of count HostCertificates spread over a few
+    namespaces, with labels, annotations, a finalizer and an owner.
+    """
+    bodies = []
+    for i, body in enumerate(replay.synthesize(HostCertificate, count)):
+        metadata = body['metadata']
+        metadata['namespace'] = f'team-{i % namespaces}'
+        metadata['labels'] = {
+            'app.kubernetes.io/name': 'ssh',
+            'app.kubernetes.io/managed-by': 'ssh-cert-manager',
+            'host': f'host-{i}',
+        }
+        metadata['annotations'] = {'ssh-cert-manager.io/rotated': 'true'} if i % 2 else {}
+        metadata['finalizers'] = ['ssh-cert-manager.io/cleanup']
+        metadata['ownerReferences'] = [{
+            'apiVersion': 'apps/v1', 'kind': 'Deployment', 'name': f'host-{i}',
+            'uid': f'00000000-0000-0000-0000-{i:012d}', 'controller': True,
+        }]
+        bodies.append(body)
+    return json.dumps(bodies)
+
+
+
+def measure(data, keep):
+    """Return the bytes per object that keep(bodies) holds on to after the
+    bodies were dropped.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        # The bodies are allocated after tracemalloc started, so whatever
+        # is still referenced of them is accounted for as well.
+        bodies = json.loads(data)
+        count = len(bodies)
+        kept = keep(bodies)
+        del bodies
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    del kept
+    return retained / count
+
+
+
+def keep_models(**kwargs):
+    return lambda bodies: [kopf_resources.from_dict(b, cache=False, **kwargs) for b in bodies]
+
+
+
+def keep_projections(bodies):
+    index = kopf_resources.CompactIndex('certificates',
+        fields=('metadata.labels', 'spec.issuerRef.name', 'spec.secretName'))
+    fake = replay.FakeIndex()
+    for body in bodies:
+        fake.replace(body['metadata']['uid'], asyncio.run(index.handler(body)))
+    return fake
+
+
+
+def keep_resource_index(bodies):
+    fake = replay.FakeIndex()
+    for body in bodies:
+        metadata = body['metadata']
+        fake.replace(metadata['uid'], {(metadata['namespace'], metadata['name']): body})
+    index = kopf_resources.ResourceIndex[HostCertificate](fake)
+    return fake, [model for key in index for model in index[key]]
+
+
+
+BENCHMARKS = {
+    'validated': keep_models(),
+    'trusted': keep_models(trusted=True),
+    'lazy': keep_models(lazy=True),
+    'projection': keep_projections,
+    'resource_index': keep_resource_index,
+}
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=10000)
+    args = parser.parse_args()
+
+    data = payload(args.count)
+    print(f'{"benchmark":<16} {"bytes/object":>14}')
+    for name, keep in BENCHMARKS.items():
+        print(f'{name:<16} {measure(data, keep):>14.0f}')
+
+
+
+if __name__ == '__main__':
+    main()
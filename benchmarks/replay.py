@@ -0,0 +1,221 @@
+"""Throughput, latency and allocation benchmarks of the hot paths.
+
+Uses the models of the example as reference workload, with handlers like
+those in example/handlers.py, and synthetic bodies generated from their
+schemas, see kopf_resources.replay.
+
+Benchmarks:
+    from_dict_validated, from_dict_trusted, from_dict_lazy, from_dict_cached
+    wrapper: a sync handler called through the decorator wrapper
+    replay: create/update/delete events through the FakeDispatcher, per event
+    as_crd, as_crd_cold: with and without the CRD memo
+    to_yaml: all CRDs
+
+Reports ops/s, latency percentiles and the peak of the memory allocated
+per op. Results can be saved as baseline and later compared against it,
+the script then exits with 1 if any benchmark got slower or allocates
+more than the tolerance allows. Baselines only make sense on the same
+machine, so none is checked in.
+
+    python benchmarks/replay.py [--count 100] [--number 2000] [--save baseline.json]
+    python benchmarks/replay.py --compare baseline.json [--tolerance 0.2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import kopf
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example'))
+
+import kopf_resources
+from kopf_resources import replay
+from kopf_resources.crd import clear_crd_cache
+
+from resources import Issuer, ClusterIssuer, HostCertificate
+
+
+
+registrations = replay.record()
+
+issuers_index = kopf_resources.CompactIndex('issuers',
+    fields=('spec.path', 'spec.server', 'spec.role'))
+Issuer.index(issuers_index)
+ClusterIssuer.index(issuers_index)
+
+
+@HostCertificate.on.create
+@HostCertificate.on.resume
+@HostCertificate.on.update
+async def reconcile_host_certificate(body: HostCertificate, namespace,
+        issuers: kopf_resources.ResourceIndex[Issuer, ClusterIssuer], patch, **_):
+    issuer_ref = body.spec.issuerRef
+    issuer = issuers.lookup(namespace, issuer_ref.name, kind=issuer_ref.kind)
+    if issuer is None:
+        raise kopf.TemporaryError('Issuer not found in cache.', delay=10)
+    patch['status'] = {'server': issuer.spec.server, 'principals': len(body.spec.principals)}
+
+
+@HostCertificate.on.delete
+def delete_host_certificate(body: HostCertificate, **_):
+    return body.metadata.name
+
+
+
+def workload(count, **kwargs):
+    """Return the bodies of the reference workload: an Issuer and a
+    ClusterIssuer per ten HostCertificates, which reference them.
+    """
+    issuers = count // 10 + 1
+    bodies = list(replay.synthesize(Issuer, issuers, **kwargs))
+    bodies.extend(replay.synthesize(ClusterIssuer, issuers, **kwargs))
+    for i, body in enumerate(replay.synthesize(HostCertificate, count, **kwargs)):
+        kind = 'ClusterIssuer' if i % 2 else 'Issuer'
+        body['spec']['issuerRef'] = {'name': f'{kind.lower()}-{i % issuers}', 'kind': kind}
+        bodies.append(body)
+    return bodies
+
+
+
+def benchmarks(bodies, events):
+    """Return a dict of name -> (op, args of the ops).
+    """
+    certificates = [b for b in bodies if b['kind'] == 'HostCertificate']
+    wrapper = next(r.func for r in registrations
+        if r.name == 'delete' and r.func.__name__ == 'delete_host_certificate')
+    crds = kopf_resources.all_crds()
+
+    def from_dict(**kwargs):
+        return lambda body: kopf_resources.from_dict(body, **kwargs)
+
+    def as_crd_cold(resource_class):
+        clear_crd_cache()
+        return kopf_resources.as_crd(resource_class)
+
+    dispatcher = replay.FakeDispatcher()
+    loop = asyncio.new_event_loop()
+    def dispatch(event):
+        loop.run_until_complete(dispatcher.dispatch(event))
+
+    return {
+        'from_dict_validated': (from_dict(cache=False), certificates),
+        'from_dict_trusted': (from_dict(cache=False, trusted=True), certificates),
+        'from_dict_lazy': (from_dict(cache=False, lazy=True), certificates),
+        'from_dict_cached': (from_dict(cache=True), certificates),
+        'wrapper': (lambda body: wrapper(body=body), certificates),
+        'replay': (dispatch, events),
+        'as_crd': (kopf_resources.as_crd, [HostCertificate]),
+        'as_crd_cold': (as_crd_cold, [HostCertificate]),
+        'to_yaml': (lambda crds: kopf_resources.to_yaml(*crds), [crds]),
+    }
+
+
+
+def run(op, args, number):
+    """Call op number times, cycling through args. Return the latencies.
+    """
+    latencies = []
+    timer = time.perf_counter
+    for i in range(number):
+        arg = args[i % len(args)]
+        start = timer()
+        op(arg)
+        latencies.append(timer() - start)
+    return latencies
+
+
+
+def allocations(op, args, number):
+    """Return the mean peak of memory allocated per op in bytes.
+    """
+    tracemalloc.start()
+    try:
+        total = 0
+        for i in range(number):
+            arg = args[i % len(args)]
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            op(arg)
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return total / number
+
+
+
+def measure(name, op, args, number):
+    # Warm up caches, e.g. the model cache and the CRD memo.
+    run(op, args, min(number, len(args)))
+    latencies = run(op, args, number)
+    points = replay.percentiles(latencies)
+    return {
+        'ops_per_second': number / sum(latencies),
+        'p50_us': points[50] * 1e6,
+        'p90_us': points[90] * 1e6,
+        'p99_us': points[99] * 1e6,
+        'alloc_peak_bytes': allocations(op, args, max(1, number // 10)),
+    }
+
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions against the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if result['ops_per_second'] < base['ops_per_second'] * (1 - tolerance):
+            regressions.append(f'{name}: {result["ops_per_second"]:.0f} ops/s, baseline {base["ops_per_second"]:.0f}')
+        if result['alloc_peak_bytes'] > base['alloc_peak_bytes'] * (1 + tolerance):
+            regressions.append(f'{name}: {result["alloc_peak_bytes"]:.0f} bytes/op, baseline {base["alloc_peak_bytes"]:.0f}')
+    return regressions
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=100, help='number of HostCertificates')
+    parser.add_argument('--list-length', type=int, default=2)
+    parser.add_argument('--string-length', type=int, default=12)
+    parser.add_argument('--updates', type=int, default=2, help='updates per object in the replay')
+    parser.add_argument('--number', type=int, default=2000, help='ops per benchmark')
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--save', metavar='FILE', help='save the results as baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare against a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    bodies = workload(args.count, list_length=args.list_length, string_length=args.string_length)
+    events = replay.synthetic_events(bodies, updates=args.updates, keep=('issuerRef',),
+        list_length=args.list_length, string_length=args.string_length)
+
+    results = {}
+    print(f'{"benchmark":<20} {"ops/s":>10} {"p50 us":>9} {"p90 us":>9} {"p99 us":>9} {"bytes/op":>10}')
+    for name, (op, op_args) in benchmarks(bodies, events).items():
+        if args.only and name not in args.only:
+            continue
+        result = results[name] = measure(name, op, op_args, args.number)
+        print(f'{name:<20} {result["ops_per_second"]:>10.0f} {result["p50_us"]:>9.1f} '
+            f'{result["p90_us"]:>9.1f} {result["p99_us"]:>9.1f} {result["alloc_peak_bytes"]:>10.0f}')
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+
+
+
+if __name__ == '__main__':
+    main()
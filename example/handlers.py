@@ -28,18 +28,18 @@ async def startup(**_):
 
 # We use kopf to populate a index of issuers so we don't have to call out to
 # the api server to fetch the issuer for every HostCertificate that is created.
-@Issuer.index(id='issuers')
-@ClusterIssuer.index(id='issuers')
-async def cache_issuers(namespace, name, body, **_):
-    issuer = kopf_resources.from_dict(body)
-    return {(namespace, name): issuer}
+# Only the fields we need are stored instead of whole Issuer models.
+issuers_index = kopf_resources.CompactIndex('issuers',
+    fields=('spec.path', 'spec.server', 'spec.role'))
+Issuer.index(issuers_index)
+ClusterIssuer.index(issuers_index)
 
 
 @HostCertificate.on.create
 @HostCertificate.on.resume
 @HostCertificate.on.update
 async def create_host_certificate(name, namespace, body,
-    issuers: kopf.Index,
+    issuers: kopf_resources.ResourceIndex[Issuer, ClusterIssuer],
     retry, **_):
 
     log.info('create_host_certificate: %s/%s %s', namespace, name, retry)
@@ -49,20 +49,16 @@ async def create_host_certificate(name, namespace, body,
 
     assert type(certificate) == HostCertificate
 
-    group,version = certificate.apiVersion.split('/')
     issuer_name = certificate.spec.issuerRef.name
     issuer_kind = certificate.spec.issuerRef.kind
-    issuer_namespace = None
-    if issuer_kind == 'Issuer':
-        issuer_namespace = namespace
     print('     issuer_kind: %s' % issuer_kind)
 
-    try:
-        # Get the requested issuer from the 'issuers' index.
-        issuer, *_ = issuers[(issuer_namespace, issuer_name)]
-    except KeyError as e:
+    # Get the requested issuer from the 'issuers' index. The Issuer is looked
+    # up in our namespace, the ClusterIssuer cluster wide.
+    issuer = issuers.lookup(namespace, issuer_name, kind=issuer_kind)
+    if issuer is None:
         if retry < 5:
-            raise kopf.TemporaryError('Issuer not found in cache.', delay=10) from e
+            raise kopf.TemporaryError('Issuer not found in cache.', delay=10)
         else:
             raise kopf.PermanentError(f'Issuer not found in cache after {retry} tries. Giving up.')
 
@@ -1,7 +1,8 @@
-import yaml
+import sys
 
-from pydantic import BaseModel, Field
-from pydantic.typing import Any, Dict, Literal, List, Mapping, Type
+from typing import Any, Dict, Literal, List, Mapping, Type
+
+from kopf_resources.backends import BaseModel, Field
 
 
 import kopf_resources
@@ -74,7 +75,7 @@ class HostCertificateV1alpha2(Resource, kind='HostCertificate', group='ssh-cert-
 
 def print_crds():
     crds = kopf_resources.all_crds()
-    print(yaml.dump_all(crds, sort_keys=False))
+    kopf_resources.to_yaml(*crds, stream=sys.stdout)
 
 
 
@@ -1,5 +1,57 @@
+import json
+
 import yaml
 
+from .cache import (
+    ModelCache,
+    default_cache,
+)
+
+from .conversion import (
+    converter,
+    ConversionNotFoundError,
+    ConversionRegistry,
+    ConversionWebhookServer,
+    webhook_conversion,
+)
+
+from .crd import (
+    as_crd,
+    all_crds,
+    changed_crds,
+    clear_crd_cache,
+    content_hash,
+    crd_size,
+    CRDSizeError,
+    CRDSizeWarning,
+    crd_fingerprint,
+    crd_fingerprints,
+    ETCD_REQUEST_LIMIT,
+    RecursiveSchemaError,
+    version_fingerprints,
+)
+
+from .index import (
+    CompactIndex,
+    Projection,
+    ResourceIndex,
+)
+
+from .lazy import (
+    LazyResource,
+    parse_lazy,
+)
+
+from .parsing import (
+    construct,
+    parse,
+    parse_cached,
+)
+
+from .patch import (
+    merge_patch,
+    StatusTracker,
+)
 
 from .registry import (
     ResourceRegistry,
@@ -12,185 +64,108 @@ from .resources import (
     Status,
 )
 
+from .sharding import (
+    assign_shard_labels,
+    ShardConfig,
+    shard_labels,
+    shard_of,
+    SHARD_LABEL,
+)
+
+from .stream import (
+    ItemError,
+    iter_documents,
+    iter_from_stream,
+    StreamFormatError,
+)
+
+
 
+def from_dict(body, cache=False, trusted=None, lazy=False):
+    """Parse the given body dict into a new resource instance.
 
-def from_dict(body):
-    """Parse the given body dict into a resource instance.
+    With cache=True the model is shared through the default ModelCache by
+    uid and resourceVersion, like the models the decorators pass to
+    handlers. Shared models must not be modified.
+
+    If trusted is true the model is built without validation, see
+    parsing.construct. If it is None the resource classes `trusted`
+    setting is used. Use trusted=False for untrusted input, e.g. in
+    admission webhooks.
+
+    If lazy is true a LazyResource is returned which only parses the
+    fields that are actually accessed.
     """
     resource_class = ResourceRegistry.get(body['apiVersion'], body['kind'])
-    return resource_class.parse_obj(body)
+    if lazy:
+        lazy_class = LazyResource[resource_class]
+        if cache:
+            return parse_cached(lazy_class, body, trusted=trusted, parser=parse_lazy)
+        return parse_lazy(lazy_class, body, trusted=trusted)
+    if cache:
+        return parse_cached(resource_class, body, trusted=trusted)
+    return parse(resource_class, body, trusted=trusted)
+
+
 
+# Use the libyaml based C emitter if available, it is a lot faster.
+_SafeDumper = getattr(yaml, 'CSafeDumper', yaml.SafeDumper)
 
 
-class NoAliasDumper(yaml.SafeDumper):
+
+class NoAliasDumper(_SafeDumper):
     def ignore_aliases(self, data):
         return True
 
 
 
-def to_yaml(*crds):
+def to_yaml(*crds, stream=None):
     """Helper function to serialize one or more CRD's to a yaml document
     that kubernetes understands.
 
     We mainly have to prevent the yaml Dumper from using any alias references
     as kubernetes does not understand those.
+
+    If a file like stream is given the yaml is written to it instead of
+    being returned as string.
     """
-    return yaml.dump_all(crds, sort_keys=False, Dumper=NoAliasDumper)
+    return yaml.dump_all(crds, stream=stream, sort_keys=False, Dumper=NoAliasDumper)
 
 
 
-def as_crd(resource_class):
-    """Create and return a CustomResourceDefinition for the given resource class.
+def iter_yaml(*crds):
+    """Like to_yaml but yield the yaml documents one by one, e.g. to
+    stream them to a file or pipe without building one huge string.
     """
-    spec = resource_class.__spec__.copy()
-    group = spec['group']
-    plural_name = spec['names']['plural']
-    body = {
-        'apiVersion': 'apiextensions.k8s.io/v1',
-        'kind': 'CustomResourceDefinition',
-        'metadata': {'name': resource_class.__fqname__},
-        'spec': spec,
-    }
-
-    for version, resource_class in ResourceRegistry.iter_versions(resource_class):
-        schema = resource_class.schema()
-        if 'definitions' in schema:
-            definitions = schema.pop('definitions')
-            # First dereference any nested definitions.
-            # This is just a performance optimisation so we only dereference
-            # each models once instead of repeating that for each reference.
-            _dereference_schema(definitions, definitions)
-            # Then dereference the actual schema.
-            _dereference_schema(schema, definitions)
-            # Then cleanup the schema into something that kubernetes agrees with.
-            _clean_schema(schema)
-
-        _version = {
-            'name': version,
-            'schema': {'openAPIV3Schema': schema},
-            'served': resource_class.__served__,
-            'storage': resource_class.__storage__,
-        }
-
-        if resource_class.__status_subresource__:
-            _version.setdefault('subresources', {})
-            _version['subresources']['status'] = {}
-            # Seen this in some kubebuilder generated CRDs.
-            # Not sure it is needed.
-            #body['status'] = {
-            #    'acceptedNames': {
-            #      'kind': '',
-            #      'plural': '',
-            #    },
-            #    'conditions': [],
-            #    'storedVersions': [],
-            #}
-
-        body['spec']['versions'].append(_version)
-
-    return body
-
-
-
-def all_crds(include_private=False):
-    """Create and return CustomResourceDefinition's for all known and loaded resource classes.
-    """
-    crds = {}
-    for resource_class in ResourceRegistry.iter_resources():
-        #print(f'resource_class: {resource_class}')
-        if include_private or not resource_class.__name__.startswith('_'):
-            if not resource_class.__fqname__ in crds:
-                crds[resource_class.__fqname__] = as_crd(resource_class)
-    return crds.values()
+    for index, crd in enumerate(crds):
+        yield yaml.dump(crd, sort_keys=False, Dumper=NoAliasDumper,
+            explicit_start=index > 0)
+
 
 
+def to_json(*crds, stream=None, indent=None, as_list=True):
+    """Serialize one or more CRD's to json.
 
-def _dereference_schema(schema, definitions, parent=None, key=None):
-    """Find and dereference objects in the given schema.
+    The CRDs are wrapped in a kubernetes List object, regardless of how
+    many there are. With as_list=False a single CRD is serialized as is.
 
-    '#/definitions/myElement' -> schema[definitions][myElement]
+    If a file like stream is given the json is written to it instead of
+    being returned as string.
     """
-    if hasattr(schema, 'items'):
-        for k, v in schema.items():
-            if k == '$ref':
-                #print(f'{type(parent)} {key}: {k} -> {v}')
-                ref_name = v.rpartition('/')[-1]
-                definition = definitions[ref_name]
-                if isinstance(parent, dict):
-                    parent[key] = definition
-                elif isinstance(parent, list):
-                    parent[parent.index(key)] = definition
-                v = definition
-            if isinstance(v, dict):
-                _dereference_schema(v, definitions, parent=schema, key=k)
-            elif isinstance(v, list):
-                for i,d in enumerate(v):
-                    _dereference_schema(d, definitions, parent=v, key=d)
-            #else:
-            #    print(f'unhandled k: {k}; v: {v}; %s' % type(v))
-
-
-
-def _clean_schema(schema):
-    """Clean the schema for use with kubernetes.
-
-    Pydantic uses allOf to preserve some fields like title and description
-    that would otherwise be overwritten by nested models.
-    Kubernetes does not like that so we work around that by merging
-    the nested models properties.
-
-    We basically turn this:
-
-    ```
-    {
-       'tokenSecretRef': {
-          'title': 'Tokensecretref',
-          'description': 'Some interesting field description.',
-          'allOf': [{
-             'title': 'SecretRef',
-             'description': 'Some model docstring.',
-             'type': 'object',
-             'properties': {
-                'name': {'title': 'Name', 'type': 'string'}, 'key': {'title': 'Key', 'type': 'string'}
-             },
-             'required': ['name']
-          }]
-       }
-    }
-    ```
-
-    into this:
-
-    ```
-    {
-       'tokenSecretRef': {
-          'title': 'Tokensecretref',
-          'description': 'Some interesting field description.',
-          'type': 'object',
-          'properties': {
-             'name': {'title': 'Name', 'type': 'string'}, 'key': {'title': 'Key', 'type': 'string'}
-          },
-          required': ['name']
-       }
-    }
-    ```
+    if stream is None:
+        return ''.join(iter_json(*crds, indent=indent, as_list=as_list))
+    for chunk in iter_json(*crds, indent=indent, as_list=as_list):
+        stream.write(chunk)
+
+
+
+def iter_json(*crds, indent=None, as_list=True):
+    """Like to_json but yield the json in chunks.
     """
-    #print(f'### _clean_schema: {schema}')
-    if hasattr(schema, 'items'):
-        if 'allOf' in schema:
-            #print(f'### _clean_schema allOf detected: {schema}')
-            value = schema['allOf']
-            #print(f'### _clean_schema value: {value}')
-            if len(value) == 1:
-                child = value[0]
-                for k,v in child.items():
-                    schema.setdefault(k, v)
-                schema.pop('allOf')
-            _clean_schema(schema)
-        else:
-            if isinstance(schema, dict):
-                for k,v in schema.items():
-                    _clean_schema(v)
-            elif isinstance(schema, list):
-                for i,d in enumerate(schema):
-                    _clean_schema(d)
+    if as_list:
+        data = {'apiVersion': 'v1', 'kind': 'List', 'items': list(crds)}
+    elif len(crds) == 1:
+        data = crds[0]
+    else:
+        raise ValueError(f'as_list=False needs exactly one CRD, got {len(crds)}.')
+    return json.JSONEncoder(indent=indent).iterencode(data)
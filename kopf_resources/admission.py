@@ -0,0 +1,244 @@
+"""Validating and defaulting admission for resource classes.
+
+Uses kopf's admission webhooks, so kopf has to be configured with an
+admission server, e.g. in a startup handler:
+```
+    settings.admission.server = kopf.WebhookServer(port=9443)
+    settings.admission.managed = 'ssh-cert-manager.io'
+```
+
+Then register the resource classes that should be checked:
+```
+    kopf_resources.admission.register(Issuer, ClusterIssuer, HostCertificate,
+        timeout=1.0, concurrency=32)
+```
+Objects that fail validation are rejected with the validation errors as
+message. Defaults of the model are added to objects with a JSON patch.
+"""
+import asyncio
+import collections
+import collections.abc
+import threading
+import time
+
+import kopf
+
+from . import metrics as _metrics
+from .backends import backend
+from .parsing import parse
+
+
+
+class AdmissionMetrics():
+    """Per kind timing metrics of the admission handlers.
+    """
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__stats = collections.defaultdict(lambda: {
+            'count': 0,
+            'rejected': 0,
+            'timeouts': 0,
+            'seconds_total': 0.0,
+            'seconds_max': 0.0,
+        })
+
+
+    def observe(self, key, seconds, rejected=False, timeout=False):
+        with self.__lock:
+            stats = self.__stats[key]
+            stats['count'] += 1
+            stats['rejected'] += int(rejected)
+            stats['timeouts'] += int(timeout)
+            stats['seconds_total'] += seconds
+            stats['seconds_max'] = max(stats['seconds_max'], seconds)
+
+
+    def snapshot(self):
+        """Return a dict of (apiVersion, kind, operation) -> stats dict.
+        """
+        with self.__lock:
+            return {k: dict(v) for k,v in self.__stats.items()}
+
+
+    def clear(self):
+        with self.__lock:
+            self.__stats.clear()
+
+
+
+metrics = AdmissionMetrics()
+
+
+
+def validate(resource_class, body):
+    """Strictly validate body against resource_class and return the model.
+
+    Raises a pydantic ValidationError if the body is not valid.
+    """
+    return parse(resource_class, body, trusted=False)
+
+
+
+def defaults_patch(resource_class, body, model=None):
+    """Return a merge patch that adds the defaults of the resource_class
+    model which are missing in body.
+
+    metadata is left alone and None defaults are skipped as None means
+    delete in merge patches.
+    """
+    if model is None:
+        model = validate(resource_class, body)
+    data = backend.dump(model, by_alias=True, exclude={'metadata'})
+    return _additions(body, data)
+
+
+
+def defaults_json_patch(resource_class, body, model=None):
+    """Like defaults_patch but return a list of JSON patch operations.
+    """
+    patch = defaults_patch(resource_class, body, model)
+    return list(_json_patch_ops(body, patch))
+
+
+
+def _additions(current, data):
+    patch = {}
+    for key, value in data.items():
+        if value is None:
+            continue
+        if key not in current:
+            patch[key] = value
+        elif isinstance(value, dict) and isinstance(current[key], collections.abc.Mapping):
+            nested = _additions(current[key], value)
+            if nested:
+                patch[key] = nested
+    return patch
+
+
+
+def _json_patch_ops(current, patch, path=''):
+    for key, value in patch.items():
+        pointer = f'{path}/{_escape(key)}'
+        if key in current:
+            # Only nested additions end up here.
+            yield from _json_patch_ops(current[key], value, pointer)
+        else:
+            yield {'op': 'add', 'path': pointer, 'value': value}
+
+
+
+def _escape(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+
+def _key(resource_class, operation):
+    return (resource_class.__api_version__, resource_class.__kind__, operation)
+
+
+
+class _Limiter():
+    """Concurrency limit and timeout for the admission handlers of one
+    resource class.
+    """
+
+    def __init__(self, timeout=None, concurrency=None, executor=None):
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.executor = executor
+        self.__semaphore = None
+
+
+    async def run(self, func, *args):
+        if self.concurrency and self.__semaphore is None:
+            # Created lazily so it is bound to kopf's event loop.
+            self.__semaphore = asyncio.Semaphore(self.concurrency)
+        if self.__semaphore is None:
+            return await self.__run(func, *args)
+        async with self.__semaphore:
+            return await self.__run(func, *args)
+
+
+    async def __run(self, func, *args):
+        if self.executor is None and self.timeout is None:
+            return func(*args)
+        loop = asyncio.get_running_loop()
+        # Run in an executor so a slow validation can not block the event
+        # loop and the timeout can actually fire.
+        future = loop.run_in_executor(self.executor, func, *args)
+        return await asyncio.wait_for(future, self.timeout)
+
+
+
+def _check(resource_class, body):
+    model = validate(resource_class, body)
+    return model, defaults_patch(resource_class, body, model)
+
+
+
+def register(*resource_classes, validate=True, mutate=True, timeout=None,
+        concurrency=None, executor=None, operations=('CREATE', 'UPDATE'), **kwargs):
+    """Register validating and/or mutating admission handlers for the given
+    resource classes.
+
+    timeout: reject requests that take longer than this many seconds.
+    concurrency: maximum number of concurrent validations per class.
+    executor: validate in this executor instead of the default one. Only
+      used if timeout is set or an executor is given, otherwise validation
+      runs on the event loop.
+
+    Any other kwargs are passed on to kopf.on.validate and kopf.on.mutate.
+    """
+    for resource_class in resource_classes:
+        limiter = _Limiter(timeout=timeout, concurrency=concurrency, executor=executor)
+        if validate:
+            _register_validate(resource_class, limiter, operations, kwargs)
+        if mutate:
+            _register_mutate(resource_class, limiter, operations, kwargs)
+
+
+
+def _register_validate(resource_class, limiter, operations, kwargs):
+    key = _key(resource_class, 'validate')
+
+    @resource_class.on.validate(id=f'validate-{resource_class.__fqname__}',
+        operations=list(operations), **kwargs)
+    async def validate_resource(body, **_):
+        await _admit(key, limiter, validate, resource_class, body)
+
+
+
+def _register_mutate(resource_class, limiter, operations, kwargs):
+    key = _key(resource_class, 'mutate')
+
+    @resource_class.on.mutate(id=f'mutate-{resource_class.__fqname__}',
+        operations=list(operations), **kwargs)
+    async def default_resource(body, patch, **_):
+        model, defaults = await _admit(key, limiter, _check, resource_class, body)
+        patch.update(defaults)
+
+
+
+async def _admit(key, limiter, func, resource_class, body):
+    start = time.perf_counter()
+    rejected = timeout = False
+    try:
+        return await limiter.run(func, resource_class, body)
+    except asyncio.TimeoutError as e:
+        rejected = timeout = True
+        raise kopf.AdmissionError(f'Admission of {resource_class.__kind__} timed out.', code=503) from e
+    except ValueError as e:
+        # pydantic's ValidationError is a ValueError.
+        rejected = True
+        raise kopf.AdmissionError(str(e), code=422) from e
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe(key, seconds, rejected=rejected, timeout=timeout)
+        if _metrics.active:
+            api_version, kind, operation = key
+            labels = {'api_version': api_version, 'kind': kind, 'operation': operation}
+            _metrics.observe('kopf_resources_admission_seconds', labels, seconds)
+            if rejected:
+                _metrics.inc('kopf_resources_admission_rejected_total',
+                    dict(labels, reason='timeout' if timeout else 'invalid'))
@@ -0,0 +1,48 @@
+"""Model backends.
+
+All model library specific code, i.e. validating, building, dumping and
+copying models and generating their JSON schemas, goes through the backend
+module selected here:
+
+- pydantic_v2 if pydantic v2 is installed, using its compiled validators.
+- pydantic_v1 if pydantic v1 is installed.
+
+Set the KOPF_RESOURCES_BACKEND environment variable to `pydantic_v1` to use
+the `pydantic.v1` compatibility package of pydantic v2 instead. The resource
+models then have to be built on `pydantic.v1.BaseModel` as well.
+
+A backend module provides:
+
+    name: name of the backend
+    BaseModel, Field, ValidationError: of the model library
+    is_model(type_): whether type_ is a model class
+    aliases(model_class): dict of field name -> alias
+    parse(model_class, data): validate data and return a model instance
+    parse_field(model_class, name, data, trusted): parse a single field
+    construct(model_class, data): build a model recursively without validation
+    build(model_class, values, fields_set=None): build a model from already
+      parsed field values
+    schema(model_class): JSON schema in the layout of pydantic v1
+    dump(model, **kwargs): dump a model to a dict, kwargs as pydantic v1's dict()
+    copy(model, deep=False): copy a model
+"""
+import importlib
+import os
+
+import pydantic
+
+
+
+def _default_backend():
+    if pydantic.VERSION.startswith('1.'):
+        return 'pydantic_v1'
+    return 'pydantic_v2'
+
+
+
+backend = importlib.import_module(
+    f'.{os.environ.get("KOPF_RESOURCES_BACKEND") or _default_backend()}', __name__)
+
+BaseModel = backend.BaseModel
+Field = backend.Field
+ValidationError = backend.ValidationError
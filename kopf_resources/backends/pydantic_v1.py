@@ -0,0 +1,155 @@
+"""pydantic v1 model backend.
+
+Also works with the `pydantic.v1` compatibility package of pydantic v2,
+the models then have to be built on `pydantic.v1.BaseModel` as well.
+"""
+import collections.abc
+import functools
+import inspect
+
+import pydantic
+
+if pydantic.VERSION.startswith('1.'):
+    from pydantic import BaseModel, Field, ValidationError
+    from pydantic.error_wrappers import ErrorWrapper
+    from pydantic.errors import MissingError
+    from pydantic.fields import (
+        SHAPE_SINGLETON,
+        SHAPE_LIST,
+        SHAPE_SET,
+        SHAPE_FROZENSET,
+        SHAPE_SEQUENCE,
+        SHAPE_TUPLE_ELLIPSIS,
+        SHAPE_ITERABLE,
+        SHAPE_DICT,
+        SHAPE_DEFAULTDICT,
+        SHAPE_MAPPING,
+    )
+else:
+    from pydantic.v1 import BaseModel, Field, ValidationError
+    from pydantic.v1.error_wrappers import ErrorWrapper
+    from pydantic.v1.errors import MissingError
+    from pydantic.v1.fields import (
+        SHAPE_SINGLETON,
+        SHAPE_LIST,
+        SHAPE_SET,
+        SHAPE_FROZENSET,
+        SHAPE_SEQUENCE,
+        SHAPE_TUPLE_ELLIPSIS,
+        SHAPE_ITERABLE,
+        SHAPE_DICT,
+        SHAPE_DEFAULTDICT,
+        SHAPE_MAPPING,
+    )
+
+
+
+name = 'pydantic_v1'
+
+_SEQUENCE_SHAPES = {
+    SHAPE_LIST, SHAPE_SET, SHAPE_FROZENSET, SHAPE_SEQUENCE,
+    SHAPE_TUPLE_ELLIPSIS, SHAPE_ITERABLE,
+}
+_MAPPING_SHAPES = {SHAPE_DICT, SHAPE_DEFAULTDICT, SHAPE_MAPPING}
+
+
+
+def is_model(type_):
+    return inspect.isclass(type_) and issubclass(type_, BaseModel)
+
+
+
+@functools.lru_cache(maxsize=None)
+def aliases(model_class):
+    """Return a dict of field name -> alias of the given model class.
+    """
+    return {name: field.alias for name, field in model_class.__fields__.items()}
+
+
+
+def parse(model_class, data):
+    return model_class.parse_obj(data)
+
+
+
+def parse_field(model_class, name, data, trusted=False):
+    field = model_class.__fields__[name]
+    if field.alias in data:
+        value = data[field.alias]
+    elif name in data:
+        value = data[name]
+    elif field.required:
+        raise ValidationError([ErrorWrapper(MissingError(), loc=field.alias)], model_class)
+    else:
+        return field.get_default()
+    if trusted:
+        return _construct_value(field, value)
+    value, errors = field.validate(value, {}, loc=field.alias, cls=model_class)
+    if errors:
+        raise ValidationError([errors], model_class)
+    return value
+
+
+
+def construct(model_class, data):
+    values = {}
+    for name, field in model_class.__fields__.items():
+        if field.alias in data:
+            value = data[field.alias]
+        elif name in data:
+            value = data[name]
+        else:
+            # Let pydantic fill in the defaults.
+            continue
+        values[name] = _construct_value(field, value)
+    return build(model_class, values)
+
+
+
+def build(model_class, values, fields_set=None):
+    if fields_set is None:
+        fields_set = set(values)
+    return model_class.construct(_fields_set=fields_set, **values)
+
+
+
+def _construct_value(field, value):
+    """Build the value for the given field, recursing into nested models.
+    """
+    type_ = field.type_
+    if value is None or field.sub_fields and field.shape == SHAPE_SINGLETON:
+        # Nothing to build or a Union which we can not decide on without
+        # validation.
+        return value
+    if not is_model(type_):
+        return value
+    if field.shape == SHAPE_SINGLETON:
+        if isinstance(value, collections.abc.Mapping):
+            return construct(type_, value)
+    elif field.shape in _SEQUENCE_SHAPES:
+        return [_construct_item(type_, v) for v in value]
+    elif field.shape in _MAPPING_SHAPES:
+        return {k: _construct_item(type_, v) for k,v in value.items()}
+    return value
+
+
+
+def _construct_item(model_class, value):
+    if isinstance(value, collections.abc.Mapping):
+        return construct(model_class, value)
+    return value
+
+
+
+def schema(model_class):
+    return model_class.schema()
+
+
+
+def dump(model, **kwargs):
+    return model.dict(**kwargs)
+
+
+
+def copy(model, deep=False):
+    return model.copy(deep=deep)
@@ -0,0 +1,246 @@
+"""pydantic v2 model backend.
+
+Validates with the compiled pydantic-core validators of the model classes
+and normalizes the generated JSON schemas to the layout of pydantic v1, so
+the CRDs are the same with both backends.
+"""
+import collections.abc
+import functools
+import inspect
+import types
+import typing
+
+from typing_extensions import Annotated, get_args, get_origin
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from pydantic.json_schema import GenerateJsonSchema
+
+
+
+name = 'pydantic_v2'
+
+REF_TEMPLATE = '#/definitions/{model}'
+
+_SEQUENCE_TYPES = (list, tuple, set, frozenset, collections.abc.Sequence,
+    collections.abc.Set, collections.abc.Iterable)
+_MAPPING_TYPES = (dict, collections.abc.Mapping, collections.abc.MutableMapping)
+# `X | Y` unions are types.UnionType since python 3.10.
+_UNION_TYPES = (typing.Union, getattr(types, 'UnionType', typing.Union))
+
+# Keys that pydantic v1 puts first, in this order.
+_LEADING_KEYS = ('title', 'description', 'default',
+    'maxLength', 'minLength', 'pattern',
+    'exclusiveMinimum', 'exclusiveMaximum', 'minimum', 'maximum', 'multipleOf',
+    'minItems', 'maxItems')
+
+
+
+def is_model(type_):
+    return inspect.isclass(type_) and issubclass(type_, BaseModel)
+
+
+
+@functools.lru_cache(maxsize=None)
+def aliases(model_class):
+    """Return a dict of field name -> alias of the given model class.
+    """
+    return {name: field.alias or name for name, field in model_class.model_fields.items()}
+
+
+
+def parse(model_class, data):
+    # Call the compiled validator directly, model_validate only adds
+    # python overhead.
+    return model_class.__pydantic_validator__.validate_python(data)
+
+
+
+@functools.lru_cache(maxsize=None)
+def _field_adapter(model_class, name):
+    field = model_class.model_fields[name]
+    annotation = field.annotation
+    if field.metadata:
+        annotation = Annotated[(annotation, *field.metadata)]
+    return TypeAdapter(annotation)
+
+
+
+def parse_field(model_class, name, data, trusted=False):
+    field = model_class.model_fields[name]
+    alias = field.alias or name
+    if alias in data:
+        value = data[alias]
+    elif name in data:
+        value = data[name]
+    elif field.is_required():
+        raise ValidationError.from_exception_data(model_class.__name__,
+            [{'type': 'missing', 'loc': (alias,), 'input': data}])
+    else:
+        return field.get_default(call_default_factory=True)
+    if trusted:
+        return _construct_value(field.annotation, value)
+    try:
+        return _field_adapter(model_class, name).validate_python(value)
+    except ValidationError as e:
+        errors = []
+        for error in e.errors():
+            details = {'type': error['type'], 'loc': (alias, *error['loc']), 'input': error['input']}
+            if 'ctx' in error:
+                details['ctx'] = error['ctx']
+            errors.append(details)
+        raise ValidationError.from_exception_data(model_class.__name__, errors) from None
+
+
+
+def construct(model_class, data):
+    values = {}
+    for name, field in model_class.model_fields.items():
+        alias = field.alias or name
+        if alias in data:
+            value = data[alias]
+        elif name in data:
+            value = data[name]
+        else:
+            # Let pydantic fill in the defaults.
+            continue
+        values[name] = _construct_value(field.annotation, value)
+    return build(model_class, values)
+
+
+
+def build(model_class, values, fields_set=None):
+    if fields_set is None:
+        fields_set = set(values)
+    return model_class.model_construct(_fields_set=fields_set, **values)
+
+
+
+def _construct_value(annotation, value):
+    """Build the value for the given type annotation, recursing into nested
+    models.
+    """
+    if value is None:
+        return value
+    origin = get_origin(annotation)
+    if origin is None:
+        if is_model(annotation) and isinstance(value, collections.abc.Mapping):
+            return construct(annotation, value)
+        return value
+    args = get_args(annotation)
+    if origin is Annotated:
+        return _construct_value(args[0], value)
+    if origin in _UNION_TYPES:
+        args = [a for a in args if a is not type(None)]
+        if len(args) == 1:
+            return _construct_value(args[0], value)
+        # A Union which we can not decide on without validation.
+        return value
+    if not args:
+        return value
+    if origin in _SEQUENCE_TYPES and is_model(args[0]):
+        return [_construct_item(args[0], v) for v in value]
+    if origin in _MAPPING_TYPES and len(args) == 2 and is_model(args[1]):
+        return {k: _construct_item(args[1], v) for k,v in value.items()}
+    return value
+
+
+
+def _construct_item(model_class, value):
+    if isinstance(value, collections.abc.Mapping):
+        return construct(model_class, value)
+    return value
+
+
+
+class _SchemaGenerator(GenerateJsonSchema):
+
+    def sort(self, value, parent_key=None):
+        # Keep the keys in the order they were generated in, they are
+        # brought into pydantic v1's order by _normalize.
+        return value
+
+
+
+def schema(model_class):
+    """Return the JSON schema of the given model class in the layout
+    pydantic v1 generates.
+    """
+    schema = model_class.model_json_schema(ref_template=REF_TEMPLATE,
+        schema_generator=_SchemaGenerator)
+    definitions = schema.pop('$defs', None)
+    enums = {
+        name for name, definition in (definitions or {}).items()
+        if 'enum' in definition and 'properties' not in definition
+    }
+    result = _normalize(schema, enums)
+    if definitions:
+        result['definitions'] = {}
+        for name, definition in definitions.items():
+            definition = _normalize(definition, enums)
+            if name in enums and 'description' not in definition:
+                # pydantic v1 describes undocumented enums like this.
+                definition = _order({**definition, 'description': 'An enumeration.'})
+            result['definitions'][name] = definition
+    return result
+
+
+
+def _normalize(schema, enums, name=None):
+    """Normalize a (sub) schema generated by pydantic v2. name is the
+    property name if schema is the schema of a model field.
+    """
+    if isinstance(schema, list):
+        return [_normalize(value, enums) for value in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    result = {}
+    for key, value in schema.items():
+        if key == 'properties':
+            value = {k: _normalize(v, enums, k) for k,v in value.items()}
+        elif key == 'const':
+            # Literal with a single value.
+            key, value = 'enum', [value]
+        else:
+            value = _normalize(value, enums)
+        result[key] = value
+
+    if 'default' in result and result['default'] is None:
+        # v1 leaves out None defaults.
+        del result['default']
+
+    any_of = result.get('anyOf')
+    if any_of is not None:
+        # Optional[X] is anyOf X or null in v2 and plain X in v1.
+        types = [s for s in any_of if s != {'type': 'null'}]
+        if len(types) == 1 and len(types) < len(any_of):
+            del result['anyOf']
+            result = {**types[0], **result}
+
+    ref = result.get('$ref')
+    if ref is not None and len(result) > 1:
+        # v1 wraps references with extra keys in an allOf and, unlike v2,
+        # adds the field title unless the reference is to an enum.
+        if name is not None and 'title' not in result and ref.rpartition('/')[-1] not in enums:
+            result['title'] = name.title().replace('_', ' ')
+        del result['$ref']
+        result['allOf'] = [{'$ref': ref}]
+
+    return _order(result)
+
+
+
+def _order(schema):
+    result = {k: schema[k] for k in _LEADING_KEYS if k in schema}
+    result.update((k, v) for k,v in schema.items() if k not in result)
+    return result
+
+
+
+def dump(model, **kwargs):
+    return model.model_dump(**kwargs)
+
+
+
+def copy(model, deep=False):
+    return model.model_copy(deep=deep)
@@ -0,0 +1,134 @@
+import collections
+import functools
+import threading
+import time
+
+from . import metrics
+from .backends import backend
+
+
+
+class ModelCache():
+    """Bounded LRU cache of parsed models with an optional time to live.
+
+    Models are keyed by (apiVersion, kind, metadata.uid, metadata.resourceVersion)
+    of the body they were parsed from. As the resourceVersion changes with
+    every modification of an object, a cached model never goes stale.
+    Bodies without a uid or resourceVersion are not cached.
+
+    The same model instance is handed out to everyone asking for the same
+    body, so cached models must be treated as read only.
+
+    e.g.
+    ```
+        cache = ModelCache(maxsize=4096, ttl=600)
+        model = cache.parse(HostCertificate, body)
+        print(cache.hits, cache.misses)
+    ```
+    """
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+        self.__entries = collections.OrderedDict()
+
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+    @staticmethod
+    def key(body):
+        """Return the cache key for the given body or None if the body
+        can not be cached.
+        """
+        metadata = body.get('metadata') or {}
+        uid = metadata.get('uid')
+        resource_version = metadata.get('resourceVersion')
+        if not uid or not resource_version:
+            return None
+        return (body.get('apiVersion'), body.get('kind'), uid, resource_version)
+
+
+    def get(self, key):
+        """Return the cached model for key or None.
+        """
+        with self.__lock:
+            try:
+                model, expires = self.__entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            if expires is not None and expires < time.monotonic():
+                del self.__entries[key]
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return model
+
+
+    def put(self, key, model):
+        """Store the given model under key, evicting the least recently
+        used entries if the cache is full.
+        """
+        if not self.maxsize:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self.__lock:
+            self.__entries[key] = (model, expires)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+
+    def parse(self, model_class, body, parser=None, tag=None):
+        """Return the model for the given body, parsing it with
+        the backend or the given parser on a cache miss.
+
+        Models are cached per model_class. Models parsed in different ways,
+        e.g. validated vs. constructed, can be kept apart by passing a
+        distinct tag.
+        """
+        parser = parser or functools.partial(backend.parse, model_class)
+        key = self.key(body)
+        if key is None:
+            return parser(body)
+        key += (model_class, tag)
+        model = self.get(key)
+        if metrics.active:
+            metrics.inc('kopf_resources_cache_total',
+                dict(metrics.model_labels(model_class), result='miss' if model is None else 'hit'))
+        if model is None:
+            model = parser(body)
+            self.put(key, model)
+        return model
+
+
+    def clear(self):
+        """Remove all entries and reset the counters.
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+    def info(self):
+        """Return a dict with the cache statistics.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.__entries),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+        }
+
+
+
+# The cache used by from_dict and the decorator wrappers.
+default_cache = ModelCache()
@@ -0,0 +1,437 @@
+"""Command line interface to render the CRDs of resource classes.
+
+e.g.
+```
+    # Print all CRDs defined in the given modules as one yaml bundle.
+    kopf_resources ./resources.py mypackage.resources
+
+    # Write one file per CRD.
+    kopf_resources -o ./crds ./resources.py
+
+    # Check that the files in ./crds are up to date, e.g. in CI.
+    kopf_resources -o ./crds --check ./resources.py
+
+    # Convert between the versions of the CRDs with a webhook.
+    kopf_resources --conversion-service operators/ssh-cert-manager:443 ./resources.py
+```
+"""
+import argparse
+import concurrent.futures
+import difflib
+import hashlib
+import importlib
+import importlib.util
+import json
+import os
+import sys
+
+import pydantic
+
+from . import crd as _crd
+from .backends import backend
+from . import iter_yaml, to_json
+from .conversion import webhook_conversion
+
+
+
+# Bump to invalidate all on-disk caches.
+CACHE_VERSION = '1'
+
+
+
+def _is_path(module):
+    return module.endswith('.py') or os.sep in module
+
+
+
+def _import(module):
+    """Import the given module name or path to a python file and return it.
+    """
+    if _is_path(module):
+        path = os.path.abspath(module)
+        name = os.path.splitext(os.path.basename(path))[0]
+        # Let the module import its siblings, like `python ./module.py` would.
+        directory = os.path.dirname(path)
+        if directory not in sys.path:
+            sys.path.insert(0, directory)
+        if name in sys.modules:
+            return sys.modules[name]
+        spec = importlib.util.spec_from_file_location(name, path)
+        _module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = _module
+        spec.loader.exec_module(_module)
+        return _module
+    return importlib.import_module(module)
+
+
+
+def _source_path(module):
+    """Return the path to the source file of the given module name or path
+    without importing it, or None if it can not be found.
+    """
+    if _is_path(module):
+        return os.path.abspath(module)
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        return None
+    if spec is None or not spec.origin or not os.path.isfile(spec.origin):
+        return None
+    return spec.origin
+
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+
+def _library_hash():
+    """Hash of the sources of this package and the model backend, which
+    all may affect the CRD output.
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    hashes = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d != '__pycache__')
+        for name in sorted(files):
+            if name.endswith('.py'):
+                path = os.path.join(root, name)
+                hashes.append(os.path.relpath(path, directory))
+                hashes.append(_file_hash(path))
+    return ''.join(hashes + [backend.name, pydantic.VERSION])
+
+
+
+def render_module(module, include_private=False, crd_options=None):
+    """Import the given module and return a list of (name, crd) tuples for
+    all resource classes defined in it, in its submodules or re-exported
+    by it.
+
+    All versions of a resource need to be importable from that module.
+    """
+    _module = _import(module)
+    name = _module.__name__
+    exported = {id(v) for v in vars(_module).values()}
+    crds = []
+    for resource_class in _crd._iter_crd_classes(include_private):
+        defined_in = resource_class.__module__ or ''
+        if defined_in == name or defined_in.startswith(f'{name}.') or id(resource_class) in exported:
+            crd = _crd.as_crd(resource_class, **(crd_options or {}))
+            crds.append((resource_class.__fqname__, crd))
+    return crds
+
+
+
+def _project_dirs(module):
+    """Return the directories whose python files count as part of the
+    project of the given module.
+    """
+    dirs = {os.getcwd()}
+    path = _source_path(module)
+    if path is not None:
+        dirs.add(os.path.dirname(path))
+    return tuple(os.path.join(d, '') for d in dirs)
+
+
+
+def _dependencies(project_dirs):
+    """Return a dict of path -> hash of the source files of all loaded
+    modules in the given project directories.
+    """
+    dependencies = {}
+    for _module in list(sys.modules.values()):
+        path = getattr(_module, '__file__', None)
+        if not path or not path.endswith('.py'):
+            continue
+        path = os.path.abspath(path)
+        if path.startswith(project_dirs) and os.path.isfile(path):
+            dependencies[path] = _file_hash(path)
+    return dependencies
+
+
+
+def _render_module_cached(module, include_private=False, crd_options=None):
+    """Like render_module but return (crds, dependencies) for the cache.
+    """
+    crds = render_module(module, include_private, crd_options)
+    return crds, _dependencies(_project_dirs(module))
+
+
+
+def _cache_key(module, include_private, crd_options):
+    path = _source_path(module)
+    if path is None:
+        return None
+    key = json.dumps([
+        CACHE_VERSION,
+        _library_hash(),
+        _file_hash(path),
+        module,
+        include_private,
+        crd_options,
+    ], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+
+def _cache_get(cache_dir, key):
+    """Return the cached crds for key, or None if there are none or any
+    of the module files they were rendered from changed since.
+    """
+    if not cache_dir or key is None:
+        return None
+    try:
+        with open(os.path.join(cache_dir, f'{key}.json')) as f:
+            entry = json.load(f)
+        for path, file_hash in entry['dependencies'].items():
+            if _file_hash(path) != file_hash:
+                return None
+        return [tuple(item) for item in entry['crds']]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+
+def _cache_put(cache_dir, key, crds, dependencies):
+    if not cache_dir or key is None:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f'{key}.json')
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'crds': crds, 'dependencies': dependencies}, f)
+    os.replace(tmp_path, path)
+
+
+
+def default_cache_dir():
+    """Return the per user cache directory, $XDG_CACHE_HOME/kopf_resources.
+    """
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'kopf_resources')
+
+
+
+def render(modules, include_private=False, crd_options=None, jobs=None, cache_dir=None):
+    """Render the CRDs of all resource classes defined in the given modules
+    and return a dict of name -> crd.
+
+    Modules are imported and rendered in a pool of `jobs` processes.
+    Results are cached in cache_dir together with the hashes of all project
+    files the module imported, so unchanged modules are not even imported.
+    """
+    results = {}
+    todo = {}
+    for module in modules:
+        key = _cache_key(module, include_private, crd_options)
+        cached = _cache_get(cache_dir, key)
+        if cached is None:
+            todo[module] = key
+        else:
+            results[module] = cached
+
+    if len(todo) == 1 or jobs == 1:
+        for module, key in todo.items():
+            results[module], dependencies = _render_module_cached(module, include_private, crd_options)
+            _cache_put(cache_dir, key, results[module], dependencies)
+    elif todo:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                module: executor.submit(_render_module_cached, module, include_private, crd_options)
+                for module in todo
+            }
+            for module, future in futures.items():
+                results[module], dependencies = future.result()
+                _cache_put(cache_dir, todo[module], results[module], dependencies)
+
+    crds = {}
+    for module in modules:
+        for name, crd in results[module]:
+            crds.setdefault(name, crd)
+    return crds
+
+
+
+def _serialize(crds, output_format, as_list=True):
+    if output_format == 'json':
+        return to_json(*crds, indent=2, as_list=as_list) + '\n'
+    return ''.join(iter_yaml(*crds))
+
+
+
+def _check(path, text):
+    """Return a diff between the file at path and text, or None if they
+    are the same.
+    """
+    try:
+        with open(path) as f:
+            current = f.read()
+    except FileNotFoundError:
+        current = ''
+    if current == text:
+        return None
+    return ''.join(difflib.unified_diff(
+        current.splitlines(keepends=True), text.splitlines(keepends=True),
+        fromfile=path, tofile=f'{path} (rendered)',
+    ))
+
+
+
+def _stale_files(directory, output_format, outputs):
+    """Return the files of the given format in directory that are not in
+    outputs, e.g. those of removed or renamed CRDs.
+    """
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    return [
+        path for path in (os.path.join(directory, name) for name in names)
+        if path.endswith(f'.{output_format}') and path not in outputs and os.path.isfile(path)
+    ]
+
+
+
+def _write(path, text):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+
+def _service(value):
+    """Parse NAMESPACE/NAME[:PORT] into the service dict of
+    webhook_conversion.
+    """
+    namespace, _, name = value.partition('/')
+    name, _, port = name.partition(':')
+    if not namespace or not name or (port and not port.isdigit()):
+        raise ValueError(f'Invalid service {value!r}, expected NAMESPACE/NAME[:PORT].')
+    service = {'namespace': namespace, 'name': name}
+    if port:
+        service['port'] = int(port)
+    return service
+
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='kopf_resources',
+        description='Render the CustomResourceDefinitions of kopf_resources resource classes.')
+    parser.add_argument('modules', nargs='+', metavar='MODULE',
+        help='module name or path to a python file that defines resource classes')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('-o', '--output-dir',
+        help='write one file per CRD into this directory')
+    output.add_argument('-f', '--output', default='-',
+        help='write all CRDs into this file, default: stdout')
+    parser.add_argument('--format', choices=('yaml', 'json'), default='yaml')
+    parser.add_argument('--include-private', action='store_true',
+        help='also render resource classes whose name starts with _')
+    parser.add_argument('--check', action='store_true',
+        help='do not write anything, exit with 1 if the output files are not up to date')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+        help='number of processes used to render, default: number of cpus')
+    parser.add_argument('--cache-dir', default=default_cache_dir(),
+        help='directory to cache rendered CRDs in, default: %(default)s')
+    parser.add_argument('--no-cache', dest='cache_dir', action='store_const', const=None,
+        help='do not use the cache')
+    parser.add_argument('--no-titles', action='store_true',
+        help='drop the generated titles from the schemas')
+    parser.add_argument('--descriptions', type=int, default=None, metavar='N',
+        help='truncate descriptions to N characters, 0 drops them')
+    parser.add_argument('--budget', type=int, default=None, metavar='BYTES',
+        help='fail if a CRD is bigger than BYTES')
+    parser.add_argument('--version-budget', type=int, default=None, metavar='BYTES',
+        help='fail if a version of a CRD is bigger than BYTES')
+    conversion = parser.add_mutually_exclusive_group()
+    conversion.add_argument('--conversion-url', metavar='URL',
+        help='convert between the versions of CRDs with the webhook at URL')
+    conversion.add_argument('--conversion-service', metavar='NAMESPACE/NAME[:PORT]',
+        help='convert between the versions of CRDs with the webhook of this service')
+    parser.add_argument('--conversion-path', default='/convert',
+        help='path of the conversion webhook of the service, default: %(default)s')
+    parser.add_argument('--conversion-ca-bundle', metavar='BASE64',
+        help='base64 encoded CA bundle to verify the conversion webhook with')
+    return parser.parse_args(argv)
+
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    crd_options = {}
+    if args.no_titles:
+        crd_options['titles'] = False
+    if args.descriptions is not None:
+        crd_options['descriptions'] = args.descriptions
+    if args.budget is not None:
+        crd_options['budget'] = args.budget
+    if args.version_budget is not None:
+        crd_options['version_budget'] = args.version_budget
+    if args.conversion_url or args.conversion_service:
+        try:
+            service = _service(args.conversion_service) if args.conversion_service else None
+        except ValueError as e:
+            print(f'error: {e}', file=sys.stderr)
+            return 2
+        crd_options['conversion'] = webhook_conversion(url=args.conversion_url,
+            service=service, ca_bundle=args.conversion_ca_bundle, path=args.conversion_path)
+
+    try:
+        crds = render(args.modules, include_private=args.include_private,
+            crd_options=crd_options, jobs=args.jobs, cache_dir=args.cache_dir)
+    except _crd.CRDSizeError as e:
+        print(f'error: {e}', file=sys.stderr)
+        return 1
+
+    if args.output_dir and os.path.exists(args.output_dir) and not os.path.isdir(args.output_dir):
+        print(f'error: {args.output_dir} is not a directory', file=sys.stderr)
+        return 2
+
+    if args.output_dir:
+        outputs = {
+            os.path.join(args.output_dir, f'{name}.{args.format}'): _serialize([crd], args.format, as_list=False)
+            for name, crd in crds.items()
+        }
+    else:
+        outputs = {args.output: _serialize(crds.values(), args.format)}
+
+    if args.check:
+        if args.output == '-' and not args.output_dir:
+            print('error: --check needs --output or --output-dir', file=sys.stderr)
+            return 2
+        outdated = False
+        for path, text in outputs.items():
+            try:
+                diff = _check(path, text)
+            except OSError as e:
+                print(f'error: {e}', file=sys.stderr)
+                return 2
+            if diff is not None:
+                outdated = True
+                sys.stdout.write(diff)
+        if args.output_dir:
+            for path in _stale_files(args.output_dir, args.format, outputs):
+                outdated = True
+                print(f'stale: {path} is not rendered from any CRD')
+        return 1 if outdated else 0
+
+    for path, text in outputs.items():
+        if path == '-':
+            sys.stdout.write(text)
+        else:
+            try:
+                _write(path, text)
+            except OSError as e:
+                print(f'error: {e}', file=sys.stderr)
+                return 2
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""Conversion between the versions of a resource and a ConversionReview
+webhook server for kubernetes.
+
+Converters are registered per (fqname, from_version, to_version) and work
+on plain body dicts. Conversions between versions without a direct
+converter are chained through intermediate versions.
+
+e.g.
+```
+    @converter(HostCertificateV1alpha2, HostCertificate)
+    def v1alpha2_to_v1(body):
+        body['spec'].setdefault('extensions', {})
+        return body
+
+    @converter(HostCertificate, HostCertificateV1alpha2)
+    def v1_to_v1alpha2(body):
+        body['spec'].pop('extensions', None)
+        body['spec'].pop('criticalOptions', None)
+        return body
+
+    server = ConversionWebhookServer(port=9443, ssl_context=ssl_context)
+    await server.start()
+```
+"""
+import asyncio
+import collections
+import copy
+import json
+import logging
+import threading
+
+from aiohttp import web
+
+from .registry import ResourceRegistry
+
+
+log = logging.getLogger(__name__)
+
+
+
+class ConversionNotFoundError(Exception):
+    pass
+
+
+
+class ConversionRegistry():
+    # fqname -> {from_version: {to_version: func}}
+    __converters = {}
+    # (fqname, from_version, to_version) -> tuple of (to_api_version, func)
+    __paths = {}
+    __lock = threading.RLock()
+
+
+    @classmethod
+    def add(cls, fqname, from_version, to_version, func):
+        """Register func to convert bodies of the resource fqname from
+        from_version to to_version.
+        """
+        with cls.__lock:
+            versions = cls.__converters.setdefault(fqname, {})
+            versions.setdefault(from_version, {})[to_version] = func
+            # A new converter may give shorter paths.
+            cls.__paths.clear()
+
+
+    @classmethod
+    def path(cls, fqname, from_version, to_version):
+        """Return the chain of converters to get from from_version to
+        to_version as a tuple of (api_version, func) tuples.
+
+        The shortest chain is used and cached per version pair.
+        """
+        key = (fqname, from_version, to_version)
+        try:
+            return cls.__paths[key]
+        except KeyError:
+            pass
+        with cls.__lock:
+            path = cls.__find_path(fqname, from_version, to_version)
+            cls.__paths[key] = path
+            return path
+
+
+    @classmethod
+    def __find_path(cls, fqname, from_version, to_version):
+        # Breadth first search for the shortest chain.
+        graph = cls.__converters.get(fqname, {})
+        previous = {from_version: None}
+        queue = collections.deque([from_version])
+        while queue:
+            version = queue.popleft()
+            if version == to_version:
+                break
+            for next_version in graph.get(version, {}):
+                if next_version not in previous:
+                    previous[next_version] = version
+                    queue.append(next_version)
+        else:
+            msg = f'No conversion for {fqname} from {from_version} to {to_version}'
+            raise ConversionNotFoundError(msg)
+
+        path = []
+        version = to_version
+        while previous[version] is not None:
+            from_ = previous[version]
+            resource_class = ResourceRegistry.get_version(fqname, version)
+            path.append((resource_class.__api_version__, graph[from_][version]))
+            version = from_
+        return tuple(reversed(path))
+
+
+    @classmethod
+    def clear(cls):
+        with cls.__lock:
+            cls.__converters.clear()
+            cls.__paths.clear()
+
+
+
+def converter(from_class, to_class):
+    """Decorator to register a function that converts bodies of from_class
+    to bodies of to_class.
+
+    The function gets a body dict which it may modify and has to return the
+    converted body. apiVersion is set automatically.
+    """
+    if from_class.__fqname__ != to_class.__fqname__:
+        raise ValueError(f'Can not convert between different resources: '
+            f'{from_class.__fqname__} and {to_class.__fqname__}')
+    def decorator(func):
+        ConversionRegistry.add(from_class.__fqname__, from_class.__version__,
+            to_class.__version__, func)
+        return func
+    return decorator
+
+
+
+def _resolve(api_version, kind, desired_api_version):
+    """Return the converter path for objects of api_version and kind.
+    """
+    resource_class = ResourceRegistry.get(api_version, kind)
+    desired_class = ResourceRegistry.get(desired_api_version, kind)
+    return ConversionRegistry.path(resource_class.__fqname__,
+        resource_class.__version__, desired_class.__version__)
+
+
+
+def convert(body, desired_api_version, copy_body=True):
+    """Convert the given body to desired_api_version and return it.
+
+    The body is deep copied first unless copy_body is false, in which case
+    converters may modify it.
+    """
+    if body['apiVersion'] == desired_api_version:
+        return body
+    if copy_body:
+        body = copy.deepcopy(body)
+    for api_version, func in _resolve(body['apiVersion'], body['kind'], desired_api_version):
+        body = func(body)
+        body['apiVersion'] = api_version
+    return body
+
+
+
+def convert_all(bodies, desired_api_version, copy_bodies=True):
+    """Convert a batch of bodies to desired_api_version and return them as list.
+
+    The converter path is only looked up once per apiVersion and kind.
+    """
+    paths = {}
+    converted = []
+    for body in bodies:
+        api_version = body['apiVersion']
+        if api_version == desired_api_version:
+            converted.append(body)
+            continue
+        key = (api_version, body['kind'])
+        try:
+            path = paths[key]
+        except KeyError:
+            path = paths[key] = _resolve(api_version, body['kind'], desired_api_version)
+        if copy_bodies:
+            body = copy.deepcopy(body)
+        for api_version, func in path:
+            body = func(body)
+            body['apiVersion'] = api_version
+        converted.append(body)
+    return converted
+
+
+
+def review(conversion_review):
+    """Handle a ConversionReview request and return the ConversionReview
+    response.
+
+    Errors are reported as failed conversion in the response.
+    """
+    if not isinstance(conversion_review, dict):
+        conversion_review = {}
+    request = conversion_review.get('request') or {}
+    if not isinstance(request, dict):
+        request = {}
+    response = {'uid': request.get('uid')}
+    try:
+        # The objects come straight from the json decoder so we own them.
+        response['convertedObjects'] = convert_all(request.get('objects') or [],
+            request['desiredAPIVersion'], copy_bodies=False)
+        response['result'] = {'status': 'Success'}
+    except Exception as e:
+        log.exception('Conversion failed: %s', request.get('uid'))
+        response['convertedObjects'] = []
+        response['result'] = {'status': 'Failed', 'message': f'{type(e).__name__}: {e}'}
+    return {
+        'apiVersion': conversion_review.get('apiVersion', 'apiextensions.k8s.io/v1'),
+        'kind': 'ConversionReview',
+        'response': response,
+    }
+
+
+
+def webhook_conversion(url=None, service=None, ca_bundle=None, path='/convert'):
+    """Return the `spec.conversion` of a CRD that uses the conversion webhook.
+
+    Either url or service, a dict with name, namespace and optionally port,
+    has to be given.
+    """
+    client_config = {}
+    if url:
+        client_config['url'] = url
+    elif service:
+        client_config['service'] = dict(service, path=path)
+    else:
+        raise ValueError('Either url or service is required.')
+    if ca_bundle:
+        client_config['caBundle'] = ca_bundle
+    return {
+        'strategy': 'Webhook',
+        'webhook': {
+            'clientConfig': client_config,
+            'conversionReviewVersions': ['v1'],
+        },
+    }
+
+
+
+class ConversionWebhookServer():
+    """asyncio http(s) server that handles ConversionReview requests.
+
+    Kubernetes requires https, so pass a ssl_context unless this is only
+    used for local testing.
+
+    Batches are converted on the event loop unless an executor is given,
+    in which case big batches don't block other tasks.
+    """
+
+    def __init__(self, host='0.0.0.0', port=9443, path='/convert',
+            ssl_context=None, executor=None):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.ssl_context = ssl_context
+        self.executor = executor
+        self.runner = None
+
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+
+    async def handle(self, request):
+        try:
+            conversion_review = await request.json(loads=json.loads)
+        except ValueError:
+            raise web.HTTPBadRequest(text='Invalid json.')
+        if not isinstance(conversion_review, dict):
+            raise web.HTTPBadRequest(text='Expected a ConversionReview object.')
+        if self.executor is None:
+            result = review(conversion_review)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(self.executor, review, conversion_review)
+        return web.json_response(result)
+
+
+    async def start(self):
+        self.runner = web.AppRunner(self.make_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port, ssl_context=self.ssl_context)
+        await site.start()
+        log.info('Conversion webhook listening on %s:%s%s', self.host, self.port, self.path)
+
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+    async def run(self):
+        """Run until cancelled, e.g. as a kopf daemon or background task.
+        """
+        await self.start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
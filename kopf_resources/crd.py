@@ -0,0 +1,475 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+import warnings
+
+from . import metrics
+from .backends import backend
+from .registry import ResourceRegistry
+
+
+
+# fqname -> _CRDEntry
+_memo = {}
+_lock = threading.RLock()
+
+# The default maximum request size of etcd. Objects, including CRDs,
+# bigger than this can not be stored.
+ETCD_REQUEST_LIMIT = 1536 * 1024
+
+# Schema keywords whose values are schemas or lists/dicts of schemas.
+_SCHEMA_KEYWORDS = ('items', 'additionalProperties', 'not')
+_SCHEMA_LIST_KEYWORDS = ('allOf', 'anyOf', 'oneOf', 'items')
+_SCHEMA_DICT_KEYWORDS = ('properties', 'patternProperties')
+
+
+
+def as_crd(resource_class, titles=True, descriptions=True, budget=None,
+        budget_action='error', version_budget=None, conversion=None):
+    """Create and return a CustomResourceDefinition for the given resource class.
+
+    The CRD is generated once per resource class and set of versions and
+    then memoized. Every call returns a copy that can be freely modified.
+
+    The size of the CRD can be reduced with:
+    - titles=False: drop the titles which pydantic generates for every
+      model and field.
+    - descriptions=False: drop all descriptions.
+    - descriptions=<int>: truncate descriptions to that many characters.
+
+    If a budget in bytes is given, e.g. ETCD_REQUEST_LIMIT, a CRD that is
+    bigger raises a CRDSizeError, or only warns with budget_action='warn'.
+    With a version_budget every version of the CRD is checked against it
+    the same way. See crd_size.
+
+    conversion is set as `spec.conversion` of CRDs with more than one
+    version, e.g. conversion.webhook_conversion(service=...).
+
+    Identical subtrees, e.g. a model that is used in several places, can
+    not be deduplicated: kubernetes requires structural schemas without
+    $ref, so every use is a full copy in the stored CRD.
+    """
+    start = time.perf_counter() if metrics.active else None
+    crd = copy.deepcopy(_crd_entry(resource_class).crd)
+    if not titles or descriptions is not True:
+        for version in crd['spec']['versions']:
+            schema = version['schema']['openAPIV3Schema']
+            version['schema']['openAPIV3Schema'] = _compact_schema(schema, titles, descriptions)
+    if conversion is not None and len(crd['spec']['versions']) > 1:
+        crd['spec']['conversion'] = copy.deepcopy(conversion)
+    if budget is not None or version_budget is not None:
+        _check_budget(crd, budget, budget_action, version_budget)
+    if start is not None:
+        metrics.observe('kopf_resources_crd_seconds', {'crd': resource_class.__fqname__},
+            time.perf_counter() - start)
+    return crd
+
+
+
+def crd_size(crd):
+    """Return the size in bytes of the given CRD as json, which is what
+    the apiserver stores.
+
+    Returns a dict with the 'total' size and a dict of 'versions' with the
+    size of every version.
+    """
+    return {
+        'total': _json_size(crd),
+        'versions': {v['name']: _json_size(v) for v in crd['spec']['versions']},
+    }
+
+
+
+def _json_size(data):
+    return len(json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+
+
+def _check_budget(crd, budget=None, budget_action='error', version_budget=None):
+    size = crd_size(crd)
+    versions = ', '.join(f'{k}: {v}' for k,v in size['versions'].items())
+    if budget is not None and size['total'] > budget:
+        msg = (f'CRD {crd["metadata"]["name"]} is {size["total"]} bytes which exceeds '
+            f'the budget of {budget} bytes (versions: {versions})')
+    elif version_budget is not None and max(size['versions'].values()) > version_budget:
+        over = ', '.join(k for k,v in size['versions'].items() if v > version_budget)
+        msg = (f'CRD {crd["metadata"]["name"]} has versions that exceed the version '
+            f'budget of {version_budget} bytes: {over} (versions: {versions})')
+    else:
+        return
+    if budget_action == 'warn':
+        warnings.warn(msg, CRDSizeWarning, stacklevel=3)
+    else:
+        raise CRDSizeError(msg)
+
+
+
+def _compact_schema(schema, titles=True, descriptions=True):
+    """Return a compacted copy of the given schema.
+
+    Drops titles if titles is false. Drops descriptions if descriptions is
+    false or truncates them to descriptions characters if it is an int.
+    Subtrees that are shared in the input are only compacted once and
+    shared in the output as well.
+    """
+    memo = {}
+
+    def compact(schema):
+        try:
+            return memo[id(schema)]
+        except KeyError:
+            pass
+        result = memo[id(schema)] = {}
+        for k,v in schema.items():
+            if k == 'title' and not titles:
+                continue
+            if k == 'description' and descriptions is not True:
+                if not descriptions:
+                    continue
+                if isinstance(v, str) and len(v) > descriptions:
+                    v = v[:descriptions].rstrip()
+            elif k in _SCHEMA_KEYWORDS and isinstance(v, dict):
+                v = compact(v)
+            elif k in _SCHEMA_LIST_KEYWORDS and isinstance(v, list):
+                v = [compact(i) if isinstance(i, dict) else i for i in v]
+            elif k in _SCHEMA_DICT_KEYWORDS and isinstance(v, dict):
+                # The keys are names here, not keywords.
+                v = {name: compact(i) if isinstance(i, dict) else i for name,i in v.items()}
+            result[k] = v
+        return result
+
+    return compact(schema)
+
+
+
+def _crd_entry(resource_class):
+    """Return the memoized _CRDEntry for the given resource class,
+    generating it if needed.
+    """
+    versions = tuple(ResourceRegistry.iter_versions(resource_class))
+    key = (resource_class.__fqname__, versions)
+    with _lock:
+        entry = _memo.get(resource_class.__fqname__)
+        hit = entry is not None and entry.key == key
+        if not hit:
+            entry = _generate_crd(resource_class, versions)
+            entry.key = key
+            _memo[resource_class.__fqname__] = entry
+    if metrics.active:
+        metrics.inc('kopf_resources_crd_cache_total', {'result': 'hit' if hit else 'miss'})
+    return entry
+
+
+
+def _generate_crd(resource_class, versions):
+    # Deep copy as we modify the nested versions list.
+    spec = copy.deepcopy(resource_class.__spec__)
+    body = {
+        'apiVersion': 'apiextensions.k8s.io/v1',
+        'kind': 'CustomResourceDefinition',
+        'metadata': {'name': resource_class.__fqname__},
+        'spec': spec,
+    }
+
+    version_fingerprints = {}
+    for version, resource_class in versions:
+        # Deep copy as pydantic v1 caches the schema and we modify it.
+        schema = copy.deepcopy(backend.schema(resource_class))
+        # Don't want ObjectMeta in crd.
+        schema['properties'].pop('metadata', None)
+        definitions = schema.pop('definitions', {})
+        # Dereference and cleanup the schema into something that kubernetes
+        # agrees with.
+        schema = _transform_schema(schema, definitions, resource_class.__name__)
+
+        _version = {
+            'name': version,
+            'schema': {'openAPIV3Schema': schema},
+            'served': resource_class.__served__,
+            'storage': resource_class.__storage__,
+        }
+
+        if resource_class.__status_subresource__:
+            _version.setdefault('subresources', {})
+            _version['subresources']['status'] = {}
+            # Seen this in some kubebuilder generated CRDs.
+            # Not sure it is needed.
+            #body['status'] = {
+            #    'acceptedNames': {
+            #      'kind': '',
+            #      'plural': '',
+            #    },
+            #    'conditions': [],
+            #    'storedVersions': [],
+            #}
+
+        body['spec']['versions'].append(_version)
+        version_fingerprints[version] = content_hash(_version)
+
+    return _CRDEntry(body, content_hash(body), version_fingerprints)
+
+
+
+class _CRDEntry():
+    __slots__ = ('crd', 'fingerprint', 'versions', 'key')
+
+    def __init__(self, crd, fingerprint, versions):
+        self.crd = crd
+        self.fingerprint = fingerprint
+        self.versions = versions
+        self.key = None
+
+
+
+def content_hash(data):
+    """Return a stable sha256 hex digest of the given json serializable data.
+    """
+    serialized = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+
+def crd_fingerprint(resource_class):
+    """Return the content hash of the CRD of the given resource class.
+    """
+    return _crd_entry(resource_class).fingerprint
+
+
+
+def version_fingerprints(resource_class):
+    """Return a dict of version name -> content hash of the versions of the
+    CRD of the given resource class.
+    """
+    return dict(_crd_entry(resource_class).versions)
+
+
+
+def crd_fingerprints(include_private=False):
+    """Return a dict of CRD name -> content hash for all known and loaded
+    resource classes.
+
+    Store this and pass it to changed_crds later on to only regenerate
+    what changed.
+    """
+    return {
+        resource_class.__fqname__: crd_fingerprint(resource_class)
+        for resource_class in _iter_crd_classes(include_private)
+    }
+
+
+
+def changed_crds(fingerprints, include_private=False, **kwargs):
+    """Return a dict of CRD name -> CustomResourceDefinition for all CRDs
+    whose content hash differs from the one in the given fingerprints dict,
+    e.g. as returned by crd_fingerprints.
+
+    CRDs that are not in fingerprints count as changed. Any kwargs are
+    passed on to as_crd.
+    """
+    crds = {}
+    for resource_class in _iter_crd_classes(include_private):
+        fqname = resource_class.__fqname__
+        if fingerprints.get(fqname) != crd_fingerprint(resource_class):
+            crds[fqname] = as_crd(resource_class, **kwargs)
+    return crds
+
+
+
+def clear_crd_cache():
+    """Forget all memoized CRDs, e.g. after resource classes were redefined.
+    """
+    with _lock:
+        _memo.clear()
+
+
+
+def all_crds(include_private=False, **kwargs):
+    """Create and return CustomResourceDefinition's for all known and loaded resource classes.
+
+    Any kwargs are passed on to as_crd.
+    """
+    return [as_crd(resource_class, **kwargs) for resource_class in _iter_crd_classes(include_private)]
+
+
+
+def _iter_crd_classes(include_private=False):
+    """Yield one resource class per CRD.
+    """
+    seen = set()
+    for resource_class in ResourceRegistry.iter_resources():
+        #print(f'resource_class: {resource_class}')
+        if include_private or not resource_class.__name__.startswith('_'):
+            if not resource_class.__fqname__ in seen:
+                seen.add(resource_class.__fqname__)
+                yield resource_class
+
+
+
+def _transform_schema(schema, definitions, name=None):
+    """Transform the given pydantic schema for use with kubernetes in a
+    single pass and return the result.
+
+    - '#/definitions/myElement' references are replaced by the transformed
+      definitions[myElement]. Every definition is only transformed once,
+      all references share the result.
+    - Single element allOf's are flattened.
+    - Recursive models raise a RecursiveSchemaError as kubernetes does not
+      support references.
+
+    The given schema and definitions are not modified. The runtime is
+    linear in the size of the input.
+
+    Pydantic uses allOf to preserve some fields like title and description
+    that would otherwise be overwritten by nested models.
+    Kubernetes does not like that so we work around that by merging
+    the nested models properties.
+
+    We basically turn this:
+
+    ```
+    {
+       'tokenSecretRef': {
+          'title': 'Tokensecretref',
+          'description': 'Some interesting field description.',
+          'allOf': [{
+             'title': 'SecretRef',
+             'description': 'Some model docstring.',
+             'type': 'object',
+             'properties': {
+                'name': {'title': 'Name', 'type': 'string'}, 'key': {'title': 'Key', 'type': 'string'}
+             },
+             'required': ['name']
+          }]
+       }
+    }
+    ```
+
+    into this:
+
+    ```
+    {
+       'tokenSecretRef': {
+          'title': 'Tokensecretref',
+          'description': 'Some interesting field description.',
+          'type': 'object',
+          'properties': {
+             'name': {'title': 'Name', 'type': 'string'}, 'key': {'title': 'Key', 'type': 'string'}
+          },
+          required': ['name']
+       }
+    }
+    ```
+    """
+    def resolve(ref):
+        return resolved[ref.rpartition('/')[-1]]
+
+    def merge(schema, skip, child):
+        # Merge child into a transformed copy of schema without the skip key.
+        # Values already in schema win.
+        result = {k: transform(v) for k,v in schema.items() if k != skip}
+        for k,v in child.items():
+            result.setdefault(k, v)
+        return result
+
+    def transform(schema):
+        if isinstance(schema, dict):
+            if '$ref' in schema:
+                child = resolve(schema['$ref'])
+                if len(schema) == 1:
+                    return child
+                return merge(schema, '$ref', child)
+            all_of = schema.get('allOf')
+            if all_of is not None and len(all_of) == 1:
+                return merge(schema, 'allOf', transform(all_of[0]))
+            return {k: transform(v) for k,v in schema.items()}
+        elif isinstance(schema, list):
+            return [transform(v) for v in schema]
+        return schema
+
+    # Transform the referenced definitions in dependency order so that
+    # every reference is already resolved when we come across it. This
+    # also keeps the recursion depth bounded by the depth of a single model
+    # instead of the depth of the whole model graph.
+    resolved = {}
+    for ref_name in _definition_order(schema, definitions, name):
+        resolved[ref_name] = transform(definitions[ref_name])
+
+    return transform(schema)
+
+
+
+def _definition_order(schema, definitions, name=None):
+    """Return the names of the definitions referenced by schema, directly
+    or indirectly, in dependency order.
+
+    Raises a RecursiveSchemaError if the definitions reference each other
+    in a cycle.
+    """
+    refs = {}
+    def ref_names(ref_name):
+        try:
+            return refs[ref_name]
+        except KeyError:
+            result = refs[ref_name] = _ref_names(definitions[ref_name])
+            return result
+
+    order = []
+    # ref_name -> True while visiting, False when done
+    state = {}
+    for root in _ref_names(schema):
+        if root in state:
+            continue
+        state[root] = True
+        stack = [(root, iter(ref_names(root)))]
+        while stack:
+            ref_name, children = stack[-1]
+            for child in children:
+                visiting = state.get(child)
+                if visiting:
+                    chain = [n for n,_ in stack]
+                    chain = ' -> '.join(chain[chain.index(child):] + [child])
+                    raise RecursiveSchemaError(f'Recursive model in schema of {name}: {chain}')
+                if visiting is None:
+                    state[child] = True
+                    stack.append((child, iter(ref_names(child))))
+                    break
+            else:
+                stack.pop()
+                state[ref_name] = False
+                order.append(ref_name)
+    return order
+
+
+
+def _ref_names(schema):
+    """Return the names of the definitions directly referenced by schema.
+    """
+    names = []
+    stack = [schema]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            ref = item.get('$ref')
+            if isinstance(ref, str):
+                names.append(ref.rpartition('/')[-1])
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return names
+
+
+
+class RecursiveSchemaError(Exception):
+    pass
+
+
+
+class CRDSizeError(Exception):
+    pass
+
+
+
+class CRDSizeWarning(UserWarning):
+    pass
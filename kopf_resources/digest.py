@@ -0,0 +1,107 @@
+import re
+
+from .backends import backend
+from .crd import content_hash
+from .parsing import parse_cached
+from .registry import ResourceRegistry
+
+
+
+# Prefix of the annotations the digests are stored in by default.
+ANNOTATION_PREFIX = 'kopf-resources'
+# kopf leaves all annotations of a prefix with this marker out of the
+# essence it detects changes on, so storing a digest does not trigger
+# another update.
+MANAGED_MARKER = f'{ANNOTATION_PREFIX}/kopf-managed'
+
+_invalid_chars = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+
+def digest(model, include=('spec',)):
+    """Return a stable, canonical digest of the given top level fields of
+    the model.
+
+    Defaults are included, so adding a field to the model changes the
+    digest of all objects.
+    """
+    data = backend.dump(model, by_alias=True, include=set(include))
+    return content_hash(data)
+
+
+
+def annotation_key(handler_id):
+    """Return the default annotation key for the digest of the given handler.
+    """
+    name = _invalid_chars.sub('-', f'digest.{handler_id}').strip('-_.')
+    if len(name) > 63:
+        # Annotation names are limited to 63 characters.
+        name = f'{name[:46].rstrip("-_.")}.{content_hash(name)[:16]}'
+    return f'{ANNOTATION_PREFIX}/{name}'
+
+
+
+class DigestGuard():
+    """Skips handler calls if the digest of the selected parts of a resource
+    did not change since the last successful call.
+
+    The digest is stored in an annotation, or in the status if key starts
+    with `status.`, through kopf's patch.
+
+    The default annotations are marked as managed by kopf, so kopf ignores
+    them. Custom annotation keys are not, kopf then sees every stored digest
+    as change and calls the update handlers again, use a `status.` key or
+    a key below ANNOTATION_PREFIX instead.
+    """
+
+    def __init__(self, handler_id, include=('spec',), key=None, trusted=None):
+        self.include = tuple(include)
+        self.key = key or annotation_key(handler_id)
+        self.trusted = trusted
+        if self.key.startswith('status.'):
+            self.path = tuple(self.key.split('.'))
+        else:
+            self.path = ('metadata', 'annotations', self.key)
+
+
+    def current(self, body):
+        """Return the digest of the given body.
+        """
+        resource_class = ResourceRegistry.get(body['apiVersion'], body['kind'])
+        model = parse_cached(resource_class, body, trusted=self.trusted)
+        return digest(model, self.include)
+
+
+    def stored(self, body):
+        """Return the digest stored in the given body or None.
+        """
+        value = body
+        for part in self.path:
+            try:
+                value = value[part]
+            except (KeyError, TypeError):
+                return None
+        return value
+
+
+    def check(self, body):
+        """Return the current digest of the given body or None if it is
+        unchanged and the handler should be skipped.
+        """
+        value = self.current(body)
+        if value == self.stored(body):
+            return None
+        return value
+
+
+    def store(self, patch, value):
+        """Store the given digest through the given kopf patch.
+        """
+        if patch is None:
+            return
+        target = patch
+        for part in self.path[:-1]:
+            target = target.setdefault(part, {})
+        target[self.path[-1]] = value
+        if self.key.startswith(f'{ANNOTATION_PREFIX}/'):
+            target[MANAGED_MARKER] = 'yes'
@@ -0,0 +1,360 @@
+import collections.abc
+import threading
+
+from .cache import ModelCache
+from .parsing import construct, parse_cached
+from .registry import ResourceRegistry, ResourceNotFoundError
+
+
+
+# apiVersion, kind, uid and resourceVersion precede the projected values.
+_HEADER = 4
+
+
+
+class Projection(tuple):
+    """Compact, tuple based, projection of a resource body.
+
+    Holds the apiVersion, kind, uid and resourceVersion of the resource
+    followed by the values of the projected fields. Subclasses are generated
+    per CompactIndex and define the field paths in _paths.
+    """
+    __slots__ = ()
+    _paths = ()
+
+
+    def __getattr__(self, name):
+        # Access values by the last part of their path, e.g. `server`
+        # for `spec.server`.
+        for path, value in zip(self._paths, self[_HEADER:]):
+            if path.rpartition('.')[-1] == name:
+                return value
+        raise AttributeError(name)
+
+
+    def get(self, path, default=None):
+        """Return the value of the given field path.
+        """
+        try:
+            return self[_HEADER + self._paths.index(path)]
+        except ValueError:
+            return default
+
+
+    def as_dict(self):
+        """Return the projection as nested body dict.
+        """
+        data = {'apiVersion': self[0], 'kind': self[1]}
+        for path, value in zip(self._paths, self[_HEADER:]):
+            if value is None:
+                continue
+            *parents, name = path.split('.')
+            target = data
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[name] = value
+        return data
+
+
+    def model(self):
+        """Build a partial resource model from the projection.
+
+        Only the projected fields are set, the model is not validated.
+        """
+        resource_class = ResourceRegistry.get(self[0], self[1])
+        return construct(resource_class, self.as_dict())
+
+
+    def key(self):
+        """Return the memo key of the projection or None if the resource
+        had no uid or resourceVersion.
+        """
+        if not self[2] or not self[3]:
+            return None
+        return (type(self), self[2], self[3])
+
+
+    def __repr__(self):
+        values = ', '.join(f'{p}={v!r}' for p,v in zip(self._paths, self[_HEADER:]))
+        return f'{type(self).__name__}({self[0]}/{self[1]}, {values})'
+
+
+
+def _getter(path):
+    """Return a function that gets the value at the given dotted path from
+    a body or None if it does not exist.
+    """
+    parts = tuple(path.split('.'))
+    def get(body):
+        value = body
+        for part in parts:
+            try:
+                value = value[part]
+            except (KeyError, TypeError):
+                return None
+        return value
+    return get
+
+
+
+# Models built from projections, keyed by the projection class, uid and
+# resourceVersion of the resource.
+_memo = ModelCache(maxsize=4096)
+
+
+
+def _model(projection):
+    """Return the partial model of the given projection, shared through
+    the memo.
+    """
+    key = projection.key()
+    if key is None:
+        return projection.model()
+    model = _memo.get(key)
+    if model is None:
+        model = projection.model()
+        _memo.put(key, model)
+    return model
+
+
+
+class CompactIndex():
+    """Declarative kopf index that stores compact projections of resources
+    instead of full models.
+
+    key: dotted path, tuple of dotted paths or a callable that returns the
+      key for a body. Defaults to (namespace, name).
+    fields: dotted paths of the fields to store, e.g. 'spec.server'.
+      Whole subtrees like 'spec.issuerRef' can be projected as well.
+
+    e.g.
+    ```
+        issuers_index = CompactIndex('issuers', fields=('spec.server', 'spec.role'))
+        Issuer.index(issuers_index)
+        ClusterIssuer.index(issuers_index)
+
+        @HostCertificate.on.create
+        async def create(issuers: kopf.Index, **_):
+            issuer = issuers_index.get(issuers, (None, 'my-cluster-issuer'))
+            print(issuer.spec.server)
+    ```
+    """
+
+    def __init__(self, id, key=('metadata.namespace', 'metadata.name'), fields=()):
+        self.id = id
+        self.fields = tuple(fields)
+        if callable(key):
+            self.key = key
+        elif isinstance(key, str):
+            self.key = _getter(key)
+        else:
+            getters = tuple(_getter(path) for path in key)
+            self.key = lambda body: tuple(get(body) for get in getters)
+        self.__getters = tuple(_getter(path) for path in self.fields)
+        name = ''.join(p.capitalize() for p in id.replace('-', '_').split('_'))
+        self.projection_class = type(f'{name}Projection', (Projection,), {
+            '__slots__': (),
+            '_paths': self.fields,
+        })
+
+
+    def project(self, body):
+        """Return the projection of the given body.
+        """
+        metadata = body.get('metadata') or {}
+        values = [body.get('apiVersion'), body.get('kind'),
+            metadata.get('uid'), metadata.get('resourceVersion')]
+        values.extend(get(body) for get in self.__getters)
+        return self.projection_class(values)
+
+
+    async def handler(self, body, **_):
+        """The kopf index handler.
+        """
+        return {self.key(body): self.project(body)}
+
+
+    def register(self, *resource_classes, **kwargs):
+        """Register the index handler for the given resource classes.
+
+        Any kwargs are passed on to the kopf.on.index decorator.
+        """
+        for resource_class in resource_classes:
+            resource_class.on.index(id=self.id, **kwargs)(self.handler)
+        return self
+
+
+    def values(self, index, key):
+        """Return the projections stored under key in the given kopf.Index.
+
+        Raises KeyError if there are none.
+        """
+        return list(index[key])
+
+
+    def get_all(self, index, key):
+        """Return partial models of all resources stored under key in the
+        given kopf.Index.
+
+        Raises KeyError if there are none. The models are shared, see
+        ResourceIndex, and must be treated as read only.
+        """
+        return [_model(projection) for projection in index[key]]
+
+
+    def get(self, index, key, default=None):
+        """Return a partial model of the first resource stored under key in
+        the given kopf.Index or default.
+        """
+        try:
+            store = index[key]
+        except KeyError:
+            return default
+        for projection in store:
+            return _model(projection)
+        return default
+
+
+
+class ResourceIndex(collections.abc.Mapping):
+    """Typed, read only view of a kopf.Index that holds resources.
+
+    Use `ResourceIndex[Issuer]` as type hint of an index argument of a
+    handler to get the kopf.Index wrapped. The values in the index can be
+    raw bodies, Projections of a CompactIndex or models. They are turned
+    into models only when looked up. Models of bodies are shared through
+    the model cache, those of projections through `memo`.
+
+    Several resource classes can be given, e.g. a namespaced and a cluster
+    scoped one that share an index keyed by (namespace, name). lookup then
+    falls back from the namespace to the cluster scope.
+
+    e.g.
+    ```
+        @HostCertificate.on.create
+        async def create(body: HostCertificate,
+                issuers: ResourceIndex[Issuer, ClusterIssuer], **_):
+            ref = body.spec.issuerRef
+            issuer = issuers.lookup(body.metadata.namespace, ref.name, kind=ref.kind)
+    ```
+    """
+
+    # Set on the classes created by __class_getitem__.
+    resource_classes = ()
+
+    # Models built from projections, shared with CompactIndex.
+    memo = _memo
+
+    __variants = {}
+    __variants_lock = threading.Lock()
+
+
+    def __class_getitem__(cls, resource_classes):
+        if not isinstance(resource_classes, tuple):
+            resource_classes = (resource_classes,)
+        with cls.__variants_lock:
+            try:
+                return cls.__variants[resource_classes]
+            except KeyError:
+                name = ''.join(c.__name__ for c in resource_classes) + 'Index'
+                variant = type(name, (cls,), {
+                    'resource_classes': resource_classes,
+                    '__module__': resource_classes[0].__module__,
+                })
+                cls.__variants[resource_classes] = variant
+                return variant
+
+
+    def __init__(self, index, trusted=None):
+        self.index = index
+        self.trusted = trusted
+
+
+    def __getitem__(self, key):
+        return [self.model(value) for value in self.index[key]]
+
+
+    def __iter__(self):
+        return iter(self.index)
+
+
+    def __len__(self):
+        return len(self.index)
+
+
+    def __contains__(self, key):
+        return key in self.index
+
+
+    def one(self, key, default=None, kind=None):
+        """Return the model of the first resource stored under key, only
+        considering resources of the given kind if any, or default.
+        """
+        try:
+            store = self.index[key]
+        except KeyError:
+            return default
+        for value in store:
+            if kind is None or _kind(value) == kind:
+                return self.model(value)
+        return default
+
+
+    def lookup(self, namespace, name, kind=None, default=None):
+        """Return the resource with the given name in the given namespace,
+        falling back to the cluster scoped resource of that name.
+
+        With a kind, only resources of that kind are returned and only its
+        scope is searched.
+        """
+        keys = [(namespace, name), (None, name)]
+        if namespace is None:
+            del keys[0]
+        elif kind is not None:
+            resource_class = self.__class_for_kind(kind)
+            if resource_class is not None:
+                if resource_class.__spec__['scope'] == 'Cluster':
+                    del keys[0]
+                else:
+                    del keys[1]
+        for key in keys:
+            model = self.one(key, kind=kind)
+            if model is not None:
+                return model
+        return default
+
+
+    def model(self, value):
+        """Return the model for a value stored in the index.
+        """
+        if isinstance(value, Projection):
+            return _model(value)
+        if isinstance(value, collections.abc.Mapping):
+            resource_class = self.__resource_class(value.get('apiVersion'), value.get('kind'))
+            return parse_cached(resource_class, value, trusted=self.trusted)
+        return value
+
+
+    def __resource_class(self, api_version, kind):
+        try:
+            return ResourceRegistry.get(api_version, kind)
+        except ResourceNotFoundError:
+            if self.resource_classes:
+                return self.resource_classes[0]
+            raise
+
+
+    def __class_for_kind(self, kind):
+        for resource_class in self.resource_classes:
+            if resource_class.__kind__ == kind:
+                return resource_class
+        return None
+
+
+
+def _kind(value):
+    if isinstance(value, Projection):
+        return value[1]
+    if isinstance(value, collections.abc.Mapping):
+        return value.get('kind')
+    return getattr(value, 'kind', None)
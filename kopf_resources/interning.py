@@ -0,0 +1,128 @@
+"""Memory compact field types for models that are kept around in numbers,
+e.g. ObjectMeta.
+
+InternedStr, InternedStrDict and InternedStrList intern the strings they
+validate, so namespaces, label keys and the like are stored once instead
+of once per object. The dicts and lists themselves stay per instance and
+mutable.
+
+The types work with both model backends: pydantic v1 uses
+__get_validators__ and __modify_schema__, pydantic v2
+__get_pydantic_core_schema__. Models built without validation, e.g.
+trusted ones, keep the values as they are.
+"""
+import sys
+
+from .backends import backend
+
+
+
+# Longer values, e.g. the last-applied-configuration annotation, are
+# unlikely to repeat and not worth hashing for interning.
+INTERN_MAX_LENGTH = 64
+
+
+
+def intern(value):
+    """Return the interned value of the given string unless it is too long.
+    """
+    if len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+
+def _check_str(value):
+    if not isinstance(value, str):
+        raise TypeError('string required')
+    return value
+
+
+
+def compact_str(value):
+    return intern(_check_str(value))
+
+
+
+def compact_dict(value):
+    """Return a dict of interned strings.
+    """
+    if not isinstance(value, dict):
+        raise TypeError('dict required')
+    return {intern(_check_str(k)): intern(_check_str(v)) for k,v in value.items()}
+
+
+
+def compact_list(value):
+    """Return a list of interned strings.
+    """
+    if not isinstance(value, (list, tuple)):
+        raise TypeError('list required')
+    return [intern(_check_str(v)) for v in value]
+
+
+
+def _core_schema(function, schema):
+    from pydantic_core import core_schema
+    return core_schema.no_info_after_validator_function(function, schema)
+
+
+
+class InternedStr(str):
+    """A str field whose values are interned.
+    """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield compact_str
+
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        from pydantic_core import core_schema
+        return _core_schema(intern, core_schema.str_schema())
+
+
+
+class InternedStrDict(dict):
+    """A Dict[str,str] field with interned keys and values.
+    """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield compact_dict
+
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        from pydantic_core import core_schema
+        return _core_schema(compact_dict,
+            core_schema.dict_schema(core_schema.str_schema(), core_schema.str_schema()))
+
+
+
+class InternedStrList(list):
+    """A List[str] field with interned items.
+    """
+
+    @classmethod
+    def __get_validators__(cls):
+        yield compact_list
+
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        from pydantic_core import core_schema
+        return _core_schema(compact_list, core_schema.list_schema(core_schema.str_schema()))
+
+
+
+# pydantic v2 refuses classes with a __modify_schema__, v1 needs it for
+# more than a bare type in the schema.
+if backend.name == 'pydantic_v1':
+    InternedStr.__modify_schema__ = classmethod(
+        lambda cls, field_schema: field_schema.update(type='string'))
+    InternedStrDict.__modify_schema__ = classmethod(
+        lambda cls, field_schema: field_schema.update(type='object', additionalProperties={'type': 'string'}))
+    InternedStrList.__modify_schema__ = classmethod(
+        lambda cls, field_schema: field_schema.update(type='array', items={'type': 'string'}))
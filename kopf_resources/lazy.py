@@ -0,0 +1,134 @@
+import threading
+
+from . import metrics
+from .backends import backend
+from .parsing import parse_field
+
+
+
+class LazyResource():
+    """Lazy, field on demand, variant of a resource model.
+
+    Only `apiVersion`, `kind` and `metadata` are parsed up front. All other
+    fields, e.g. `spec` and `status`, are validated and built the first time
+    they are accessed and then cached on the instance.
+
+    Use `LazyResource[SomeResource]` to get the lazy variant of a resource
+    class. This can be used as a type hint on handler arguments or be
+    called with a body. `from_dict(body, lazy=True)` returns lazy instances
+    as well.
+
+    e.g.
+    ```
+        @HostCertificate.on.field(field='spec.secretName')
+        def secret_changed(body: LazyResource[HostCertificate], **_):
+            print(body.metadata.name, body.spec.secretName)
+    ```
+
+    Attributes that are not fields, e.g. methods like `dict()`, are looked
+    up on the fully built model, see `model()`.
+
+    Lazy instances are not instances of their resource class, i.e.
+    `isinstance(LazyResource[Issuer](body), Issuer)` is false, as making
+    them one would make them pass as pydantic models as well. Code that
+    dispatches on the resource class has to check `resource_class` or use
+    the fully built `model()`.
+    """
+
+    # Set on the classes created by __class_getitem__.
+    resource_class = None
+
+    # Fields that are parsed up front.
+    eager_fields = ('apiVersion', 'kind', 'metadata')
+
+    __variants = {}
+    __variants_lock = threading.Lock()
+
+
+    def __class_getitem__(cls, resource_class):
+        with cls.__variants_lock:
+            try:
+                return cls.__variants[resource_class]
+            except KeyError:
+                name = f'Lazy{resource_class.__name__}'
+                variant = type(name, (cls,), {
+                    'resource_class': resource_class,
+                    '__trusted__': getattr(resource_class, '__trusted__', False),
+                    '__module__': resource_class.__module__,
+                })
+                cls.__variants[resource_class] = variant
+                return variant
+
+
+    def __init__(self, body, trusted=None):
+        resource_class = self.resource_class
+        if resource_class is None:
+            raise TypeError('Use LazyResource[SomeResource] to create lazy resources.')
+        values = {}
+        raw = {}
+        for name, alias in backend.aliases(resource_class).items():
+            if name in self.eager_fields:
+                values[name] = parse_field(resource_class, name, body, trusted)
+            elif alias in body:
+                # Only keep a reference to the raw subtree. kopf replaces
+                # the bodies it passes to handlers instead of modifying
+                # them, so this stays valid.
+                raw[alias] = body[alias]
+        # Bypass our own __setattr__.
+        object.__setattr__(self, '_LazyResource__trusted', trusted)
+        object.__setattr__(self, '_LazyResource__values', values)
+        object.__setattr__(self, '_LazyResource__raw', raw)
+        object.__setattr__(self, '_LazyResource__model', None)
+
+
+    def __getattr__(self, name):
+        # Only called if normal attribute lookup fails.
+        resource_class = self.resource_class
+        if name.startswith('_LazyResource__') or resource_class is None:
+            raise AttributeError(name)
+        values = self.__values
+        if name in backend.aliases(resource_class):
+            if name not in values:
+                values[name] = parse_field(resource_class, name, self.__raw, self.__trusted)
+            return values[name]
+        return getattr(self.model(), name)
+
+
+    def __setattr__(self, name, value):
+        raise TypeError(f'{type(self).__name__} is read only.')
+
+
+    def model(self):
+        """Build and return the full resource model.
+        """
+        if self.__model is None:
+            resource_class = self.resource_class
+            values = self.__values
+            aliases = backend.aliases(resource_class)
+            for name in aliases:
+                if name not in values:
+                    values[name] = parse_field(resource_class, name, self.__raw, self.__trusted)
+            fields_set = {
+                name for name, alias in aliases.items()
+                if name in self.eager_fields or alias in self.__raw
+            }
+            model = backend.build(resource_class, values, fields_set)
+            object.__setattr__(self, '_LazyResource__model', model)
+        return self.__model
+
+
+    def __str__(self):
+        return f'<LazyResource {self.resource_class.__name__} {self.metadata}>'
+
+
+    def __repr__(self):
+        return f'{type(self).__name__}(apiVersion={self.apiVersion!r}, kind={self.kind!r}, metadata={self.metadata!r})'
+
+
+
+def parse_lazy(lazy_class, body, trusted=None):
+    """Parser function for parsing.parse_cached.
+    """
+    if metrics.active:
+        return metrics.timed_parse('lazy', lambda cls, data: cls(data, trusted=trusted), lazy_class, body)
+    return lazy_class(body, trusted=trusted)
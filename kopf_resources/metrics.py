@@ -0,0 +1,448 @@
+"""Performance metrics of kopf_resources.
+
+Parsing, the model cache, the handlers registered through the resource
+decorators, CRD generation and admission are instrumented and report to
+the configured sink. The default NullSink is disabled, then the
+instrumentation is skipped after a single check.
+
+e.g.
+```
+    sink = kopf_resources.metrics.PrometheusSink()
+    kopf_resources.metrics.set_sink(sink)
+
+    @kopf.on.startup()
+    async def startup(**_):
+        await sink.start(port=9090)
+```
+
+Slow handler calls can additionally be profiled with a SlowCallProfiler,
+see set_profiler.
+"""
+import bisect
+import collections
+import functools
+import json
+import logging
+import random
+import sys
+import threading
+import time
+
+from aiohttp import web
+
+
+log = logging.getLogger(__name__)
+
+
+
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name -> (type, help, histogram buckets)
+METRICS = {
+    'kopf_resources_parse_seconds': ('histogram',
+        'Time spent parsing bodies into models.', SECONDS_BUCKETS),
+    'kopf_resources_body_bytes': ('histogram',
+        'Size of the parsed bodies as json.', BYTES_BUCKETS),
+    'kopf_resources_cache_total': ('counter',
+        'Model cache lookups by result.', None),
+    'kopf_resources_handler_seconds': ('histogram',
+        'Duration of handler calls, including parsing.', SECONDS_BUCKETS),
+    'kopf_resources_handler_errors_total': ('counter',
+        'Handler calls that raised, by exception type.', None),
+    'kopf_resources_handler_skipped_total': ('counter',
+        'Handler calls skipped because the digest did not change.', None),
+    'kopf_resources_handler_debounced_total': ('counter',
+        'Handler calls delayed to coalesce changes.', None),
+    'kopf_resources_crd_seconds': ('histogram',
+        'Time spent in as_crd.', SECONDS_BUCKETS),
+    'kopf_resources_crd_cache_total': ('counter',
+        'CRD memo lookups by result.', None),
+    'kopf_resources_admission_seconds': ('histogram',
+        'Duration of admission checks.', SECONDS_BUCKETS),
+    'kopf_resources_admission_rejected_total': ('counter',
+        'Rejected admission requests by reason.', None),
+}
+
+
+
+class Sink():
+    """Base class of metrics sinks.
+
+    labels are dicts of label name -> value.
+    """
+    enabled = True
+    # Whether to measure the size of parsed bodies, which means serializing
+    # them.
+    body_sizes = False
+
+    def inc(self, name, labels, value=1):
+        pass
+
+
+    def observe(self, name, labels, value):
+        pass
+
+
+
+class NullSink(Sink):
+    """The default sink, disables all instrumentation.
+    """
+    enabled = False
+
+
+
+class PrometheusSink(Sink):
+    """Collects the metrics in memory and renders them in the Prometheus
+    text exposition format.
+    """
+
+    def __init__(self, body_sizes=False):
+        self.body_sizes = body_sizes
+        self.__lock = threading.Lock()
+        # (name, labels) -> value
+        self.__counters = {}
+        # (name, labels) -> [bucket counts..., sum, count]
+        self.__histograms = {}
+        self.runner = None
+
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(labels.items()))
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+
+    def observe(self, name, labels, value):
+        buckets = _buckets(name)
+        key = (name, tuple(labels.items()))
+        with self.__lock:
+            histogram = self.__histograms.get(key)
+            if histogram is None:
+                histogram = self.__histograms[key] = [0] * (len(buckets) + 2)
+            # Buckets are cumulative when rendered.
+            histogram[bisect.bisect_left(buckets, value)] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+
+    def clear(self):
+        with self.__lock:
+            self.__counters.clear()
+            self.__histograms.clear()
+
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format.
+        """
+        with self.__lock:
+            counters = sorted(self.__counters.items())
+            histograms = sorted((k, list(v)) for k,v in self.__histograms.items())
+        lines = []
+        seen = set()
+        def header(name, default_type):
+            if name not in seen:
+                seen.add(name)
+                type_, help, _ = METRICS.get(name, (default_type, None, None))
+                if help:
+                    lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {type_}')
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f'{name}{_format_labels(labels)} {value}')
+        for (name, labels), histogram in histograms:
+            header(name, 'histogram')
+            total = 0
+            for bound, count in zip(_buckets(name) + (float('inf'),), histogram):
+                total += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{name}_bucket{_format_labels(labels + (("le", le),))} {total}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-2]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+    async def handle(self, request):
+        return web.Response(text=self.render(),
+            content_type='text/plain', charset='utf-8',
+            headers={'X-Content-Type-Options': 'nosniff'})
+
+
+    async def start(self, host='0.0.0.0', port=9090, path='/metrics'):
+        """Serve the metrics over http, e.g. from a kopf startup handler.
+        """
+        app = web.Application()
+        app.router.add_get(path, self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        log.info('Metrics listening on %s:%s%s', host, port, path)
+
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+
+def _buckets(name):
+    definition = METRICS.get(name)
+    if definition is None or definition[2] is None:
+        return SECONDS_BUCKETS
+    return definition[2]
+
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k,v in labels) + '}'
+
+
+
+class SlowCallProfiler():
+    """Sampling profiler for slow handler calls.
+
+    A background thread samples the stack of the thread that runs a
+    handler call every `interval` seconds. Calls that take at least
+    `threshold` seconds are reported to callback(handler_id, seconds,
+    samples), samples being a collections.Counter of stacks, each a tuple of
+    (filename, lineno, function) tuples, outermost first. The default
+    callback logs the most common stacks.
+
+    Only sample_rate of the calls are sampled. The stacks of async handlers
+    are those of the event loop thread, so they can include other tasks
+    that ran while the handler was waiting.
+
+    The thread is started by the first sampled call and waits without
+    waking up while no call is sampled. stop ends it.
+    """
+
+    def __init__(self, threshold=1.0, interval=0.005, sample_rate=1.0,
+            callback=None, max_depth=30):
+        self.threshold = threshold
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.callback = callback or self.log
+        self.max_depth = max_depth
+        self.__lock = threading.Lock()
+        # token -> (thread id, samples)
+        self.__calls = {}
+        self.__thread = None
+        # Set while calls are sampled or the thread should stop.
+        self.__wakeup = threading.Event()
+
+
+    def begin(self):
+        """Start sampling the current thread. Returns a token for end or
+        None if this call is not sampled.
+        """
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return None
+        token = object()
+        with self.__lock:
+            self.__calls[token] = (threading.get_ident(), collections.Counter())
+            self.__wakeup.set()
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run,
+                    name='kopf_resources-profiler', daemon=True)
+                self.__thread.start()
+        return token
+
+
+    def end(self, token, handler_id, seconds):
+        with self.__lock:
+            _, samples = self.__calls.pop(token)
+        if seconds >= self.threshold:
+            try:
+                self.callback(handler_id, seconds, samples)
+            except Exception:
+                log.exception('SlowCallProfiler callback failed.')
+
+
+    def stop(self):
+        """Stop the sampling thread. It is started again by the next
+        sampled call.
+        """
+        with self.__lock:
+            thread = self.__thread
+            self.__thread = None
+            self.__wakeup.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+    def __run(self):
+        thread = threading.current_thread()
+        while True:
+            self.__wakeup.wait()
+            time.sleep(self.interval)
+            with self.__lock:
+                if self.__thread is not thread:
+                    return
+                if not self.__calls:
+                    self.__wakeup.clear()
+                    continue
+                calls = list(self.__calls.values())
+            frames = sys._current_frames()
+            for thread_id, samples in calls:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[self.__stack(frame)] += 1
+
+
+    def __stack(self, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append((code.co_filename, frame.f_lineno, code.co_name))
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+
+    def log(self, handler_id, seconds, samples, top=3):
+        lines = [f'Slow handler call {handler_id}: {seconds:.3f}s, {sum(samples.values())} samples']
+        for stack, count in samples.most_common(top):
+            lines.append(f'  {count} samples:')
+            lines.extend(f'    {f}:{l} {n}' for f,l,n in stack)
+        log.warning('\n'.join(lines))
+
+
+
+sink = NullSink()
+profiler = None
+# Whether any instrumentation is needed, checked first on every hot path.
+active = False
+
+
+
+def set_sink(new_sink=None):
+    """Set the sink the metrics are reported to, None disables them.
+    """
+    global sink, active
+    sink = new_sink or NullSink()
+    active = sink.enabled or profiler is not None
+    return sink
+
+
+
+def set_profiler(new_profiler=None):
+    """Set the SlowCallProfiler for handler calls, None disables it.
+
+    The thread of the previous profiler is stopped.
+    """
+    global profiler, active
+    if profiler is not None and profiler is not new_profiler:
+        profiler.stop()
+    profiler = new_profiler
+    active = sink.enabled or profiler is not None
+    return profiler
+
+
+
+def inc(name, labels, value=1):
+    if sink.enabled:
+        sink.inc(name, labels, value)
+
+
+
+def observe(name, labels, value):
+    if sink.enabled:
+        sink.observe(name, labels, value)
+
+
+
+@functools.lru_cache(maxsize=None)
+def model_labels(model_class):
+    """Return the apiVersion and kind labels for the given model or
+    LazyResource class.
+    """
+    model_class = getattr(model_class, 'resource_class', None) or model_class
+    return {
+        'api_version': getattr(model_class, '__api_version__', None) or '',
+        'kind': getattr(model_class, '__kind__', None) or model_class.__name__,
+    }
+
+
+
+def body_labels(body):
+    try:
+        return {'api_version': body.get('apiVersion') or '', 'kind': body.get('kind') or ''}
+    except AttributeError:
+        return {'api_version': '', 'kind': ''}
+
+
+
+def timed_parse(mode, parser, model_class, data, *args, **kwargs):
+    """Call parser(model_class, data, ...) and report the parse time.
+    """
+    start = time.perf_counter()
+    try:
+        return parser(model_class, data, *args, **kwargs)
+    finally:
+        if sink.enabled:
+            labels = dict(model_labels(model_class), mode=mode)
+            sink.observe('kopf_resources_parse_seconds', labels, time.perf_counter() - start)
+            if sink.body_sizes:
+                size = len(json.dumps(dict(data), default=str))
+                sink.observe('kopf_resources_body_bytes', model_labels(model_class), size)
+
+
+
+class _HandlerCall():
+    __slots__ = ('handler_id', 'labels', 'start', 'token')
+
+    def __init__(self, handler_id, body):
+        self.handler_id = handler_id
+        self.labels = dict(body_labels(body), handler=handler_id)
+        self.token = profiler.begin() if profiler is not None else None
+        self.start = time.perf_counter()
+
+
+    def done(self, error=None):
+        seconds = time.perf_counter() - self.start
+        if self.token is not None:
+            profiler.end(self.token, self.handler_id, seconds)
+        if sink.enabled:
+            sink.observe('kopf_resources_handler_seconds', self.labels, seconds)
+            if error is not None:
+                sink.inc('kopf_resources_handler_errors_total',
+                    dict(self.labels, exception=type(error).__name__))
+
+
+
+def measure(handler_id, func, args, kwargs):
+    """Call func(args, kwargs) and report it as call of the given handler.
+    """
+    if not active:
+        return func(args, kwargs)
+    call = _HandlerCall(handler_id, kwargs.get('body'))
+    error = None
+    try:
+        return func(args, kwargs)
+    except Exception as e:
+        # Cancellations and exits are no handler errors.
+        error = e
+        raise
+    finally:
+        call.done(error)
+
+
+
+async def measure_async(handler_id, func, args, kwargs):
+    """Like measure for async functions.
+    """
+    if not active:
+        return await func(args, kwargs)
+    call = _HandlerCall(handler_id, kwargs.get('body'))
+    error = None
+    try:
+        return await func(args, kwargs)
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        call.done(error)
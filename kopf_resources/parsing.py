@@ -0,0 +1,67 @@
+import functools
+
+from . import metrics
+from .backends import backend
+from .cache import default_cache
+
+
+
+def parse(model_class, data, trusted=None):
+    """Parse the given data into an instance of model_class.
+
+    If trusted is true the model is built without validation, see construct.
+    If trusted is None the resource classes `trusted` setting is used.
+    """
+    if trusted is None:
+        trusted = getattr(model_class, '__trusted__', False)
+    if trusted:
+        if metrics.active:
+            return metrics.timed_parse('trusted', construct, model_class, data)
+        return construct(model_class, data)
+    if metrics.active:
+        return metrics.timed_parse('validated', backend.parse, model_class, data)
+    return backend.parse(model_class, data)
+
+
+
+def parse_cached(model_class, data, trusted=None, cache=None, parser=parse):
+    """Like parse but share the resulting model through the given or the
+    default ModelCache.
+    """
+    if trusted is None:
+        trusted = getattr(model_class, '__trusted__', False)
+    if cache is None:
+        cache = default_cache
+    parser = functools.partial(parser, model_class, trusted=trusted)
+    return cache.parse(model_class, data, parser=parser,
+        tag='trusted' if trusted else None)
+
+
+
+def parse_field(model_class, name, data, trusted=None):
+    """Parse the value of a single field of model_class from data.
+
+    This is used to build models piece by piece, e.g. by LazyResource.
+    Validators that depend on other fields and root validators are not run,
+    with the pydantic v2 backend neither are the field validators.
+    """
+    if trusted is None:
+        trusted = getattr(model_class, '__trusted__', False)
+    return backend.parse_field(model_class, name, data, trusted)
+
+
+
+def construct(model_class, data):
+    """Recursively build an instance of model_class from data without
+    validating it.
+
+    Unlike pydantic's own `construct` this also builds nested models, e.g.
+    the `spec` and `metadata` of a resource, including models in lists
+    and dicts.
+
+    Only use this for data that has already been validated, e.g. bodies
+    of custom resources which the apiserver has checked against the CRD's
+    openAPIV3Schema. Values are not coerced and containers of plain values
+    are shared with data, so treat the result as read only.
+    """
+    return backend.construct(model_class, data)
@@ -0,0 +1,102 @@
+import copy
+
+from .backends import backend
+
+
+
+def merge_patch(old, new):
+    """Return the JSON merge patch (RFC 7386) that turns old into new.
+
+    Unchanged values are left out, removed keys are set to None. Returns
+    an empty dict if there are no changes.
+    """
+    patch = {}
+    for key, value in new.items():
+        if key not in old:
+            patch[key] = value
+            continue
+        old_value = old[key]
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            nested = merge_patch(old_value, value)
+            if nested:
+                patch[key] = nested
+        elif value != old_value:
+            patch[key] = value
+    for key in old:
+        if key not in new:
+            patch[key] = None
+    return patch
+
+
+
+def merge_into(target, patch):
+    """Merge the given merge patch into target, e.g. a kopf.Patch, so that
+    consecutive patches end up in one.
+    """
+    for key, value in patch.items():
+        current = target.get(key)
+        if isinstance(value, dict) and isinstance(current, dict):
+            merge_into(current, value)
+        else:
+            target[key] = copy.deepcopy(value)
+    return target
+
+
+
+def _dump(status):
+    if status is None:
+        return None
+    return backend.dump(status, by_alias=True)
+
+
+
+class StatusTracker():
+    """Tracks the status of a resource model and computes minimal merge
+    patches for the changes made to it.
+
+    e.g.
+    ```
+        @HostCertificate.on.update
+        def update(body: HostCertificate, patch, **_):
+            tracker = body.track_status()
+            body.status.phase = 'Issuing'
+            tracker.apply(patch)
+            ...
+            body.status.phase = 'Ready'
+            tracker.apply(patch)
+    ```
+    Both changes end up in the one status patch that kopf sends after the
+    handler returned. If nothing changed nothing is patched.
+
+    The tracked model is modified by the handler, so don't track models that
+    are shared through the model cache, copy them first or use the
+    decorators' `patch_status` option.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.__applied = _dump(model.status)
+
+
+    def patch(self):
+        """Return the merge patch for the status changes since the last
+        apply, or an empty dict if there are none.
+        """
+        current = _dump(self.model.status)
+        if current == self.__applied:
+            return {}
+        if current is None or self.__applied is None:
+            return {'status': current}
+        return {'status': merge_patch(self.__applied, current)}
+
+
+    def apply(self, patch):
+        """Merge the status changes since the last apply into the given
+        kopf patch. Returns whether there were changes.
+        """
+        status_patch = self.patch()
+        if not status_patch:
+            return False
+        merge_into(patch, status_patch)
+        self.__applied = _dump(self.model.status)
+        return True
@@ -1,3 +1,23 @@
+import importlib
+import importlib.metadata
+import threading
+
+
+
+# Entry point group of lazily registered resource modules, e.g. in setup.py:
+#
+#    entry_points={
+#        'kopf_resources.resources': [
+#            'ssh-cert-manager.io = ssh_cert_manager.resources',
+#        ],
+#    }
+#
+# The name is the API group, the value the module that defines its resource
+# classes. The module is only imported when a resource of that group is
+# looked up for the first time.
+ENTRY_POINT_GROUP = 'kopf_resources.resources'
+
+
 
 class ResourceNotFoundError(Exception):
     pass
@@ -5,48 +25,176 @@ class ResourceNotFoundError(Exception):
 
 
 class ResourceRegistry():
+    """Registry of all resource classes.
+
+    Resource classes are looked up by (apiVersion, kind), (group, plural)
+    or fqname, e.g. `issuers.ssh-cert-manager.io`, and version.
+
+    Modules that define resource classes can be registered lazily by API
+    group with add_lazy or through entry points. They are imported on the
+    first lookup of a resource of their group.
+    """
+    __lock = threading.RLock()
+    # fqname -> {version: resource_class}
     __versions = {}
+    # (apiVersion, kind) -> resource_class
     __resources = {}
+    # (group, plural) -> fqname
+    __plurals = {}
+    # group -> [module path, ...] not imported yet
+    __lazy = {}
+    __entry_points_loaded = False
 
 
     @classmethod
     def add(cls, resource_class):
-        # To get all versions of a resource.
-        cls.__versions.setdefault(resource_class.__fqname__, {})
-        cls.__versions[resource_class.__fqname__][resource_class.__version__] = resource_class
-        # For easy access via (apiVersion, kind) tuple.
-        key = (resource_class.__api_version__, resource_class.__kind__)
-        cls.__resources[key] = resource_class
+        with cls.__lock:
+            fqname = resource_class.__fqname__
+            # To get all versions of a resource.
+            cls.__versions.setdefault(fqname, {})[resource_class.__version__] = resource_class
+            # For easy access via (apiVersion, kind) tuple.
+            key = (resource_class.__api_version__, resource_class.__kind__)
+            cls.__resources[key] = resource_class
+            # For access by the group and plural kopf uses.
+            cls.__plurals[(resource_class.__group__, resource_class.__plural__)] = fqname
+
+
+    @classmethod
+    def add_lazy(cls, group, module):
+        """Register a module that defines the resource classes of the given
+        API group. It is imported on the first lookup of a resource of that
+        group.
+        """
+        with cls.__lock:
+            modules = cls.__lazy.setdefault(group, [])
+            if module not in modules:
+                modules.append(module)
+
+
+    @classmethod
+    def load_entry_points(cls, group=ENTRY_POINT_GROUP):
+        """Register the resource modules of the given entry point group
+        lazily, see ENTRY_POINT_GROUP.
+
+        Called automatically on the first failed lookup.
+        """
+        with cls.__lock:
+            cls.__entry_points_loaded = True
+            entry_points = importlib.metadata.entry_points()
+            if hasattr(entry_points, 'select'):
+                entry_points = entry_points.select(group=group)
+            else:
+                # python < 3.10
+                entry_points = entry_points.get(group, ())
+            for entry_point in entry_points:
+                cls.add_lazy(entry_point.name, entry_point.value.partition(':')[0])
+
+
+    @classmethod
+    def __load(cls, group=None):
+        """Import the lazily registered modules of the given group, or of
+        all groups if group is None. Returns whether anything was imported.
+
+        Modules stay registered until they were imported successfully, so
+        a failed import is retried on the next lookup.
+        """
+        with cls.__lock:
+            if not cls.__entry_points_loaded:
+                cls.load_entry_points()
+            if group is None:
+                groups = list(cls.__lazy)
+            elif group in cls.__lazy:
+                groups = [group]
+            else:
+                return False
+            for name in groups:
+                # Popped first, so lookups from within the imported modules
+                # don't import them again.
+                modules = cls.__lazy.pop(name, ())
+                for index, module in enumerate(modules):
+                    try:
+                        importlib.import_module(module)
+                    except BaseException:
+                        cls.__lazy.setdefault(name, [])[:0] = modules[index:]
+                        raise
+            return bool(groups)
+
+
+    @classmethod
+    def __lookup(cls, index, key, group):
+        # Lookups of registered classes don't need the lock.
+        try:
+            return index[key]
+        except KeyError:
+            pass
+        with cls.__lock:
+            if key not in index:
+                cls.__load(group)
+            return index.get(key)
 
 
     @classmethod
     def get(cls, api_version, kind):
         key = (api_version, kind)
-        try:
-            return cls.__resources[key]
-        except KeyError as e:
+        group = api_version.rpartition('/')[0]
+        resource_class = cls.__lookup(cls.__resources, key, group)
+        if resource_class is None:
             msg = f'Could not find resource class for: {key}'
-            raise ResourceNotFoundError() from e
+            raise ResourceNotFoundError(msg)
+        return resource_class
 
 
     @classmethod
     def get_version(cls, fqname, version):
+        group = fqname.partition('.')[-1]
+        versions = cls.__lookup(cls.__versions, fqname, group) or {}
         try:
-            return cls.__versions[fqname][version]
+            return versions[version]
         except KeyError as e:
             msg = f'Could not find resource class for: {fqname}, {version}'
-            raise ResourceNotFoundError() from e
+            raise ResourceNotFoundError(msg) from e
+
+
+    @classmethod
+    def get_plural(cls, group, plural, version=None):
+        """Return the resource class for the given group, plural and
+        version. If version is None the storage version is returned.
+        """
+        fqname = cls.__lookup(cls.__plurals, (group, plural), group)
+        if fqname is None:
+            msg = f'Could not find resource class for: {(group, plural)}'
+            raise ResourceNotFoundError(msg)
+        if version is not None:
+            return cls.get_version(fqname, version)
+        versions = list(cls.__versions[fqname].values())
+        for resource_class in versions:
+            if resource_class.__storage__:
+                return resource_class
+        return versions[-1]
 
 
     @classmethod
     def iter_versions(cls, resource_class):
-        try:
-            return iter(cls.__versions[resource_class.__fqname__].items())
-        except KeyError as e:
+        """Return an iterator over the (version, resource_class) tuples of
+        all versions of the given resource class.
+        """
+        fqname = resource_class.__fqname__
+        versions = cls.__lookup(cls.__versions, fqname, resource_class.__group__)
+        if versions is None:
             msg = f'Could not find resource classes for: {fqname}'
-            raise ResourceNotFoundError() from e
+            raise ResourceNotFoundError(msg)
+        with cls.__lock:
+            return iter(list(versions.items()))
 
 
     @classmethod
     def iter_resources(cls):
-        return iter(cls.__resources.values())
+        """Return an iterator over all versions of all resource classes.
+
+        Imports all lazily registered modules.
+        """
+        with cls.__lock:
+            cls.__load()
+            return iter([resource_class
+                for versions in cls.__versions.values()
+                for resource_class in versions.values()])
@@ -0,0 +1,567 @@
+"""Offline replay of resource events through the registered handlers.
+
+Replays create/update/delete streams through the handlers registered with
+`Resource.on.*` and `Resource.index`, without kopf and without an
+apiserver, e.g. to benchmark handlers or to reproduce problems with
+recorded events.
+
+e.g.
+```
+    # Before the handlers are registered.
+    replay.record()
+    ...
+    bodies = list(synthesize(Issuer, count=10)) + list(synthesize(HostCertificate, count=100))
+    stats = replay(synthetic_events(bodies, updates=2))
+    print(stats.summary())
+```
+
+The FakeDispatcher only does what is needed to drive handlers: indexes are
+updated before the other handlers are called, `when`, `labels`,
+`annotations` and `field` filters are applied and temporary errors can be
+retried right away. Patches are collected but not applied, daemons,
+timers and admission handlers are not run.
+"""
+import asyncio
+import collections
+import collections.abc
+import copy
+import inspect
+import json
+import logging
+import random
+import string
+import time
+import uuid
+
+import kopf
+
+from .crd import as_crd
+from .registry import ResourceRegistry
+from .resources import DecoratorWrapper
+from .stream import iter_documents
+
+
+log = logging.getLogger(__name__)
+
+
+
+Event = collections.namedtuple('Event', ('type', 'body'))
+Event.__doc__ = """A resource event. type is one of EVENT_TYPES.
+"""
+
+EVENT_TYPES = ('create', 'update', 'delete', 'resume')
+
+Registration = collections.namedtuple('Registration', ('name', 'args', 'kwargs', 'func'))
+Registration.__doc__ = """A handler registered through a resource decorator, see record().
+"""
+
+# Event types of kubernetes watch events.
+_WATCH_TYPES = {'ADDED': 'create', 'MODIFIED': 'update', 'DELETED': 'delete'}
+_EVENT_WATCH_TYPES = {'create': 'ADDED', 'resume': 'ADDED', 'update': 'MODIFIED', 'delete': 'DELETED'}
+
+# Handlers that are called for an event type.
+_CHANGE_HANDLERS = {
+    'create': ('create',),
+    'update': ('update', 'field'),
+    'delete': ('delete',),
+    'resume': ('resume',),
+}
+
+
+
+class BodyFactory():
+    """Generates synthetic bodies for a resource class from the
+    openAPIV3Schema of its CRD.
+
+    list_length: number of items in arrays and entries in maps.
+    string_length: length of generated strings.
+    keep: names of spec fields that update does not change, e.g.
+      references to other objects.
+
+    Enums, defaults and numeric bounds are respected, patterns are not.
+    """
+
+    def __init__(self, resource_class, list_length=2, string_length=12,
+            seed=0, namespace='default', status=True, keep=()):
+        self.resource_class = resource_class
+        self.list_length = list_length
+        self.string_length = string_length
+        self.namespace = namespace
+        self.status = status
+        self.keep = frozenset(keep)
+        self.random = random.Random(seed)
+        crd = as_crd(resource_class)
+        for version in crd['spec']['versions']:
+            if version['name'] == resource_class.__version__:
+                self.schema = version['schema']['openAPIV3Schema']
+        self.namespaced = crd['spec']['scope'] == 'Namespaced'
+
+
+    def body(self, index=0):
+        """Return a new body, index is used to build its name.
+        """
+        resource_class = self.resource_class
+        metadata = {
+            'name': f'{resource_class.__kind__.lower()}-{index}',
+            'resourceVersion': '1',
+            'generation': 1,
+            'creationTimestamp': '2024-01-01T00:00:00Z',
+        }
+        if self.namespaced:
+            metadata['namespace'] = self.namespace
+        # Stable and unique per object, regardless of the seed.
+        metadata['uid'] = str(uuid.uuid5(uuid.NAMESPACE_URL,
+            f'{resource_class.__fqname__}/{metadata.get("namespace")}/{metadata["name"]}'))
+        body = {
+            'apiVersion': resource_class.__api_version__,
+            'kind': resource_class.__kind__,
+            'metadata': metadata,
+        }
+        for name, schema in self.schema.get('properties', {}).items():
+            if name in body or name == 'status' and not self.status:
+                continue
+            body[name] = self.value(schema)
+        return body
+
+
+    def update(self, body):
+        """Return a copy of body with a regenerated spec field and bumped
+        resourceVersion and generation.
+        """
+        body = dict(body)
+        metadata = body['metadata'] = dict(body['metadata'])
+        metadata['resourceVersion'] = str(int(metadata.get('resourceVersion', 0)) + 1)
+        metadata['generation'] = metadata.get('generation', 0) + 1
+        properties = self.schema.get('properties', {}).get('spec', {}).get('properties')
+        names = sorted(set(properties or ()) - self.keep)
+        if names:
+            spec = body['spec'] = copy.deepcopy(body.get('spec', {}))
+            name = self.random.choice(names)
+            spec[name] = self.value(properties[name])
+        return body
+
+
+    def value(self, schema):
+        """Return a value that matches the given schema.
+        """
+        rnd = self.random
+        if 'enum' in schema:
+            return rnd.choice(schema['enum'])
+        any_of = schema.get('anyOf') or schema.get('oneOf')
+        if any_of:
+            return self.value(any_of[0])
+        type_ = schema.get('type')
+        if type_ == 'object' or 'properties' in schema:
+            result = {name: self.value(s) for name, s in schema.get('properties', {}).items()}
+            additional = schema.get('additionalProperties')
+            if isinstance(additional, dict):
+                for i in range(self.list_length):
+                    result[f'key{i}'] = self.value(additional)
+            return result
+        if type_ == 'array':
+            return [self.value(schema.get('items', {})) for _ in range(self.list_length)]
+        if type_ == 'boolean':
+            return rnd.random() < 0.5
+        if type_ in ('integer', 'number'):
+            low, high = _bounds(schema, type_ == 'integer')
+            if type_ == 'integer':
+                return rnd.randint(low, high)
+            return rnd.uniform(low, high)
+        fmt = schema.get('format')
+        if fmt == 'date-time':
+            return '2024-01-01T00:00:00Z'
+        if fmt == 'date':
+            return '2024-01-01'
+        length = min(max(self.string_length, schema.get('minLength', 0)),
+            schema.get('maxLength', self.string_length))
+        return ''.join(rnd.choices(string.ascii_lowercase, k=length))
+
+
+
+def _bounds(schema, integer):
+    step = 1 if integer else 1e-6
+    low = schema.get('minimum', 0)
+    high = schema.get('maximum', max(low, 0) + 1000)
+    # Booleans in openapi v3, numbers in JSON schema.
+    exclusive_minimum = schema.get('exclusiveMinimum')
+    if exclusive_minimum is True:
+        low += step
+    elif exclusive_minimum is not None and exclusive_minimum is not False:
+        low = max(low, exclusive_minimum + step)
+    exclusive_maximum = schema.get('exclusiveMaximum')
+    if exclusive_maximum is True:
+        high -= step
+    elif exclusive_maximum is not None and exclusive_maximum is not False:
+        high = min(high, exclusive_maximum - step)
+    return low, high
+
+
+
+def synthesize(resource_class, count=1, **kwargs):
+    """Yield count synthetic bodies of the given resource class. kwargs are
+    passed on to BodyFactory.
+    """
+    factory = BodyFactory(resource_class, **kwargs)
+    for index in range(count):
+        yield factory.body(index)
+
+
+
+def synthetic_events(bodies, updates=1, delete=True, seed=0, **kwargs):
+    """Return a list of events that creates all given bodies, updates
+    each of them `updates` times and then deletes them.
+
+    kwargs are passed on to the BodyFactory used for the updates.
+    """
+    bodies = list(bodies)
+    factories = {}
+    def factory(body):
+        resource_class = ResourceRegistry.get(body['apiVersion'], body['kind'])
+        if resource_class not in factories:
+            factories[resource_class] = BodyFactory(resource_class, seed=seed, **kwargs)
+        return factories[resource_class]
+
+    events = [Event('create', body) for body in bodies]
+    for _ in range(updates):
+        bodies = [factory(body).update(body) for body in bodies]
+        events.extend(Event('update', body) for body in bodies)
+    if delete:
+        for body in bodies:
+            body = dict(body, metadata=dict(body['metadata'], deletionTimestamp='2024-01-01T00:00:00Z'))
+            events.append(Event('delete', body))
+    return events
+
+
+
+def read_events(fp, format=None):
+    """Yield the events in the given file like object.
+
+    Reads kubernetes watch events, i.e. {"type": "ADDED", "object": {...}},
+    events in the format write_events writes, and plain objects or
+    Lists of them, which are read as create events.
+    """
+    for document in iter_documents(fp, format=format):
+        type_ = document.get('type')
+        if 'object' in document and type_ is not None:
+            yield Event(_WATCH_TYPES.get(type_, type_), document['object'])
+        else:
+            yield Event('create', document)
+
+
+
+def write_events(events, fp):
+    """Write the given events as json lines of kubernetes watch events.
+    Resume events are written as ADDED.
+    """
+    for event in events:
+        fp.write(json.dumps({'type': _EVENT_WATCH_TYPES[event.type], 'object': event.body}))
+        fp.write('\n')
+
+
+
+class FakeIndex(collections.abc.Mapping):
+    """In-memory stand in for kopf.Index, a mapping of key -> values.
+    """
+
+    def __init__(self):
+        # uid -> keys the object contributed to
+        self.__keys = {}
+        # key -> {uid: value}
+        self.__values = {}
+
+
+    def replace(self, uid, result):
+        """Replace the entries of the object with the given uid by the
+        result of an index handler.
+        """
+        self.remove(uid)
+        if result is None:
+            return
+        if not isinstance(result, collections.abc.Mapping):
+            result = {None: result}
+        for key, value in result.items():
+            self.__values.setdefault(key, {})[uid] = value
+        self.__keys[uid] = tuple(result)
+
+
+    def remove(self, uid):
+        for key in self.__keys.pop(uid, ()):
+            store = self.__values[key]
+            store.pop(uid, None)
+            if not store:
+                del self.__values[key]
+
+
+    def __getitem__(self, key):
+        return list(self.__values[key].values())
+
+
+    def __iter__(self):
+        return iter(self.__values)
+
+
+    def __len__(self):
+        return len(self.__values)
+
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Return a dict of point -> nearest rank percentile of values.
+    """
+    values = sorted(values)
+    if not values:
+        return {p: None for p in points}
+    return {
+        p: values[min(len(values) - 1, max(0, int(round(p / 100 * len(values))) - 1))]
+        for p in points
+    }
+
+
+
+class ReplayStats():
+    """Calls, errors and latencies per handler of a replay.
+    """
+
+    def __init__(self):
+        self.events = 0
+        self.seconds = 0.0
+        self.calls = collections.Counter()
+        self.errors = collections.defaultdict(collections.Counter)
+        self.latencies = collections.defaultdict(list)
+        self.patches = collections.defaultdict(list)
+
+
+    def summary(self):
+        handlers = {}
+        for handler_id, latencies in self.latencies.items():
+            handlers[handler_id] = dict(
+                calls=self.calls[handler_id],
+                errors=dict(self.errors[handler_id]),
+                mean=sum(latencies) / len(latencies),
+                **{f'p{k}': v for k,v in percentiles(latencies).items()},
+            )
+        return {
+            'events': self.events,
+            'seconds': self.seconds,
+            'events_per_second': self.events / self.seconds if self.seconds else None,
+            'handlers': handlers,
+        }
+
+
+
+_registrations = None
+
+
+
+def record():
+    """Record the handlers registered through the resource decorators from
+    now on and return the list of their Registrations.
+
+    Has to be called before the handlers are registered. Nothing is recorded
+    unless it is called, as the recorded handlers are kept alive.
+    """
+    global _registrations
+    if _registrations is None:
+        _registrations = []
+        DecoratorWrapper.registration_hook = _record
+    return _registrations
+
+
+
+def _record(name, args, kwargs, func):
+    _registrations.append(Registration(name, args, kwargs, func))
+
+
+
+class FakeDispatcher():
+    """Dispatches events to the handlers registered through the resource
+    decorators, by default the ones recorded since record() was called.
+
+    retries: how often handlers that raise a kopf.TemporaryError are called
+      again, right away with an increased `retry`.
+    """
+
+    def __init__(self, registrations=None, retries=0):
+        if registrations is None:
+            if _registrations is None:
+                raise ValueError('No handlers recorded, call replay.record() before registering them.')
+            registrations = _registrations
+        self.retries = retries
+        self.stats = ReplayStats()
+        self.indexes = {}
+        # (group, version, plural) -> [(handler id, registration), ...]
+        self.__handlers = collections.defaultdict(list)
+        for registration in registrations:
+            if registration.name != 'index' and registration.name not in _CHANGE_HANDLERS['update'] \
+                    and registration.name not in ('create', 'delete', 'resume', 'event'):
+                continue
+            handler_id = registration.kwargs.get('id') or registration.func.__qualname__
+            if registration.name == 'index':
+                self.indexes.setdefault(handler_id, FakeIndex())
+            self.__handlers[registration.args[:3]].append((handler_id, registration))
+        # uid -> last body
+        self.__objects = {}
+        # uid -> memo
+        self.__memos = collections.defaultdict(dict)
+        self.__logger = logging.getLogger('kopf_resources.replay.handlers')
+
+
+    async def replay(self, events):
+        """Dispatch all events in order and return the ReplayStats.
+        """
+        start = time.perf_counter()
+        for event in events:
+            await self.dispatch(event)
+        self.stats.seconds += time.perf_counter() - start
+        return self.stats
+
+
+    async def dispatch(self, event):
+        body = event.body
+        resource_class = ResourceRegistry.get(body['apiVersion'], body['kind'])
+        key = (resource_class.__group__, resource_class.__version__, resource_class.__plural__)
+        metadata = body.get('metadata', {})
+        uid = metadata.get('uid') or (metadata.get('namespace'), metadata.get('name'))
+        old = self.__objects.get(uid)
+        handlers = self.__handlers.get(key, ())
+        self.stats.events += 1
+
+        # Indexes are up to date before any other handler runs.
+        for handler_id, registration in handlers:
+            if registration.name != 'index':
+                continue
+            index = self.indexes[handler_id]
+            kwargs = self.__kwargs(event, body, old, uid)
+            if event.type == 'delete' or not self.__matches(registration, body, kwargs):
+                index.remove(uid)
+            else:
+                index.replace(uid, await self.__call(handler_id, registration, kwargs))
+
+        names = _CHANGE_HANDLERS[event.type]
+        for handler_id, registration in handlers:
+            if registration.name == 'event':
+                kwargs = self.__kwargs(event, body, old, uid)
+                kwargs['type'] = _EVENT_WATCH_TYPES[event.type]
+                kwargs['event'] = {'type': kwargs['type'], 'object': body}
+            elif registration.name in names:
+                kwargs = self.__kwargs(event, body, old, uid)
+                if registration.name == 'field':
+                    field = registration.kwargs['field']
+                    if isinstance(field, str):
+                        field = field.split('.')
+                    old_value = _get(old, field)
+                    new_value = _get(body, field)
+                    if old_value == new_value:
+                        continue
+                    kwargs.update(old=old_value, new=new_value,
+                        diff=(('change', tuple(field), old_value, new_value),))
+            else:
+                continue
+            if not self.__matches(registration, body, kwargs):
+                continue
+            for retry in range(self.retries + 1):
+                kwargs['retry'] = retry
+                try:
+                    await self.__call(handler_id, registration, kwargs)
+                except kopf.TemporaryError:
+                    continue
+                except Exception:
+                    pass
+                break
+
+        if event.type == 'delete':
+            self.__objects.pop(uid, None)
+            self.__memos.pop(uid, None)
+        else:
+            self.__objects[uid] = body
+
+
+    def __kwargs(self, event, body, old, uid):
+        metadata = body.get('metadata', {})
+        kwargs = dict(
+            body=body,
+            spec=body.get('spec', {}),
+            meta=metadata,
+            status=body.get('status', {}),
+            name=metadata.get('name'),
+            namespace=metadata.get('namespace'),
+            uid=metadata.get('uid'),
+            labels=metadata.get('labels', {}),
+            annotations=metadata.get('annotations', {}),
+            patch={},
+            logger=self.__logger,
+            memo=self.__memos[uid],
+            retry=0,
+            reason=event.type,
+            old=old,
+            new=body,
+            diff=(),
+        )
+        kwargs.update(self.indexes)
+        return kwargs
+
+
+    def __matches(self, registration, body, kwargs):
+        metadata = body.get('metadata', {})
+        options = registration.kwargs
+        if not _match_meta(options.get('labels'), metadata.get('labels') or {}, kwargs):
+            return False
+        if not _match_meta(options.get('annotations'), metadata.get('annotations') or {}, kwargs):
+            return False
+        when = options.get('when')
+        return when is None or bool(when(**kwargs))
+
+
+    async def __call(self, handler_id, registration, kwargs):
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            result = registration.func(**kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            stats.errors[handler_id][type(e).__name__] += 1
+            raise
+        finally:
+            stats.calls[handler_id] += 1
+            stats.latencies[handler_id].append(time.perf_counter() - start)
+        if kwargs['patch']:
+            stats.patches[handler_id].append(kwargs['patch'])
+        return result
+
+
+
+def _get(body, path):
+    value = body
+    for part in path:
+        try:
+            value = value[part]
+        except (KeyError, TypeError):
+            return None
+    return value
+
+
+
+def _match_meta(selector, values, kwargs):
+    for key, expected in (selector or {}).items():
+        if expected is kopf.PRESENT:
+            if key not in values:
+                return False
+        elif expected is kopf.ABSENT:
+            if key in values:
+                return False
+        elif callable(expected):
+            if not expected(values.get(key), **kwargs):
+                return False
+        elif values.get(key) != expected:
+            return False
+    return True
+
+
+
+def replay(events, registrations=None, retries=0):
+    """Replay the given events through a new FakeDispatcher and return
+    its ReplayStats.
+    """
+    dispatcher = FakeDispatcher(registrations, retries=retries)
+    return asyncio.run(dispatcher.replay(events))
@@ -1,13 +1,20 @@
+import asyncio
+import contextvars
 import functools
 import inspect
-import types
 import typing
-
-from pydantic import BaseModel, Field
-from pydantic.typing import Any, Dict, Literal, List, Mapping, Type
+from typing import List
 
 import kopf
 
+from . import metrics, sharding, throttle
+from .backends import backend, BaseModel, Field
+from .digest import DigestGuard, digest
+from .index import CompactIndex, ResourceIndex
+from .interning import InternedStr, InternedStrDict, InternedStrList
+from .lazy import LazyResource, parse_lazy
+from .parsing import parse, parse_cached
+from .patch import StatusTracker
 from .registry import ResourceRegistry
 
 
@@ -34,10 +41,57 @@ class DecoratorWrapper():
     ```
     """
 
+    # Options that are consumed by the wrapper itself and must not be passed
+    # on to the kopf decorator.
+    #
+    # executor: a concurrent.futures.Executor used to parse the models.
+    #   For sync handlers the handler itself is also run in that executor
+    #   instead of kopf's default one.
+    # trusted: build models without validation, see parsing.construct.
+    #   Defaults to the `trusted` setting of the resource class.
+    # digest: skip calls if the digest of these top level fields, e.g.
+    #   ('spec',), did not change since the last successful call.
+    #   True means ('spec',). See digest.DigestGuard.
+    # digest_key: annotation, or `status.` path, to store the digest in.
+    #   Defaults to an annotation per handler.
+    # patch_status: hand out private copies of the parsed resources and
+    #   patch the changes the handler made to their status, see
+    #   patch.StatusTracker.
+    # shard: False to handle the objects of all shards, see sharding.
+    #   Defaults to the `sharding` setting of the resource class, except
+    #   for indexes which need True to be sharded.
+    # debounce: seconds an object has to stay unchanged before further
+    #   changes are handled, coalescing bursts of changes. The first change
+    #   is handled right away. The delays are kopf.TemporaryError retries
+    #   and count against the retry settings of the handler. See
+    #   throttle.Debouncer.
+    # debounce_max_delay: maximum seconds a change is delayed by debounce.
+    #   Defaults to 10 times debounce.
+    # concurrency: maximum number of concurrent calls of the handlers of
+    #   the resource that use this option. Sync handlers then wait for a
+    #   slot before they are run in an executor. See
+    #   throttle.ConcurrencyLimit.
+    options = ('executor', 'trusted', 'digest', 'digest_key', 'patch_status',
+        'shard', 'debounce', 'debounce_max_delay', 'concurrency')
+
+    # Admission requests are not distributed by shard, so the admission
+    # handlers are never sharded.
+    unsharded = ('validate', 'mutate')
+    # Indexes are typically looked up by the handlers of other resources,
+    # e.g. issuers by certificates, so they hold the objects of all shards
+    # unless sharded explicitly with shard=True.
+    unsharded_by_default = ('index',)
+
+    # Called with the name, kopf decorator args and kwargs and the function
+    # of every handler registered through a DecoratorWrapper if set, e.g.
+    # to replay events offline, see replay.record.
+    registration_hook = None
+
     def __init__(self, name=None, args=None):
         # This method is only used in explicit/manual mode.
         self.name = name
         self.args = args
+        self.resource = None
 
 
     def __call__(self, func):
@@ -56,11 +110,25 @@ class DecoratorWrapper():
     def __get__(self, instance, owner):
         # This method is only used in descriptor mode.
         #print(f'DecoratorWrapper.__get__: {instance}, {owner}')
-        resource = instance.owner
+        resource = self.resource = instance.owner
         self.args = (resource.__group__, resource.__version__, resource.__plural__)
         return self.decorator
 
 
+    def sharding(self, resource, shard=None):
+        """Return the ShardConfig that applies to handlers of the given
+        resource class or None if they are not sharded.
+        """
+        if shard is False or self.name in self.unsharded:
+            return None
+        if shard is None and self.name in self.unsharded_by_default:
+            return None
+        config = getattr(resource, '__sharding__', None)
+        if config is False:
+            return None
+        return config or sharding.get_config()
+
+
     def decorator(self, *args, **kwargs):
         """Decorator function that uses the name and resource specific
         parameters available to this class to wrap the corresponding
@@ -74,6 +142,7 @@ class DecoratorWrapper():
             func = args[0]
             d_args = kwargs.get('__args', self.args)
             d_kwargs = kwargs.get('__kwargs', {})
+            resource = kwargs.get('__resource', self.resource)
         else:
             # Used as:
             # @SomeResource.on.create(when=some_filter, labels=...)
@@ -83,37 +152,266 @@ class DecoratorWrapper():
             # Inject our resource specific args to comply with kopf's decorator
             # signatures.
             all_args = self.args + args
-            return functools.partial(self.decorator, __args=all_args, __kwargs=kwargs)
+            return functools.partial(self.decorator, __args=all_args,
+                __kwargs=kwargs, __resource=self.resource)
 
 
         #print(f'name: {self.name}')
         #print(f'     func: {func}')
         #print(f'     d_args: {d_args}')
         #print(f'     d_kwargs: {d_kwargs}')
+        d_kwargs = dict(d_kwargs)
+        options = {k: d_kwargs.pop(k) for k in self.options if k in d_kwargs}
+        shard_config = self.sharding(resource, options.pop('shard', None))
+        if shard_config is not None:
+            d_kwargs = shard_config.inject(d_kwargs)
         kopf_decorator = getattr(kopf.on, self.name)
         handler = kopf_decorator(*d_args, **d_kwargs)
-        signature = inspect.signature(func)
-        type_hints = typing.get_type_hints(func)
-        #print('     signature: %s' % signature)
-        #print('     type_hints: %s' % type_hints)
 
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs):
-            # Wrapper function that parses pydantic models based on
-            # typing hints.
-            #print('     wrapper: %s; %s' % (args, kwargs))
-            for argument_name, argument_type in type_hints.items():
-                # NOTE: BaseModel is pydantic specific. Will need a way to
-                #       make this configurable if other datamodel packages
-                #       should be supported.
-                if issubclass(argument_type, BaseModel):
-                    _object = kwargs[argument_name]
-                    kwargs[argument_name] = argument_type.parse_obj(_object)
-
-            return func(*args, **kwargs)
+        # functools.wraps copied the __qualname__ to our wrappers.
+        handler_id = d_kwargs.get('id') or func.__qualname__
+        plan = getattr(func, '__kopf_resources_plan__', None)
+        if plan is not None:
+            # Stacked decorators, e.g.
+            # @SomeResource.on.create
+            # @SomeResource.on.update
+            # The function we got is already one of our wrappers. If it
+            # uses the same handler id and options register it as is
+            # instead of wrapping it again, otherwise wrap the original
+            # function with the same plan. That way all stacked decorators
+            # share one plan and models are only parsed once per call.
+            if (func.__kopf_resources_handler_id__, func.__kopf_resources_options__) == (handler_id, options):
+                self.registered(d_args, d_kwargs, func)
+                return handler(func)
+            func = func.__wrapped__
+        else:
+            plan = _compile_plan(func)
+        #print('     plan: %s' % plan)
+        wrap_options = dict(options)
+        if options.get('concurrency'):
+            group, _, plural = d_args[:3]
+            wrap_options['concurrency'] = throttle.concurrency_limit(
+                f'{plural}.{group}', options['concurrency'])
+        wrapper = _wrap(func, plan, handler_id=handler_id, **wrap_options)
+        wrapper.__kopf_resources_plan__ = plan
+        wrapper.__kopf_resources_options__ = options
+        wrapper.__kopf_resources_handler_id__ = handler_id
+        self.registered(d_args, d_kwargs, wrapper)
         return handler(wrapper)
 
 
+    def registered(self, args, kwargs, func):
+        hook = DecoratorWrapper.registration_hook
+        if hook is not None:
+            hook(self.name, tuple(args), kwargs, func)
+
+
+
+def _wrap(func, plan, handler_id=None, executor=None, trusted=None,
+        digest=None, digest_key=None, patch_status=False, debounce=None,
+        debounce_max_delay=None, concurrency=None):
+    """Create the wrapper function that parses models based on the given
+    plan before calling func.
+
+    concurrency is a throttle.ConcurrencyLimit, it covers parsing as well.
+
+    The wrapper matches the wrapped function so that kopf runs async
+    handlers on the event loop and sync handlers in its executor.
+    If an executor is given, models are parsed in it. Sync handlers are
+    then wrapped in a async wrapper that runs both, parsing and the
+    handler, in that executor instead of kopf's default one. The same
+    is done for sync handlers with a concurrency limit, using kopf's
+    executor, so they wait for the limit on the event loop.
+    """
+    guard = None
+    if digest:
+        include = ('spec',) if digest is True else digest
+        guard = DigestGuard(handler_id, include, key=digest_key, trusted=trusted)
+    debouncer = throttle.Debouncer(debounce, debounce_max_delay) if debounce else None
+
+    def prepare(kwargs):
+        # Parse the models and return whether func should be called and
+        # the state needed by finish.
+        body = kwargs.get('body')
+        _apply_plan(plan, kwargs, trusted=trusted)
+        value = trackers = None
+        if guard is not None:
+            value = guard.check(body)
+            if value is None:
+                if metrics.active:
+                    metrics.inc('kopf_resources_handler_skipped_total',
+                        dict(metrics.body_labels(body), handler=handler_id))
+                return False, None
+        if patch_status:
+            trackers = _track_status(plan, kwargs)
+        return True, (value, trackers)
+
+    def finish(kwargs, state):
+        value, trackers = state
+        patch = kwargs.get('patch')
+        if trackers and patch is not None:
+            for tracker in trackers:
+                tracker.apply(patch)
+        if guard is not None:
+            guard.store(patch, value)
+
+    def debounce_check(kwargs):
+        # Returns the token for debounce_verify.
+        if debouncer is None:
+            return None
+        return debouncer.check(kwargs.get('body'), handler_id)
+
+    def debounce_verify(token):
+        # Drop the result of a call the object changed during.
+        if debouncer is not None:
+            debouncer.verify(token)
+
+    if inspect.iscoroutinefunction(func):
+        async def call(token, args, kwargs):
+            if executor is None:
+                run, value = prepare(kwargs)
+            else:
+                loop = asyncio.get_running_loop()
+                run, value = await loop.run_in_executor(executor, prepare, kwargs)
+            if not run:
+                return None
+            result = await func(*args, **kwargs)
+            debounce_verify(token)
+            finish(kwargs, value)
+            return result
+
+        if concurrency is not None:
+            unlimited_call = call
+            async def call(token, args, kwargs):
+                async with concurrency.semaphore():
+                    return await unlimited_call(token, args, kwargs)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            token = debounce_check(kwargs)
+            return await metrics.measure_async(handler_id,
+                functools.partial(call, token), args, kwargs)
+
+    else:
+        def call(token, args, kwargs):
+            run, value = prepare(kwargs)
+            if not run:
+                return None
+            result = func(*args, **kwargs)
+            debounce_verify(token)
+            finish(kwargs, value)
+            return result
+
+        if executor is not None or concurrency is not None:
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                token = debounce_check(kwargs)
+                loop = asyncio.get_running_loop()
+                run_executor = executor
+                if run_executor is None:
+                    settings = kwargs.get('settings')
+                    run_executor = settings.execution.executor if settings is not None else None
+                # Preserve kopf's context vars, e.g. for logging, like kopf
+                # itself does for sync handlers.
+                context = contextvars.copy_context()
+                run = functools.partial(loop.run_in_executor, run_executor, context.run,
+                    metrics.measure, handler_id, functools.partial(call, token), args, kwargs)
+                if concurrency is None:
+                    return await run()
+                async with concurrency.semaphore():
+                    return await run()
+
+        else:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                token = debounce_check(kwargs)
+                return metrics.measure(handler_id, functools.partial(call, token), args, kwargs)
+
+    return wrapper
+
+
+
+def _track_status(plan, kwargs):
+    """Replace the parsed resources in kwargs by private copies and return
+    a StatusTracker for each of them.
+    """
+    trackers = []
+    for argument_name, argument_type in plan:
+        model = kwargs.get(argument_name)
+        if isinstance(model, Resource) and 'status' in backend.aliases(type(model)):
+            # The parsed models are shared through the cache.
+            model = kwargs[argument_name] = backend.copy(model, deep=True)
+            trackers.append(StatusTracker(model))
+    return trackers
+
+
+
+def _apply_plan(plan, kwargs, trusted=None):
+    """Parse the arguments in kwargs in place according to the given plan.
+    """
+    #print('     _apply_plan: %s; %s' % (plan, kwargs))
+    for argument_name, argument_type in plan:
+        try:
+            _object = kwargs[argument_name]
+        except KeyError:
+            continue
+        kwargs[argument_name] = _parse_argument(argument_type, _object, trusted)
+
+
+
+def _compile_plan(func):
+    """Work out which keyword arguments of the given function have to be
+    parsed into which models.
+
+    Returns a tuple of (argument_name, model_class) tuples.
+    """
+    plan = []
+    for argument_name, argument_type in typing.get_type_hints(func).items():
+        if argument_name == 'return':
+            continue
+        model_class = _model_class(argument_type)
+        if model_class is not None:
+            plan.append((argument_name, model_class))
+    return tuple(plan)
+
+
+
+def _model_class(argument_type):
+    """Return the model class for the given type hint or None if the hint
+    is not something we know how to parse.
+
+    Handles plain model classes, `LazyResource[SomeResource]`,
+    `ResourceIndex[SomeResource]` and `Optional[...]` of those.
+    """
+    if typing.get_origin(argument_type) is typing.Union:
+        args = [a for a in typing.get_args(argument_type) if a is not type(None)]
+        if len(args) != 1:
+            return None
+        argument_type = args[0]
+    if backend.is_model(argument_type):
+        return argument_type
+    if inspect.isclass(argument_type) and issubclass(argument_type, (LazyResource, ResourceIndex)):
+        return argument_type
+    return None
+
+
+
+def _parse_argument(model_class, value, trusted=None):
+    """Parse the given value into an instance of the given model class.
+    """
+    if value is None or isinstance(value, model_class):
+        # Optional argument or already parsed.
+        return value
+    if issubclass(model_class, Resource):
+        # Shares parsed models with from_dict and other handlers.
+        return parse_cached(model_class, value, trusted=trusted)
+    if issubclass(model_class, LazyResource):
+        return parse_cached(model_class, value, trusted=trusted, parser=parse_lazy)
+    if issubclass(model_class, ResourceIndex):
+        return model_class(value, trusted=trusted)
+    return parse(model_class, value, trusted=trusted)
+
+
 
 class DecoratorProxy():
     """Descriptor class that dispatches decorators to kopf.on.$name.
@@ -135,6 +433,8 @@ class DecoratorProxy():
     daemon = DecoratorWrapper()
     timer = DecoratorWrapper()
     index = DecoratorWrapper()
+    validate = DecoratorWrapper()
+    mutate = DecoratorWrapper()
 
 
 
@@ -146,20 +446,48 @@ class DecoratorMixin():
 
 
 
-class ObjectMeta(BaseModel):
-    """Resource ObjectMeta
+class OwnerReference(BaseModel):
+    """Resource OwnerReference
     """
-    # https://kubernetes.github.io/cluster-registry/reference/build/index.html#objectmeta-v1
+    __slots__ = ()
+    apiVersion: InternedStr
+    kind: InternedStr
     name: str
-    namespace: str = None
-    labels: Dict[str,str] = Field(default_factory=dict)
-    annotations: Dict[str,str] = Field(default_factory=dict)
-    uuid: str = None
+    uid: str
+    controller: bool = None
+    blockOwnerDeletion: bool = None
 
-    # TODO: add more of these ...
-    #creationTimestamp
-    #deletionGracePeriodSeconds
-    finalizers: List[str] = Field(default_factory=list)
+
+
+class ObjectMeta(BaseModel):
+    """Resource ObjectMeta
+
+    Lots of these are kept alive in caches and indexes, so repeated strings
+    like namespaces, label keys and finalizers are interned.
+    See kopf_resources.interning.
+
+    Timestamps are kept as the RFC 3339 strings kubernetes sends.
+
+    Pydantic keeps field values in the instance __dict__, with either
+    backend, so they can not be slotted. The empty __slots__ only drops
+    the __weakref__ slot pydantic 2 models get otherwise.
+    """
+    __slots__ = ()
+    # https://kubernetes.io/docs/reference/kubernetes-api/common-definitions/object-meta/
+    # Not set yet on admission of a CREATE with generateName.
+    name: str = None
+    generateName: str = None
+    namespace: InternedStr = None
+    uid: str = None
+    resourceVersion: str = None
+    generation: int = None
+    creationTimestamp: str = None
+    deletionTimestamp: str = None
+    deletionGracePeriodSeconds: int = None
+    labels: InternedStrDict = Field(default_factory=dict)
+    annotations: InternedStrDict = Field(default_factory=dict)
+    finalizers: InternedStrList = Field(default_factory=list)
+    ownerReferences: List[OwnerReference] = Field(default_factory=list)
 
 
 
@@ -181,21 +509,35 @@ class Resource(BaseModel, DecoratorMixin):
     __api_version__ = None
     __kwargs__ = None
     __status_subresource__ = False
+    __trusted__ = False
+    __sharding__ = None
 
     # This would also work instead of inheriting from the DecoratorMixin
     # base class.
     #on = DecoratorProxy()
 
+    @classmethod
+    def lazy(cls, body, trusted=None):
+        """Return a LazyResource for the given body.
+        """
+        return LazyResource[cls](body, trusted=trusted)
+
+
     @classmethod
     def index(cls, *args, **kwargs):
         """Sugar: `index` instead of `on.index`
+
+        Also accepts a CompactIndex whose generated handler is then
+        registered for this resource class.
         """
+        if len(args) == 1 and isinstance(args[0], CompactIndex):
+            return args[0].register(cls, **kwargs)
         return cls.on.index(*args, **kwargs)
 
 
     def __init_subclass__(cls, /, group, version, kind=None,
             scope='Namespaced', status_subresource=False,
-            served=True, storage=True, **kwargs):
+            served=True, storage=True, trusted=False, sharding=None, **kwargs):
         name = cls.__kind__ = kind or cls.__name__
         cls.__group__ = group
         cls.__version__ = version
@@ -206,6 +548,11 @@ class Resource(BaseModel, DecoratorMixin):
         cls.__served__ = served
         # TODO: only one version can be stored. Maybe validate that somehow?
         cls.__storage__ = storage
+        # Build instances without validation as the apiserver already
+        # validated the objects against the CRD schema.
+        cls.__trusted__ = trusted
+        # None uses the operator wide setting, False disables sharding.
+        cls.__sharding__ = sharding
         cls.__spec__ = {
             'group': group,
             'names': {
@@ -225,12 +572,17 @@ class Resource(BaseModel, DecoratorMixin):
     metadata: ObjectMeta = None
 
 
-    class Config:
-        """pydantic config"""
-        @staticmethod
-        def schema_extra(schema: Dict[str, Any]) -> None:
-            # Don't want ObjectMeta in crd.
-            del schema['properties']['metadata']
+    def track_status(self):
+        """Return a StatusTracker that computes minimal patches for the
+        changes made to the status of this resource.
+        """
+        return StatusTracker(self)
+
+
+    def digest(self, include=('spec',)):
+        """Return a stable, canonical digest of the given top level fields.
+        """
+        return digest(self, include)
 
 
     def __str__(self):
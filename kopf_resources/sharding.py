@@ -0,0 +1,202 @@
+"""Split the objects of resources across several operator replicas.
+
+Every object belongs to exactly one of N shards, by a stable hash of its
+namespace/name or uid. Each replica only handles the objects of its own
+shard, either by a generated `when=` filter or by a label selector on a
+shard label that has to be assigned to the objects, see
+assign_shard_labels.
+
+The operator wide setting is configured with configure() or through the
+environment:
+
+    KOPF_RESOURCES_SHARDS: number of shards
+    KOPF_RESOURCES_SHARD: shard of this replica, defaults to the ordinal
+        of a StatefulSet pod taken from the hostname, e.g. 2 for operator-2.
+    KOPF_RESOURCES_SHARD_KEY: 'name' (default) or 'uid'
+    KOPF_RESOURCES_SHARD_MODE: 'when' (default) or 'labels'
+
+Resource classes can override it with the `sharding` class argument,
+either a ShardConfig or False to disable sharding. Single handlers can opt
+out with the `shard=False` decorator option. Indexes are not sharded
+unless they opt in with `shard=True`, as they usually have to contain all
+objects.
+"""
+import hashlib
+import os
+import random
+import re
+import socket
+
+
+
+SHARD_LABEL = 'kopf-resources/shard'
+
+_ordinal = re.compile(r'-(\d+)$')
+
+
+
+class ShardConfig():
+    """Which shard of how many this operator replica handles.
+
+    key: 'name' to hash namespace/name, 'uid' to hash the uid. Objects keep
+      their shard when hashed by name as long as they are not renamed,
+      which can not happen, but the uid changes if an object is recreated.
+    mode: 'when' to filter with a generated when= callback, 'labels' to
+      select the shard label, see assign_shard_labels. Only works with
+      key='name' as the uid is not known yet when the label is assigned.
+    """
+
+    def __init__(self, shards, shard, key='name', mode='when'):
+        if not 0 <= shard < shards:
+            raise ValueError(f'Shard {shard} is out of range for {shards} shards.')
+        if key not in ('name', 'uid'):
+            raise ValueError(f'Invalid shard key: {key}')
+        if mode not in ('when', 'labels'):
+            raise ValueError(f'Invalid shard mode: {mode}')
+        if key == 'uid' and mode == 'labels':
+            raise ValueError('Shard key uid does not work with mode labels, the uid '
+                'is not known yet when the shard label is assigned.')
+        self.shards = shards
+        self.shard = shard
+        self.key = key
+        self.mode = mode
+
+
+    def __repr__(self):
+        return f'ShardConfig(shards={self.shards}, shard={self.shard}, key={self.key!r}, mode={self.mode!r})'
+
+
+    def shard_of(self, body):
+        return shard_of(body, self.shards, self.key)
+
+
+    def owns(self, body):
+        """Return whether the given body belongs to this replica's shard.
+        """
+        return self.shard_of(body) == self.shard
+
+
+    def inject(self, kwargs):
+        """Return a copy of the given kopf decorator kwargs with the shard
+        filter added.
+        """
+        kwargs = dict(kwargs)
+        if self.mode == 'labels':
+            labels = dict(kwargs.get('labels') or {})
+            labels[SHARD_LABEL] = str(self.shard)
+            kwargs['labels'] = labels
+        else:
+            when = kwargs.get('when')
+            owns = self.owns
+            if when is None:
+                def shard_filter(body, **_):
+                    return owns(body)
+            else:
+                def shard_filter(body, **kwargs):
+                    return owns(body) and when(body=body, **kwargs)
+            kwargs['when'] = shard_filter
+        return kwargs
+
+
+
+def shard_of(body, shards, key='name'):
+    """Return the shard the given body belongs to.
+
+    Uses a stable hash, unlike python's hash() which differs between
+    processes. Objects without uid are hashed by name and objects without
+    name, e.g. on admission of a CREATE with generateName, by generateName.
+    """
+    metadata = body.get('metadata') or {}
+    value = metadata.get('uid') if key == 'uid' else None
+    if not value:
+        name = metadata.get('name') or metadata.get('generateName') or ''
+        value = f'{metadata.get("namespace") or ""}/{name}'
+    digest = hashlib.blake2b(value.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+
+def shard_labels(body, shards, key='name'):
+    """Return the labels that assign the given body to its shard.
+    """
+    return {SHARD_LABEL: str(shard_of(body, shards, key))}
+
+
+
+def assign_shard_labels(*resource_classes, shards=None, key=None, **kwargs):
+    """Register mutating admission handlers that add the shard label to new
+    objects of the given resource classes. Needed with mode='labels'.
+
+    shards and key default to the operator wide configuration. Any other
+    kwargs are passed on to kopf.on.mutate.
+
+    Objects created with generateName have no name yet, they are assigned
+    to a random shard so they don't all end up in the same one.
+    """
+    config = get_config()
+    if shards is None:
+        if config is None:
+            raise ValueError('Sharding is not configured, pass shards.')
+        shards = config.shards
+    key = key or (config.key if config is not None else 'name')
+    if key != 'name':
+        raise ValueError(f'Shard labels can only be assigned by name, not by {key}.')
+    for resource_class in resource_classes:
+        @resource_class.on.mutate(id=f'shard-{resource_class.__fqname__}',
+            operations=['CREATE'], **kwargs)
+        def add_shard_label(body, patch, **_):
+            if body['metadata'].get('name'):
+                labels = shard_labels(body, shards, key)
+            else:
+                labels = {SHARD_LABEL: str(random.randrange(shards))}
+            if body['metadata'].get('labels', {}).get(SHARD_LABEL) != labels[SHARD_LABEL]:
+                patch.setdefault('metadata', {}).setdefault('labels', {}).update(labels)
+
+
+
+_config = None
+_configured = False
+
+
+
+def configure(shards=None, shard=None, key='name', mode='when'):
+    """Configure the operator wide sharding. Must be called before the
+    handlers are registered.
+
+    Pass shards=None to disable sharding.
+    """
+    global _config, _configured
+    if shards is None:
+        _config = None
+    else:
+        if shard is None:
+            shard = _shard_from_hostname()
+        _config = ShardConfig(shards, shard, key=key, mode=mode)
+    _configured = True
+    return _config
+
+
+
+def get_config():
+    """Return the operator wide ShardConfig or None if sharding is disabled.
+    """
+    if not _configured:
+        shards = os.environ.get('KOPF_RESOURCES_SHARDS')
+        shard = os.environ.get('KOPF_RESOURCES_SHARD')
+        configure(
+            shards=int(shards) if shards else None,
+            shard=int(shard) if shard else None,
+            key=os.environ.get('KOPF_RESOURCES_SHARD_KEY', 'name'),
+            mode=os.environ.get('KOPF_RESOURCES_SHARD_MODE', 'when'),
+        )
+    return _config
+
+
+
+def _shard_from_hostname():
+    hostname = socket.gethostname()
+    match = _ordinal.search(hostname)
+    if match is None:
+        raise ValueError(f'Can not get the shard from hostname {hostname}, '
+            'set KOPF_RESOURCES_SHARD or pass shard.')
+    return int(match.group(1))
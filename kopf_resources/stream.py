@@ -0,0 +1,372 @@
+"""Incremental parsing of resource dumps, e.g. the output of
+`kubectl get -o json` or List responses of the apiserver.
+
+e.g.
+```
+    errors = []
+    with open('dump.json') as fp:
+        for resource in kopf_resources.iter_from_stream(fp, trusted=False,
+                errors=errors, skip_unknown=True):
+            ...
+    for error in errors:
+        print(error.kind, error.namespace, error.name, error.error)
+```
+"""
+import codecs
+import collections
+import json
+import os
+
+import yaml
+
+from .parsing import parse
+from .registry import ResourceRegistry, ResourceNotFoundError
+
+
+
+# Use the libyaml based C loader if available, it is a lot faster.
+_SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+CHUNK_SIZE = 64 * 1024
+
+_whitespace = ' \t\n\r'
+
+
+
+class StreamFormatError(ValueError):
+    pass
+
+
+
+ItemError = collections.namedtuple('ItemError',
+    ('index', 'apiVersion', 'kind', 'namespace', 'name', 'error'))
+ItemError.__doc__ = """An item of a stream that could not be parsed.
+
+index is the position of the item in the stream, error the exception.
+"""
+
+
+
+class _Prefixed():
+    """File like object that returns prefix before the rest of fp.
+    """
+
+    def __init__(self, prefix, fp):
+        self.prefix = prefix
+        self.fp = fp
+
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.fp.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.fp.read()
+        else:
+            data = self.prefix[:size]
+        self.prefix = self.prefix[len(data):]
+        return data
+
+
+
+class _JSONReader():
+    """Incremental reader for a stream of concatenated JSON documents.
+
+    Only the top level objects and the arrays in their `items` are walked
+    incrementally, everything else is decoded with the json module.
+    """
+
+    def __init__(self, fp, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+
+    def fill(self, size=None):
+        """Read more data into the buffer. Returns False at the end of
+        the stream.
+        """
+        if self.eof:
+            return False
+        if self.pos:
+            # Drop what was consumed already.
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        data = self.fp.read(size or self.chunk_size)
+        if isinstance(data, bytes):
+            data = self.text_decoder.decode(data, final=not data)
+        if not data:
+            self.eof = True
+            return False
+        self.buffer += data
+        return True
+
+
+    def peek(self):
+        """Skip whitespace and return the next character or '' at the end
+        of the stream.
+        """
+        while True:
+            buffer = self.buffer
+            pos = self.pos
+            while pos < len(buffer) and buffer[pos] in _whitespace:
+                pos += 1
+            self.pos = pos
+            if pos < len(buffer):
+                return buffer[pos]
+            if not self.fill():
+                return ''
+
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise StreamFormatError(f'Expected one of {chars!r} but got {char!r}.')
+        self.pos += 1
+        return char
+
+
+    def value(self):
+        """Decode and return the next JSON value.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                end = None
+            # A number at the end of the buffer may continue in the next
+            # chunk, so only accept values that are followed by something.
+            if end is not None and (end < len(self.buffer) or self.eof):
+                self.pos = end
+                return value
+            # Read at least as much again as the value has so far so
+            # large values are not decoded over and over.
+            size = max(self.chunk_size, len(self.buffer) - self.pos)
+            if not self.fill(size) and end is None:
+                raise StreamFormatError(f'Invalid JSON at: {self.buffer[self.pos:self.pos+80]!r}')
+
+
+    def documents(self):
+        """Yield (item, list) tuples of all items of all documents.
+
+        list holds the top level fields of the List the item is part of, or
+        None. Items without kind are only yielded once the kind and
+        apiVersion of the List were read.
+        """
+        while True:
+            char = self.peek()
+            if not char:
+                return
+            if char == '{':
+                yield from self.object()
+            elif char == '[':
+                for item in self.array():
+                    yield item, None
+            else:
+                raise StreamFormatError(f'Expected an object or array but got {char!r}.')
+
+
+    def object(self):
+        self.expect('{')
+        data = {}
+        is_list = False
+        # Items that need the kind of the List before it was read, e.g. in
+        # key sorted dumps, and all items after them to keep the order.
+        # They are yielded once the List is complete.
+        deferred = None
+        if self.peek() == '}':
+            self.pos += 1
+        else:
+            while True:
+                key = self.value()
+                self.expect(':')
+                if key == 'items' and self.peek() == '[':
+                    is_list = True
+                    for item in self.array():
+                        if deferred is None and _needs_context(item, data):
+                            deferred = []
+                        if deferred is None:
+                            yield item, data
+                        else:
+                            deferred.append(item)
+                else:
+                    data[key] = self.value()
+                if self.expect(',}') == '}':
+                    break
+        if deferred:
+            # Free the items as they are consumed.
+            deferred.reverse()
+            while deferred:
+                yield deferred.pop(), data
+        if not is_list:
+            yield data, None
+
+
+    def array(self):
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+
+def _needs_context(item, context):
+    return isinstance(item, dict) and 'kind' not in item \
+        and not ('kind' in context and 'apiVersion' in context)
+
+
+
+def _iter_json(fp, chunk_size=CHUNK_SIZE):
+    return _JSONReader(fp, chunk_size).documents()
+
+
+
+def _iter_yaml(fp):
+    # libyaml can only load whole documents, so a List document is held in
+    # memory until all its items have been consumed. Use json for huge dumps.
+    for document in yaml.load_all(fp, Loader=_SafeLoader):
+        if document is None:
+            continue
+        items = document.get('items') if isinstance(document, dict) else None
+        if isinstance(items, list):
+            context = {k: v for k,v in document.items() if k != 'items'}
+            # Free the items as they are consumed.
+            items.reverse()
+            while items:
+                yield items.pop(), context
+        else:
+            yield document, None
+
+
+
+def iter_documents(fp, format=None, chunk_size=CHUNK_SIZE):
+    """Yield the resource bodies of all documents in the given file like
+    object.
+
+    List documents are unpacked. Items of a List that have no apiVersion
+    and kind, like in List responses of the apiserver, get them from the
+    List.
+
+    format is 'json' or 'yaml', by default it is detected from the first
+    character of the stream.
+    """
+    if format is None:
+        prefix = fp.read(chunk_size)
+        start = prefix.lstrip()[:1]
+        if isinstance(start, bytes):
+            start = start.decode('ascii', 'replace')
+        format = 'json' if start in ('{', '[') else 'yaml'
+        fp = _Prefixed(prefix, fp)
+    if format == 'json':
+        documents = _iter_json(fp, chunk_size)
+    elif format == 'yaml':
+        documents = _iter_yaml(fp)
+    else:
+        raise ValueError(f'Invalid format: {format}')
+    for item, context in documents:
+        if context and isinstance(item, dict) and 'kind' not in item:
+            kind = context.get('kind') or ''
+            if kind.endswith('List'):
+                item.setdefault('apiVersion', context.get('apiVersion'))
+                item['kind'] = kind[:-len('List')]
+        yield item
+
+
+
+def _item_error(index, body, error):
+    if not isinstance(body, dict):
+        body = {}
+    metadata = body.get('metadata') or {}
+    return ItemError(index, body.get('apiVersion'), body.get('kind'),
+        metadata.get('namespace'), metadata.get('name'), error)
+
+
+
+def _parse_item(resource_class, body, trusted):
+    return parse(resource_class, body, trusted=trusted)
+
+
+
+def iter_from_stream(fp, format=None, trusted=None, errors=None,
+        skip_unknown=False, executor=None, window=None, chunk_size=CHUNK_SIZE):
+    """Parse the resources in the given file like object one by one and
+    yield them as instances of their registered resource classes.
+
+    See iter_documents for the supported formats. Models are not cached
+    as every object is only seen once.
+
+    trusted: see parsing.parse. Use trusted=False to check objects against
+      the models.
+    errors: if a list is given, items that fail to parse are appended to it
+      as ItemError instead of raising.
+    skip_unknown: skip items without a registered resource class.
+    executor: parse in this concurrent.futures.Executor. Use a
+      ProcessPoolExecutor to validate in parallel, the resource classes then
+      have to be importable by the workers.
+    window: maximum number of items that are parsed concurrently, defaults
+      to 4 per CPU, i.e. per worker of a default sized pool. Pass it for
+      executors of other sizes. Items are yielded in stream order.
+    """
+    bodies = enumerate(iter_documents(fp, format=format, chunk_size=chunk_size))
+    if executor is None:
+        for index, body in bodies:
+            try:
+                resource_class = _resource_class(body, skip_unknown)
+                if resource_class is None:
+                    continue
+                item = _parse_item(resource_class, body, trusted)
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.append(_item_error(index, body, e))
+                continue
+            yield item
+        return
+
+    if window is None:
+        window = 4 * (os.cpu_count() or 1)
+    pending = collections.deque()
+
+    def results(limit):
+        while len(pending) > limit:
+            index, body, future = pending.popleft()
+            try:
+                yield future.result()
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors.append(_item_error(index, body, e))
+
+    for index, body in bodies:
+        try:
+            resource_class = _resource_class(body, skip_unknown)
+        except Exception as e:
+            if errors is None:
+                raise
+            errors.append(_item_error(index, body, e))
+            continue
+        if resource_class is None:
+            continue
+        future = executor.submit(_parse_item, resource_class, body, trusted)
+        # Only keep the bodies around if they are needed for errors.
+        pending.append((index, body if errors is not None else None, future))
+        yield from results(window - 1)
+    yield from results(0)
+
+
+
+def _resource_class(body, skip_unknown):
+    try:
+        return ResourceRegistry.get(body['apiVersion'], body['kind'])
+    except ResourceNotFoundError:
+        if skip_unknown:
+            return None
+        raise
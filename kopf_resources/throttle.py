@@ -0,0 +1,195 @@
+"""Debouncing and concurrency limits for handlers, see the `debounce`
+and `concurrency` options of DecoratorWrapper.
+
+e.g.
+```
+    @HostCertificate.on.update(debounce=2.0, debounce_max_delay=30, concurrency=4)
+    async def update(body: HostCertificate, **_):
+        ...
+```
+"""
+import asyncio
+import collections
+import threading
+import time
+
+import kopf
+
+from . import metrics
+from .crd import content_hash
+
+
+
+class Debouncer():
+    """Coalesces bursts of changes per object.
+
+    The first call for an object, and any call after the object was quiet
+    for `window` seconds, is let through right away. Further changes within
+    the window are delayed until the object did not change for `window`
+    seconds, but at most `max_delay` seconds after the first delayed
+    change. Until then kopf.TemporaryError is raised with the remaining
+    time as delay. kopf then calls the handler again with the latest body,
+    changes in between are coalesced into that one call.
+
+    The delays are kopf.TemporaryError retries, so they count against the
+    retry and backoff settings of the handler, e.g. its `retries` and
+    `timeout` options, like any other retry.
+
+    A call that was let through is stale if a newer change of the object
+    was seen while it ran. verify then raises kopf.TemporaryError, so its
+    result is dropped and kopf calls the handler again with the latest
+    body.
+
+    Changes are detected by the spec and the labels, so the annotations
+    kopf stores its progress in do not restart the window.
+
+    max_delay: defaults to 10 times the window.
+    max_objects: number of objects to track, the least recently seen are
+      forgotten first and handled right away on their next call.
+    """
+
+    def __init__(self, window, max_delay=None, max_objects=65536):
+        self.window = window
+        self.max_delay = 10 * window if max_delay is None else max_delay
+        self.max_objects = max_objects
+        self.__lock = threading.Lock()
+        # object key -> (fingerprint, monotonic time of the last change or
+        # call, monotonic time of the first delayed change or None)
+        self.__seen = collections.OrderedDict()
+
+
+    @staticmethod
+    def fingerprint(body):
+        metadata = body.get('metadata') or {}
+        return content_hash([body.get('spec'), metadata.get('labels')])
+
+
+    def __store(self, key, fingerprint, last, pending):
+        seen = self.__seen
+        seen[key] = (fingerprint, last, pending)
+        seen.move_to_end(key)
+        while len(seen) > self.max_objects:
+            seen.popitem(last=False)
+
+
+    @staticmethod
+    def key(body):
+        metadata = body.get('metadata') or {}
+        return metadata.get('uid') or (metadata.get('namespace'), metadata.get('name'))
+
+
+    def remaining(self, body):
+        """Return the seconds to wait before the given body should be
+        handled, 0 if it can be handled now.
+        """
+        return self.__remaining(self.key(body), self.fingerprint(body))
+
+
+    def __remaining(self, key, fingerprint):
+        now = time.monotonic()
+        with self.__lock:
+            seen = self.__seen.get(key)
+            if seen is None:
+                self.__store(key, fingerprint, now, None)
+                return 0
+            last_fingerprint, last, pending = seen
+            if fingerprint != last_fingerprint:
+                if pending is None and now - last >= self.window:
+                    self.__store(key, fingerprint, now, None)
+                    return 0
+                if pending is None:
+                    pending = now
+                last = now
+                self.__store(key, fingerprint, last, pending)
+            elif pending is None:
+                # Nothing delayed, e.g. a retry of a failed call.
+                return 0
+            remaining = min(last + self.window, pending + self.max_delay) - now
+            if remaining <= 0:
+                self.__store(key, fingerprint, now, None)
+                return 0
+            return remaining
+
+
+    def check(self, body, handler_id=None):
+        """Raise kopf.TemporaryError if the given body should not be
+        handled yet. Otherwise return a token for verify.
+        """
+        key = self.key(body)
+        fingerprint = self.fingerprint(body)
+        remaining = self.__remaining(key, fingerprint)
+        if remaining > 0:
+            if metrics.active:
+                metrics.inc('kopf_resources_handler_debounced_total',
+                    dict(metrics.body_labels(body), handler=handler_id))
+            raise kopf.TemporaryError(f'Debouncing for {remaining:.2f}s.', delay=remaining)
+        return (key, fingerprint)
+
+
+    def verify(self, token):
+        """Raise kopf.TemporaryError if the object changed since check
+        returned token, e.g. while the handler ran.
+
+        The delay is the remaining time of the newer change.
+        """
+        key, fingerprint = token
+        with self.__lock:
+            seen = self.__seen.get(key)
+        if seen is None or seen[0] == fingerprint:
+            return
+        _, last, pending = seen
+        now = time.monotonic()
+        if pending is None:
+            remaining = 0
+        else:
+            remaining = max(min(last + self.window, pending + self.max_delay) - now, 0)
+        raise kopf.TemporaryError('Changed while handled, dropping the stale result.',
+            delay=remaining)
+
+
+
+class ConcurrencyLimit():
+    """Caps the number of concurrent handler calls.
+
+    Async and sync handlers share one asyncio.Semaphore of `limit`. Sync
+    handlers wait for it on the event loop before they are handed to an
+    executor, so waiting does not block the threads of the executor.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.__semaphore = None
+        self.__loop = None
+
+
+    def semaphore(self):
+        """Return the asyncio.Semaphore for the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        if self.__loop is not loop:
+            # Created lazily as semaphores are bound to a loop.
+            self.__semaphore = asyncio.Semaphore(self.limit)
+            self.__loop = loop
+        return self.__semaphore
+
+
+
+# resource fqname -> ConcurrencyLimit
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+
+def concurrency_limit(fqname, limit):
+    """Return the ConcurrencyLimit shared by all handlers of the given
+    resource, e.g. `hostcertificates.ssh-cert-manager.io`.
+
+    Raises ValueError if a different limit was already set for it.
+    """
+    with _limits_lock:
+        concurrency = _limits.get(fqname)
+        if concurrency is None:
+            concurrency = _limits[fqname] = ConcurrencyLimit(limit)
+        elif concurrency.limit != limit:
+            raise ValueError(f'Concurrency of {fqname} is already limited to {concurrency.limit}, not {limit}.')
+        return concurrency
@@ -0,0 +1,6 @@
+import os
+import sys
+
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'example')
+sys.path.insert(0, EXAMPLE_DIR)
@@ -0,0 +1,127 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+import kopf
+import pytest
+
+from kopf_resources import admission
+
+from resources import HostCertificate, Issuer
+
+
+
+def issuer(**metadata):
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'metadata': dict({'namespace': 'default'}, **metadata),
+        'spec': {'path': 'ssh', 'server': 'https://vault:8200', 'role': 'host'},
+    }
+
+
+
+def host_certificate(**spec):
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'HostCertificate',
+        'metadata': {'name': 'host', 'namespace': 'default'},
+        'spec': dict({'secretName': 'host', 'issuerRef': {'name': 'issuer', 'kind': 'Issuer'}}, **spec),
+    }
+
+
+
+def handlers(registry):
+    return {h.id: h.fn for h in registry._webhooks.get_all_handlers()}
+
+
+
+def test_validate_generate_name():
+    model = admission.validate(Issuer, issuer(generateName='issuer-'))
+    assert model.metadata.name is None
+    assert model.metadata.generateName == 'issuer-'
+
+
+
+def test_validate_name():
+    model = admission.validate(Issuer, issuer(name='issuer'))
+    assert model.metadata.name == 'issuer'
+
+
+
+def test_defaults_patch():
+    body = host_certificate(principals=['host.example.com'])
+    assert admission.defaults_patch(HostCertificate, body) == {
+        'spec': {'keyTypes': [], 'extensions': {}, 'criticalOptions': {}},
+    }
+    ops = admission.defaults_json_patch(HostCertificate, body)
+    assert sorted(ops, key=lambda op: op['path']) == [
+        {'op': 'add', 'path': '/spec/criticalOptions', 'value': {}},
+        {'op': 'add', 'path': '/spec/extensions', 'value': {}},
+        {'op': 'add', 'path': '/spec/keyTypes', 'value': []},
+    ]
+    complete = host_certificate(principals=[], keyTypes=[], extensions={}, criticalOptions={})
+    assert admission.defaults_patch(HostCertificate, complete) == {}
+
+
+
+def test_register():
+    registry = kopf.OperatorRegistry()
+    admission.register(HostCertificate, registry=registry)
+    fns = handlers(registry)
+    validate = fns['validate-hostcertificates.ssh-cert-manager.io']
+    mutate = fns['mutate-hostcertificates.ssh-cert-manager.io']
+
+    asyncio.run(validate(body=host_certificate()))
+    with pytest.raises(kopf.AdmissionError) as e:
+        asyncio.run(validate(body=host_certificate(principals='not a list')))
+    assert e.value.code == 422
+
+    patch = {}
+    asyncio.run(mutate(body=host_certificate(), patch=patch))
+    assert set(patch['spec']) == {'principals', 'keyTypes', 'extensions', 'criticalOptions'}
+
+
+
+def test_register_only_validate():
+    registry = kopf.OperatorRegistry()
+    admission.register(Issuer, mutate=False, registry=registry)
+    assert list(handlers(registry)) == ['validate-issuers.ssh-cert-manager.io']
+
+
+
+def test_timeout(monkeypatch):
+    def slow_validate(resource_class, body):
+        time.sleep(0.2)
+    monkeypatch.setattr(admission, 'validate', slow_validate)
+    registry = kopf.OperatorRegistry()
+    admission.register(Issuer, mutate=False, timeout=0.01, registry=registry)
+    validate, = handlers(registry).values()
+    with pytest.raises(kopf.AdmissionError) as e:
+        asyncio.run(validate(body=issuer(name='issuer')))
+    assert e.value.code == 503
+
+
+
+def test_concurrency():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    async def main():
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            limiter = admission._Limiter(concurrency=2, executor=executor)
+            await asyncio.gather(*(limiter.run(work) for _ in range(8)))
+
+    asyncio.run(main())
+    assert len(peak) == 8
+    assert max(peak) == 2
@@ -0,0 +1,82 @@
+import pytest
+
+from kopf_resources import cache as cache_module
+from kopf_resources import from_dict, ModelCache, parse_cached
+
+from resources import Issuer
+
+
+
+def issuer(uid='1', resource_version='1', server='https://vault:8200'):
+    metadata = {'name': 'issuer', 'namespace': 'default'}
+    if uid:
+        metadata['uid'] = uid
+    if resource_version:
+        metadata['resourceVersion'] = resource_version
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'metadata': metadata,
+        'spec': {'path': 'ssh', 'server': server, 'role': 'host'},
+    }
+
+
+
+def test_hit():
+    cache = ModelCache()
+    model = cache.parse(Issuer, issuer())
+    assert cache.parse(Issuer, issuer()) is model
+    assert cache.parse(Issuer, issuer(resource_version='2')) is not model
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+
+def test_lru_eviction():
+    cache = ModelCache(maxsize=2)
+    first = cache.parse(Issuer, issuer(uid='1'))
+    cache.parse(Issuer, issuer(uid='2'))
+    # Use the first, so the second is the least recently used one.
+    assert cache.parse(Issuer, issuer(uid='1')) is first
+    cache.parse(Issuer, issuer(uid='3'))
+    assert len(cache) == 2
+    assert cache.parse(Issuer, issuer(uid='1')) is first
+    assert cache.get(ModelCache.key(issuer(uid='2')) + (Issuer, None)) is None
+
+
+
+def test_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(cache_module.time, 'monotonic', lambda: now[0])
+    cache = ModelCache(ttl=10)
+    model = cache.parse(Issuer, issuer())
+    now[0] += 9
+    assert cache.parse(Issuer, issuer()) is model
+    now[0] += 2
+    assert cache.parse(Issuer, issuer()) is not model
+
+
+
+def test_trusted_and_validated_kept_apart():
+    cache = ModelCache()
+    validated = parse_cached(Issuer, issuer(), trusted=False, cache=cache)
+    trusted = parse_cached(Issuer, issuer(), trusted=True, cache=cache)
+    assert trusted is not validated
+    assert parse_cached(Issuer, issuer(), trusted=False, cache=cache) is validated
+    assert parse_cached(Issuer, issuer(), trusted=True, cache=cache) is trusted
+
+
+
+@pytest.mark.parametrize('body', [issuer(uid=None), issuer(resource_version=None)])
+def test_not_cached_without_uid_or_resource_version(body):
+    cache = ModelCache()
+    assert ModelCache.key(body) is None
+    assert cache.parse(Issuer, body) is not cache.parse(Issuer, body)
+    assert len(cache) == 0
+
+
+
+def test_from_dict_not_shared_by_default():
+    model = from_dict(issuer(uid='from-dict'))
+    model.spec.server = 'changed'
+    assert from_dict(issuer(uid='from-dict')).spec.server == 'https://vault:8200'
+    assert from_dict(issuer(uid='from-dict'), cache=True) is from_dict(issuer(uid='from-dict'), cache=True)
@@ -0,0 +1,38 @@
+import os
+
+from kopf_resources import cli
+
+from conftest import EXAMPLE_DIR
+
+
+
+RESOURCES = os.path.join(EXAMPLE_DIR, 'resources.py')
+
+
+
+def test_check_stale_files(tmp_path, capsys):
+    output_dir = str(tmp_path / 'crds')
+    assert cli.main([RESOURCES, '-o', output_dir, '--no-cache']) == 0
+    assert cli.main([RESOURCES, '-o', output_dir, '--no-cache', '--check']) == 0
+    stale = tmp_path / 'crds' / 'removed.ssh-cert-manager.io.yaml'
+    stale.write_text('')
+    capsys.readouterr()
+    assert cli.main([RESOURCES, '-o', output_dir, '--no-cache', '--check']) == 1
+    assert str(stale) in capsys.readouterr().out
+
+
+
+def test_check_not_a_directory(tmp_path):
+    path = tmp_path / 'file'
+    path.write_text('')
+    assert cli.main([RESOURCES, '-o', str(path), '--no-cache', '--check']) == 2
+
+
+
+def test_library_hash_covers_package(monkeypatch):
+    library_hash = cli._library_hash()
+    interning = os.path.join(os.path.dirname(cli.__file__), 'interning.py')
+    file_hash = cli._file_hash
+    monkeypatch.setattr(cli, '_file_hash',
+        lambda path: 'changed' if path == interning else file_hash(path))
+    assert cli._library_hash() != library_hash
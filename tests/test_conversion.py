@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from kopf_resources import as_crd, cli, webhook_conversion
+from kopf_resources.conversion import converter, ConversionRegistry, ConversionWebhookServer, review
+
+from conftest import EXAMPLE_DIR
+from resources import HostCertificate, HostCertificateV1alpha2, Issuer
+
+
+
+RESOURCES = os.path.join(EXAMPLE_DIR, 'resources.py')
+
+
+
+@pytest.fixture
+def converters():
+    @converter(HostCertificateV1alpha2, HostCertificate)
+    def v1alpha2_to_v1(body):
+        body['spec'].setdefault('extensions', {})
+        return body
+
+    @converter(HostCertificate, HostCertificateV1alpha2)
+    def v1_to_v1alpha2(body):
+        body['spec'].pop('extensions', None)
+        return body
+
+    yield
+    ConversionRegistry.clear()
+
+
+
+def host_certificate(api_version, name, **spec):
+    return {
+        'apiVersion': api_version,
+        'kind': 'HostCertificate',
+        'metadata': {'name': name, 'namespace': 'default'},
+        'spec': dict({'secretName': name, 'issuerRef': {'name': 'issuer'}}, **spec),
+    }
+
+
+
+def post(conversion_review):
+    async def _post():
+        async with TestClient(TestServer(ConversionWebhookServer().make_app())) as client:
+            response = await client.post('/convert', json=conversion_review)
+            assert response.status == 200
+            return await response.json()
+    return asyncio.run(_post())
+
+
+
+def test_conversion_review(converters):
+    result = post({
+        'apiVersion': 'apiextensions.k8s.io/v1',
+        'kind': 'ConversionReview',
+        'request': {
+            'uid': '705ab4f5-6393-11e8-b7cc-42010a800002',
+            'desiredAPIVersion': 'ssh-cert-manager.io/v1',
+            'objects': [
+                host_certificate('ssh-cert-manager.io/v1alpha2', 'old'),
+                host_certificate('ssh-cert-manager.io/v1', 'new', extensions={'a': 'b'}),
+            ],
+        },
+    })
+    assert result['kind'] == 'ConversionReview'
+    response = result['response']
+    assert response['uid'] == '705ab4f5-6393-11e8-b7cc-42010a800002'
+    assert response['result'] == {'status': 'Success'}
+    assert response['convertedObjects'] == [
+        host_certificate('ssh-cert-manager.io/v1', 'old', extensions={}),
+        host_certificate('ssh-cert-manager.io/v1', 'new', extensions={'a': 'b'}),
+    ]
+
+
+
+def test_conversion_review_down(converters):
+    result = post({
+        'apiVersion': 'apiextensions.k8s.io/v1',
+        'kind': 'ConversionReview',
+        'request': {
+            'uid': '1',
+            'desiredAPIVersion': 'ssh-cert-manager.io/v1alpha2',
+            'objects': [host_certificate('ssh-cert-manager.io/v1', 'new', extensions={'a': 'b'})],
+        },
+    })
+    assert result['response']['convertedObjects'] == [
+        host_certificate('ssh-cert-manager.io/v1alpha2', 'new'),
+    ]
+
+
+
+def test_conversion_review_failed():
+    result = post({
+        'apiVersion': 'apiextensions.k8s.io/v1',
+        'kind': 'ConversionReview',
+        'request': {
+            'uid': '2',
+            'desiredAPIVersion': 'ssh-cert-manager.io/v1alpha2',
+            'objects': [host_certificate('ssh-cert-manager.io/v1', 'new')],
+        },
+    })
+    response = result['response']
+    assert response['uid'] == '2'
+    assert response['convertedObjects'] == []
+    assert response['result']['status'] == 'Failed'
+    assert 'ConversionNotFoundError' in response['result']['message']
+
+
+
+@pytest.mark.parametrize('data', [[], 'x'])
+def test_conversion_review_not_an_object(data):
+    async def _post():
+        async with TestClient(TestServer(ConversionWebhookServer().make_app())) as client:
+            response = await client.post('/convert', json=data)
+            return response.status
+    assert asyncio.run(_post()) == 400
+    assert review(data)['response']['result']['status'] == 'Failed'
+
+
+
+def test_webhook_conversion_in_crd():
+    conversion = webhook_conversion(service={'namespace': 'operators', 'name': 'ssh-cert-manager'})
+    crd = as_crd(HostCertificate, conversion=conversion)
+    assert crd['spec']['conversion'] == {
+        'strategy': 'Webhook',
+        'webhook': {
+            'clientConfig': {'service': {'namespace': 'operators', 'name': 'ssh-cert-manager', 'path': '/convert'}},
+            'conversionReviewVersions': ['v1'],
+        },
+    }
+    # Nothing to convert with a single version.
+    assert 'conversion' not in as_crd(Issuer, conversion=conversion)
+
+
+
+def test_cli_conversion_service(capsys):
+    assert cli.main([RESOURCES, '--no-cache', '--format', 'json',
+        '--conversion-service', 'operators/ssh-cert-manager:8443']) == 0
+    crds = {crd['metadata']['name']: crd for crd in json.loads(capsys.readouterr().out)['items']}
+    service = crds['hostcertificates.ssh-cert-manager.io']['spec']['conversion']['webhook']['clientConfig']['service']
+    assert service == {'namespace': 'operators', 'name': 'ssh-cert-manager', 'port': 8443, 'path': '/convert'}
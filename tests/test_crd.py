@@ -0,0 +1,27 @@
+import pytest
+
+from kopf_resources import as_crd, crd_size, CRDSizeError, CRDSizeWarning
+
+from resources import HostCertificate
+
+
+
+def test_version_budget():
+    sizes = crd_size(as_crd(HostCertificate))['versions']
+    smallest, largest = min(sizes.values()), max(sizes.values())
+    assert smallest < largest
+    as_crd(HostCertificate, version_budget=largest)
+    with pytest.raises(CRDSizeError, match='v1'):
+        as_crd(HostCertificate, version_budget=largest - 1)
+    with pytest.warns(CRDSizeWarning):
+        as_crd(HostCertificate, version_budget=smallest - 1, budget_action='warn')
+
+
+
+def test_budget():
+    size = crd_size(as_crd(HostCertificate))['total']
+    as_crd(HostCertificate, budget=size)
+    with pytest.raises(CRDSizeError):
+        as_crd(HostCertificate, budget=size - 1)
+    # Compaction brings it below the budget.
+    as_crd(HostCertificate, budget=size - 1, descriptions=False)
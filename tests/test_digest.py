@@ -0,0 +1,71 @@
+import kopf
+
+from kopf._cogs.configs.diffbase import AnnotationsDiffBaseStorage
+from kopf._cogs.structs.bodies import Body
+
+from kopf_resources.digest import DigestGuard
+
+from resources import Issuer
+
+
+
+def issuer(annotations=None, server='https://vault:8200'):
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'metadata': {'name': 'issuer', 'namespace': 'default', 'annotations': annotations or {}},
+        'spec': {'path': 'ssh', 'server': server, 'role': 'host'},
+    }
+
+
+
+def test_stored_digest_is_not_a_change():
+    guard = DigestGuard('reconcile')
+    body = issuer()
+    value = guard.check(body)
+    patch = {}
+    guard.store(patch, value)
+
+    stored = issuer(annotations=patch['metadata']['annotations'])
+    assert guard.check(stored) is None
+    storage = AnnotationsDiffBaseStorage()
+    assert storage.build(body=Body(stored)) == storage.build(body=Body(body))
+    assert guard.check(issuer(annotations=patch['metadata']['annotations'], server='other')) is not None
+
+
+
+def test_status_key():
+    guard = DigestGuard('reconcile', key='status.digest')
+    patch = {}
+    guard.store(patch, guard.check(issuer()))
+    assert list(patch) == ['status']
+
+
+
+def test_stacked_handler_ids():
+    registry = kopf.OperatorRegistry()
+    with_registry = dict(registry=registry, digest=True)
+
+    @Issuer.on.update(id='outer', **with_registry)
+    @Issuer.on.create(id='inner', **with_registry)
+    def reconcile(**_):
+        pass
+
+    handlers = {h.id: h.fn for h in registry._changing.get_all_handlers()}
+    assert handlers['outer'] is not handlers['inner']
+    assert handlers['outer'].__kopf_resources_handler_id__ == 'outer'
+    assert handlers['inner'].__kopf_resources_handler_id__ == 'inner'
+
+
+
+def test_stacked_shared_wrapper():
+    registry = kopf.OperatorRegistry()
+
+    @Issuer.on.update(registry=registry, digest=True)
+    @Issuer.on.create(registry=registry, digest=True)
+    def reconcile(**_):
+        pass
+
+    handlers = registry._changing.get_all_handlers()
+    assert len(handlers) == 2
+    assert handlers[0].fn is handlers[1].fn
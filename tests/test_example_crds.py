@@ -0,0 +1,22 @@
+import os
+import subprocess
+import sys
+
+import pydantic
+import pytest
+
+from conftest import EXAMPLE_DIR
+
+
+
+@pytest.mark.parametrize('backend', ['pydantic_v1', 'pydantic_v2'])
+def test_example_crds(backend):
+    if backend == 'pydantic_v2' and pydantic.VERSION.startswith('1.'):
+        pytest.skip('pydantic v2 is not installed')
+    env = dict(os.environ, KOPF_RESOURCES_BACKEND=backend,
+        PYTHONPATH=os.pathsep.join(filter(None, [os.path.join(EXAMPLE_DIR, '..'), os.environ.get('PYTHONPATH')])))
+    # In a new process as the backend is selected on import.
+    output = subprocess.run([sys.executable, 'resources.py'], cwd=EXAMPLE_DIR, env=env,
+        stdout=subprocess.PIPE, check=True).stdout.decode('utf-8')
+    with open(os.path.join(EXAMPLE_DIR, 'crds.yaml')) as fp:
+        assert output == fp.read()
@@ -0,0 +1,105 @@
+import asyncio
+
+from kopf_resources import CompactIndex, ResourceIndex
+from kopf_resources.replay import FakeIndex
+
+from resources import Issuer, ClusterIssuer
+
+
+
+def issuer(name, namespace=None, server='https://vault:8200', uid=None, resource_version='1'):
+    kind = 'Issuer' if namespace else 'ClusterIssuer'
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': kind,
+        'metadata': {
+            'name': name,
+            'namespace': namespace,
+            'uid': uid or f'{kind}-{namespace}-{name}',
+            'resourceVersion': resource_version,
+            'labels': {'team': 'ops'},
+        },
+        'spec': {'path': 'ssh', 'server': server, 'role': 'host'},
+    }
+
+
+
+def fill(index, *bodies):
+    fake = FakeIndex()
+    for body in bodies:
+        fake.replace(body['metadata']['uid'], asyncio.run(index.handler(body)))
+    return fake
+
+
+
+def test_projection_get():
+    index = CompactIndex('issuers', fields=('spec.server', 'metadata.labels'))
+    projection = index.project(issuer('a', 'default'))
+    assert projection.get('spec.server') == 'https://vault:8200'
+    assert projection.get('metadata.labels') == {'team': 'ops'}
+    assert projection.get('spec.role') is None
+    assert projection.get('spec.role', 'default') == 'default'
+    assert projection.server == 'https://vault:8200'
+
+
+
+def test_only_projected_paths_are_stored():
+    index = CompactIndex('issuers', fields=('spec.server', 'spec.missing'))
+    projection = index.project(issuer('a', 'default'))
+    assert projection.as_dict() == {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'spec': {'server': 'https://vault:8200'},
+    }
+    model = projection.model()
+    assert isinstance(model, Issuer)
+    assert model.spec.server == 'https://vault:8200'
+
+
+
+def test_compact_index_memoizes_models():
+    index = CompactIndex('issuers', fields=('spec.server', 'metadata.labels'))
+    fake = fill(index, issuer('a', 'default'))
+    model = index.get(fake, ('default', 'a'))
+    assert model.spec.server == 'https://vault:8200'
+    assert index.get(fake, ('default', 'a')) is model
+    assert index.get_all(fake, ('default', 'a')) == [model]
+    assert index.get_all(fake, ('default', 'a'))[0] is model
+    assert index.get(fake, ('default', 'missing')) is None
+
+    # A new resourceVersion builds a new model.
+    fake.replace('Issuer-default-a', asyncio.run(index.handler(
+        issuer('a', 'default', server='https://other:8200', resource_version='2'))))
+    updated = index.get(fake, ('default', 'a'))
+    assert updated is not model
+    assert updated.spec.server == 'https://other:8200'
+
+
+
+def test_memo_is_shared_with_resource_index():
+    index = CompactIndex('issuers', fields=('spec.server',))
+    fake = fill(index, issuer('a', 'default'))
+    model = index.get(fake, ('default', 'a'))
+    assert ResourceIndex[Issuer, ClusterIssuer](fake).one(('default', 'a')) is model
+
+
+
+def test_lookup_falls_back_to_cluster_scope():
+    index = CompactIndex('issuers', fields=('spec.server',))
+    fake = fill(index,
+        issuer('shared', 'default', server='https://namespaced:8200'),
+        issuer('shared', server='https://cluster:8200'),
+        issuer('global', server='https://global:8200'),
+    )
+    issuers = ResourceIndex[Issuer, ClusterIssuer](fake)
+
+    assert issuers.lookup('default', 'shared').spec.server == 'https://namespaced:8200'
+    assert issuers.lookup('other', 'shared').spec.server == 'https://cluster:8200'
+    assert issuers.lookup('default', 'global').spec.server == 'https://global:8200'
+    assert issuers.lookup(None, 'shared').spec.server == 'https://cluster:8200'
+    assert issuers.lookup('default', 'missing') is None
+
+    # With a kind only the scope of that kind is searched.
+    assert issuers.lookup('default', 'shared', kind='ClusterIssuer').spec.server == 'https://cluster:8200'
+    assert issuers.lookup('default', 'global', kind='Issuer') is None
+    assert isinstance(issuers.lookup('default', 'global', kind='ClusterIssuer'), ClusterIssuer)
@@ -0,0 +1,43 @@
+import sys
+
+from kopf_resources import from_dict
+
+from resources import Issuer
+
+
+
+def issuer(**metadata):
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'metadata': dict({'name': 'issuer', 'namespace': 'default'}, **metadata),
+        'spec': {'path': 'ssh', 'server': 'https://vault:8200', 'role': 'host'},
+    }
+
+
+
+def test_mutable_defaults():
+    model = from_dict(issuer(), cache=False)
+    model.metadata.labels['app'] = 'ssh'
+    model.metadata.finalizers.append('ssh-cert-manager.io/cleanup')
+    other = from_dict(issuer(), cache=False)
+    assert other.metadata.labels == {}
+    assert other.metadata.finalizers == []
+
+
+
+def test_mutable_empty_values():
+    model = from_dict(issuer(labels={}, annotations={}), cache=False)
+    model.metadata.labels['app'] = 'ssh'
+    model.metadata.annotations['a'] = 'b'
+    assert from_dict(issuer(labels={}), cache=False).metadata.labels == {}
+
+
+
+def test_interned():
+    namespace = ''.join(['team', '-', 'a'])
+    label = ''.join(['app', '.io/name'])
+    model = from_dict(issuer(namespace=namespace, labels={label: 'ssh'}), cache=False)
+    assert model.metadata.namespace is sys.intern('team-a')
+    key, = model.metadata.labels
+    assert key is sys.intern('app.io/name')
@@ -0,0 +1,29 @@
+from kopf_resources import from_dict, LazyResource
+
+from resources import Issuer
+
+
+
+def issuer():
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'metadata': {'name': 'issuer', 'namespace': 'default'},
+        'spec': {'path': 'ssh', 'server': 'https://vault:8200', 'role': 'host'},
+    }
+
+
+
+def test_lazy_fields():
+    lazy = from_dict(issuer(), lazy=True)
+    assert type(lazy) is LazyResource[Issuer]
+    assert lazy.metadata.name == 'issuer'
+    assert lazy.spec.server == 'https://vault:8200'
+
+
+
+def test_lazy_is_not_a_resource_instance():
+    lazy = LazyResource[Issuer](issuer())
+    assert not isinstance(lazy, Issuer)
+    assert lazy.resource_class is Issuer
+    assert isinstance(lazy.model(), Issuer)
@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from kopf_resources import metrics
+
+
+
+@pytest.fixture
+def sink():
+    sink = metrics.set_sink(metrics.PrometheusSink())
+    yield sink
+    metrics.set_sink(None)
+
+
+
+@pytest.fixture
+def profiler():
+    slow_calls = []
+    profiler = metrics.set_profiler(metrics.SlowCallProfiler(threshold=0.0,
+        interval=0.001, callback=lambda *args: slow_calls.append(args)))
+    profiler.slow_calls = slow_calls
+    yield profiler
+    metrics.set_profiler(None)
+
+
+
+def profiler_threads():
+    return [t for t in threading.enumerate() if t.name == 'kopf_resources-profiler']
+
+
+
+def errors(sink):
+    return [line for line in sink.render().splitlines()
+        if line.startswith('kopf_resources_handler_errors_total{')]
+
+
+
+def call(args, kwargs):
+    raise kwargs['error']
+
+
+
+async def call_async(args, kwargs):
+    raise kwargs['error']
+
+
+
+def test_errors_are_counted(sink):
+    with pytest.raises(ValueError):
+        metrics.measure('handler', call, (), {'error': ValueError()})
+    with pytest.raises(ValueError):
+        asyncio.run(metrics.measure_async('handler', call_async, (), {'error': ValueError()}))
+    assert errors(sink) == [
+        'kopf_resources_handler_errors_total{api_version="",kind="",handler="handler",exception="ValueError"} 2',
+    ]
+    assert 'kopf_resources_handler_seconds_count{api_version="",kind="",handler="handler"} 2' in sink.render()
+
+
+
+def test_cancellations_are_not_counted(sink, profiler):
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(metrics.measure_async('handler', call_async, (), {'error': asyncio.CancelledError()}))
+    with pytest.raises(KeyboardInterrupt):
+        metrics.measure('handler', call, (), {'error': KeyboardInterrupt()})
+    assert errors(sink) == []
+    # The calls are still ended.
+    assert [handler_id for handler_id, *_ in profiler.slow_calls] == ['handler', 'handler']
+
+
+
+def test_profiler_samples_calls(profiler):
+    def slow(args, kwargs):
+        time.sleep(0.05)
+    metrics.measure('slow', slow, (), {})
+    [(handler_id, seconds, samples)] = profiler.slow_calls
+    assert handler_id == 'slow'
+    assert seconds >= 0.05
+    assert any(name == 'slow' for stack in samples for _, _, name in stack)
+
+
+
+def test_profiler_parks_without_calls(profiler, monkeypatch):
+    sleeps = []
+    sleep = time.sleep
+    monkeypatch.setattr(metrics.time, 'sleep', lambda seconds: (sleeps.append(seconds), sleep(seconds)))
+    profiler.end(profiler.begin(), 'handler', 0.0)
+    sleep(0.05)
+    parked = len(sleeps)
+    sleep(0.05)
+    assert len(sleeps) == parked
+    assert len(profiler_threads()) == 1
+
+
+
+def test_profiler_stop(profiler):
+    profiler.end(profiler.begin(), 'handler', 0.0)
+    assert len(profiler_threads()) == 1
+    profiler.stop()
+    assert profiler_threads() == []
+    # The next sampled call starts it again.
+    profiler.end(profiler.begin(), 'handler', 0.0)
+    assert len(profiler_threads()) == 1
+    metrics.set_profiler(None)
+    assert profiler_threads() == []
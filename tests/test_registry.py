@@ -0,0 +1,108 @@
+import importlib.metadata
+
+import pytest
+
+from kopf_resources import ResourceRegistry, ResourceNotFoundError
+
+from resources import Issuer, HostCertificate, HostCertificateV1alpha2
+
+
+
+RESOURCE_MODULE = '''
+from kopf_resources import Resource
+
+class {kind}(Resource, group={group!r}, version='v1', scope='Namespaced'):
+    pass
+'''
+
+
+
+def write_module(path, name, group, kind):
+    path.joinpath(f'{name}.py').write_text(RESOURCE_MODULE.format(group=group, kind=kind))
+
+
+
+def test_get_by_api_version_and_kind():
+    assert ResourceRegistry.get('ssh-cert-manager.io/v1', 'Issuer') is Issuer
+    assert ResourceRegistry.get('ssh-cert-manager.io/v1alpha2', 'HostCertificate') is HostCertificateV1alpha2
+    with pytest.raises(ResourceNotFoundError):
+        ResourceRegistry.get('ssh-cert-manager.io/v1', 'Missing')
+
+
+
+def test_get_by_group_and_plural():
+    assert ResourceRegistry.get_plural('ssh-cert-manager.io', 'issuers') is Issuer
+    # Without a version the storage version is returned.
+    assert ResourceRegistry.get_plural('ssh-cert-manager.io', 'hostcertificates') is HostCertificate
+    assert ResourceRegistry.get_plural('ssh-cert-manager.io', 'hostcertificates', 'v1alpha2') is HostCertificateV1alpha2
+    with pytest.raises(ResourceNotFoundError):
+        ResourceRegistry.get_plural('ssh-cert-manager.io', 'missings')
+
+
+
+def test_get_by_fqname():
+    assert ResourceRegistry.get_version('hostcertificates.ssh-cert-manager.io', 'v1') is HostCertificate
+    with pytest.raises(ResourceNotFoundError, match='missings.ssh-cert-manager.io, v1'):
+        ResourceRegistry.get_version('missings.ssh-cert-manager.io', 'v1')
+    with pytest.raises(ResourceNotFoundError, match='issuers.ssh-cert-manager.io, v2'):
+        ResourceRegistry.get_version('issuers.ssh-cert-manager.io', 'v2')
+
+
+
+def test_iter_versions():
+    assert dict(ResourceRegistry.iter_versions(HostCertificate)) == {
+        'v1': HostCertificate,
+        'v1alpha2': HostCertificateV1alpha2,
+    }
+
+
+
+def test_iter_versions_of_unknown_resource():
+    class Unknown():
+        __fqname__ = 'unknowns.registry.example.com'
+        __group__ = 'registry.example.com'
+    with pytest.raises(ResourceNotFoundError, match='unknowns.registry.example.com'):
+        ResourceRegistry.iter_versions(Unknown)
+
+
+
+def test_lazy_loading(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    write_module(tmp_path, 'registry_lazy', 'lazy.registry.example.com', 'Widget')
+    ResourceRegistry.add_lazy('lazy.registry.example.com', 'registry_lazy')
+    resource_class = ResourceRegistry.get('lazy.registry.example.com/v1', 'Widget')
+    assert resource_class.__module__ == 'registry_lazy'
+    assert ResourceRegistry.get_plural('lazy.registry.example.com', 'widgets') is resource_class
+
+
+
+def test_failed_lazy_import_is_retried(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    ResourceRegistry.add_lazy('retry.registry.example.com', 'registry_retry')
+    with pytest.raises(ImportError):
+        ResourceRegistry.get('retry.registry.example.com/v1', 'Gadget')
+
+    write_module(tmp_path, 'registry_retry', 'retry.registry.example.com', 'Gadget')
+    importlib.invalidate_caches()
+    resource_class = ResourceRegistry.get('retry.registry.example.com/v1', 'Gadget')
+    assert resource_class.__module__ == 'registry_retry'
+
+
+
+def test_entry_point_loading(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    write_module(tmp_path, 'registry_plugin', 'plugin.registry.example.com', 'Gizmo')
+    entry_point = importlib.metadata.EntryPoint(
+        name='plugin.registry.example.com',
+        value='registry_plugin:Gizmo',
+        group='kopf_resources.resources',
+    )
+
+    class EntryPoints():
+        def select(self, group):
+            return [entry_point] if group == entry_point.group else []
+
+    monkeypatch.setattr(importlib.metadata, 'entry_points', EntryPoints)
+    ResourceRegistry.load_entry_points()
+    resource_class = ResourceRegistry.get_version('gizmos.plugin.registry.example.com', 'v1')
+    assert resource_class.__module__ == 'registry_plugin'
@@ -0,0 +1,42 @@
+import kopf
+import pytest
+
+from kopf_resources import replay
+from kopf_resources.resources import DecoratorWrapper
+
+from resources import Issuer
+
+
+
+@pytest.fixture
+def not_recording(monkeypatch):
+    monkeypatch.setattr(replay, '_registrations', None)
+    monkeypatch.setattr(DecoratorWrapper, 'registration_hook', None)
+
+
+
+def test_not_recorded_by_default(not_recording):
+    @Issuer.on.create(registry=kopf.OperatorRegistry())
+    def create(**_):
+        pass
+
+    assert replay._registrations is None
+    with pytest.raises(ValueError):
+        replay.FakeDispatcher()
+
+
+
+def test_record(not_recording):
+    registrations = replay.record()
+    assert replay.record() is registrations
+
+    @Issuer.on.create(registry=kopf.OperatorRegistry())
+    def create(body: Issuer, **_):
+        return body.spec.server
+
+    registration, = registrations
+    assert registration.name == 'create'
+    assert registration.args == ('ssh-cert-manager.io', 'v1', 'issuers')
+    body, = replay.synthesize(Issuer, 1)
+    stats = replay.replay([replay.Event('create', body)])
+    assert stats.events == 1
@@ -0,0 +1,61 @@
+import kopf
+import pytest
+
+from kopf_resources import sharding
+
+from resources import Issuer
+
+
+
+def body(**metadata):
+    return {'metadata': dict({'namespace': 'default'}, **metadata)}
+
+
+
+def test_shard_of_without_name():
+    assert sharding.shard_of(body(generateName='issuer-'), 4) == sharding.shard_of(body(name='issuer-'), 4)
+    assert 0 <= sharding.shard_of(body(), 4) < 4
+    assert sharding.shard_of(body(name='issuer'), 4, key='uid') == sharding.shard_of(body(name='issuer'), 4)
+
+
+
+def test_uid_labels_rejected():
+    with pytest.raises(ValueError):
+        sharding.ShardConfig(2, 0, key='uid', mode='labels')
+    with pytest.raises(ValueError):
+        sharding.assign_shard_labels(Issuer, shards=2, key='uid')
+
+
+
+def test_assign_shard_labels_generate_name():
+    registry = kopf.OperatorRegistry()
+    sharding.assign_shard_labels(Issuer, shards=2, registry=registry)
+    handler, = registry._webhooks.get_all_handlers()
+    patch = {}
+    handler.fn(body=body(generateName='issuer-'), patch=patch)
+    assert patch['metadata']['labels'][sharding.SHARD_LABEL] in ('0', '1')
+
+
+
+def test_index_not_sharded_by_default(monkeypatch):
+    monkeypatch.setattr(sharding, '_config', sharding.ShardConfig(2, 0))
+    monkeypatch.setattr(sharding, '_configured', True)
+    registry = kopf.OperatorRegistry()
+
+    @Issuer.on.index(registry=registry, id='unsharded')
+    def unsharded(**_):
+        pass
+
+    @Issuer.on.index(registry=registry, id='sharded', shard=True)
+    def sharded(**_):
+        pass
+
+    @Issuer.on.create(registry=registry)
+    def create(**_):
+        pass
+
+    handlers = {h.id: h for h in registry._indexing.get_all_handlers()}
+    assert handlers['unsharded'].when is None
+    assert handlers['sharded'].when is not None
+    create_handler, = registry._changing.get_all_handlers()
+    assert create_handler.when is not None
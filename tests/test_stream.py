@@ -0,0 +1,80 @@
+import concurrent.futures
+import io
+import json
+
+from kopf_resources import stream
+
+from resources import Issuer
+
+
+
+def issuer(name, typed=True):
+    body = {
+        'metadata': {'name': name, 'namespace': 'default'},
+        'spec': {'path': 'ssh', 'server': 'https://vault:8200', 'role': 'host'},
+    }
+    if typed:
+        body.update(apiVersion='ssh-cert-manager.io/v1', kind='Issuer')
+    return body
+
+
+
+def dump(typed=True, sort_keys=False):
+    data = {
+        'kind': 'IssuerList',
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'metadata': {'resourceVersion': '1'},
+        'items': [issuer(f'issuer-{i}', typed) for i in range(3)],
+    }
+    return json.dumps(data, sort_keys=sort_keys)
+
+
+
+def names(data, **kwargs):
+    return [r.metadata.name for r in stream.iter_from_stream(io.StringIO(data), chunk_size=16, **kwargs)]
+
+
+
+def test_list_kind_after_items():
+    # Key sorted, e.g. kubectl get -o json, the items come before the kind.
+    errors = []
+    assert names(dump(typed=False, sort_keys=True), errors=errors) == ['issuer-0', 'issuer-1', 'issuer-2']
+    assert errors == []
+    assert all(isinstance(r, Issuer)
+        for r in stream.iter_from_stream(io.StringIO(dump(typed=False, sort_keys=True))))
+
+
+
+def test_list_kind_before_items():
+    assert names(dump(typed=False)) == ['issuer-0', 'issuer-1', 'issuer-2']
+    assert names(dump(sort_keys=True)) == ['issuer-0', 'issuer-1', 'issuer-2']
+
+
+
+def test_executor_window():
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        assert names(dump(), executor=executor) == ['issuer-0', 'issuer-1', 'issuer-2']
+        assert names(dump(), executor=executor, window=1) == ['issuer-0', 'issuer-1', 'issuer-2']
+
+
+
+def test_consumer_errors_are_not_collected():
+    errors = []
+    items = stream.iter_from_stream(io.StringIO(dump()), chunk_size=16, errors=errors)
+    next(items)
+    try:
+        items.throw(RuntimeError('consumer failed'))
+    except RuntimeError:
+        pass
+    else:
+        raise AssertionError('the error of the consumer was swallowed')
+    assert errors == []
+
+
+
+def test_parse_errors_are_collected():
+    data = json.loads(dump())
+    del data['items'][1]['spec']['server']
+    errors = []
+    assert names(json.dumps(data), errors=errors, trusted=False) == ['issuer-0', 'issuer-2']
+    assert [e.index for e in errors] == [1]
@@ -0,0 +1,162 @@
+import asyncio
+import concurrent.futures
+import inspect
+import threading
+import time
+import types
+
+import kopf
+import pytest
+
+from kopf_resources import throttle
+
+from resources import ClusterIssuer, Issuer
+
+
+
+def issuer(server='https://vault:8200', uid='1'):
+    return {
+        'apiVersion': 'ssh-cert-manager.io/v1',
+        'kind': 'Issuer',
+        'metadata': {'name': 'issuer', 'namespace': 'default', 'uid': uid},
+        'spec': {'path': 'ssh', 'server': server, 'role': 'host'},
+    }
+
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(throttle.time, 'monotonic', lambda: now[0])
+    return now
+
+
+
+def test_debounce_leading_edge(clock):
+    debouncer = throttle.Debouncer(2)
+    assert debouncer.remaining(issuer()) == 0
+    clock[0] += 0.5
+    assert debouncer.remaining(issuer('a')) == 2
+    clock[0] += 1
+    assert debouncer.remaining(issuer('b')) == 2
+    # The retry of the delayed call.
+    clock[0] += 1
+    assert debouncer.remaining(issuer('b')) == 1
+    clock[0] += 1
+    assert debouncer.remaining(issuer('b')) == 0
+    # Quiet for the window, handled right away.
+    clock[0] += 2
+    assert debouncer.remaining(issuer('c')) == 0
+    assert debouncer.remaining(issuer('c', uid='2')) == 0
+
+
+
+def test_debounce_max_delay(clock):
+    debouncer = throttle.Debouncer(2, max_delay=3)
+    assert debouncer.remaining(issuer()) == 0
+    for i in range(4):
+        clock[0] += 1
+        debouncer.remaining(issuer(str(i)))
+    # First delayed change at 101, so due at 104 at the latest.
+    assert clock[0] == 104
+    assert debouncer.remaining(issuer('3')) == 0
+
+
+
+def test_debounce_check(clock):
+    debouncer = throttle.Debouncer(2)
+    debouncer.check(issuer())
+    with pytest.raises(kopf.TemporaryError) as e:
+        debouncer.check(issuer('a'))
+    assert e.value.delay == 2
+
+
+
+def test_sync_concurrency_does_not_block_executor():
+    registry = kopf.OperatorRegistry()
+    running = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+    finished = {}
+
+    @Issuer.on.update(registry=registry, id='limited', concurrency=1)
+    def limited(body, **_):
+        with lock:
+            running.append(1)
+            assert len(running) == 1
+        time.sleep(0.1)
+        with lock:
+            running.pop()
+        finished.setdefault('limited', time.perf_counter() - started)
+
+    @ClusterIssuer.on.update(registry=registry, id='other', executor=None)
+    def other(body, **_):
+        finished['other'] = time.perf_counter() - started
+
+    limited_wrapper, = [h.fn for h in registry._changing.get_all_handlers() if h.id == 'limited']
+    other_wrapper, = [h.fn for h in registry._changing.get_all_handlers() if h.id == 'other']
+    assert inspect.iscoroutinefunction(limited_wrapper)
+
+    async def main():
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            settings = types.SimpleNamespace(execution=types.SimpleNamespace(executor=executor))
+            loop = asyncio.get_running_loop()
+            calls = [limited_wrapper(body=issuer(uid=str(i)), settings=settings) for i in range(3)]
+            tasks = [asyncio.ensure_future(call) for call in calls]
+            await asyncio.sleep(0.01)
+            await loop.run_in_executor(executor, lambda: other_wrapper(body=issuer()))
+            await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    # Waiting limited calls do not hold executor threads.
+    assert finished['other'] < finished['limited']
+
+
+
+def test_debounce_verify(clock):
+    debouncer = throttle.Debouncer(2)
+    token = debouncer.check(issuer())
+    debouncer.verify(token)
+    # A newer change seen while the first call ran.
+    clock[0] += 0.5
+    with pytest.raises(kopf.TemporaryError):
+        debouncer.check(issuer('a'))
+    clock[0] += 0.5
+    with pytest.raises(kopf.TemporaryError) as e:
+        debouncer.verify(token)
+    assert e.value.delay == 1.5
+
+
+
+def test_stale_call_is_dropped():
+    registry = kopf.OperatorRegistry()
+    release = asyncio.Event()
+    calls = []
+
+    @Issuer.on.update(registry=registry, id='debounced', debounce=2, digest=True)
+    async def debounced(body, **_):
+        calls.append(body['spec']['server'])
+        if len(calls) == 1:
+            await release.wait()
+        return 'done'
+
+    wrapper, = [h.fn for h in registry._changing.get_all_handlers() if h.id == 'debounced']
+
+    async def main():
+        first_patch, second_patch = {}, {}
+        first = asyncio.ensure_future(wrapper(body=issuer(), patch=first_patch))
+        await asyncio.sleep(0)
+        with pytest.raises(kopf.TemporaryError):
+            await wrapper(body=issuer('a'), patch=second_patch)
+        release.set()
+        with pytest.raises(kopf.TemporaryError, match='stale'):
+            await first
+        # The digest of the stale call is not stored, only that of a
+        # current one.
+        assert first_patch == {}
+        patch = {}
+        assert await wrapper(body=issuer(uid='2'), patch=patch) == 'done'
+        assert patch
+
+    asyncio.run(main())
+    assert calls == ['https://vault:8200', 'https://vault:8200']